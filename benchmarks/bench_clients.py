@@ -0,0 +1,179 @@
+"""
+Load benchmark of the clients against the local stand-in server (see benchmarks/server.py).  For each client and
+number of positions, measures the throughput, the p50/p99 latency of the calls and the peak memory, and writes one
+JSON object per run so that regressions can be tracked.
+
+Usage: python -m benchmarks.bench_clients --positions 1 100 10000 --latency 0.05 --jitter 0.02 --output results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import random
+import socket
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, UTC
+from typing import List, Tuple
+
+import aiohttp
+
+from benchmarks.server import create_app
+from src.open_irceline import (IrcelineRioClient, IrcelineRioIfdmClient, IrcelineForecastClient, RioFeature,
+                               RioIfdmFeature, ForecastFeature, RequestLimiter, __version__)
+
+_hosts = ('https://geo.irceline.be', 'https://geobelair.irceline.be')
+
+
+class _LocalSession:
+    """Send the requests of the clients to the local stand-in server instead of the IRCEL - CELINE servers"""
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str) -> None:
+        self._session = session
+        self._base_url = base_url
+
+    async def request(self, method: str, url: str, **kwargs):
+        for host in _hosts:
+            if url.startswith(host):
+                url = self._base_url + url[len(host):]
+        return await self._session.request(method, url, **kwargs)
+
+
+def _run_server(port: int, latency: float, jitter: float, error_rate: float) -> None:
+    from aiohttp import web
+    web.run_app(create_app(latency, jitter, error_rate, seed=42), host='127.0.0.1', port=port, print=None)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Stand-in server did not start on port {port}")
+
+
+def _positions(n: int) -> List[Tuple[float, float]]:
+    rng = random.Random(n)
+    return [(rng.uniform(49.6, 51.4), rng.uniform(2.6, 6.3)) for _ in range(n)]
+
+
+async def _timed(coroutine, latencies: list):
+    start = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        latencies.append(time.perf_counter() - start)
+
+
+async def _scenario(name: str, session, positions: list, limiter: RequestLimiter, latencies: list) -> None:
+    if name == 'rio':
+        client = IrcelineRioClient(session, limiter=limiter)
+        features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN, RioFeature.PM10_HMEAN, RioFeature.PM25_HMEAN]
+        await asyncio.gather(*[_timed(client.get_data(features, p), latencies) for p in positions],
+                             return_exceptions=True)
+    elif name == 'rio_many':
+        client = IrcelineRioClient(session, limiter=limiter)
+        features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN, RioFeature.PM10_HMEAN, RioFeature.PM25_HMEAN]
+        await asyncio.gather(_timed(client.get_data_many(features, positions), latencies), return_exceptions=True)
+    elif name == 'rio_ifdm':
+        client = IrcelineRioIfdmClient(session, limiter=limiter)
+        features = [RioIfdmFeature.NO2_HMEAN, RioIfdmFeature.O3_HMEAN, RioIfdmFeature.PM10_HMEAN,
+                    RioIfdmFeature.PM25_HMEAN]
+        await asyncio.gather(*[_timed(client.get_data(features, p), latencies) for p in positions],
+                             return_exceptions=True)
+    elif name == 'forecast':
+        client = IrcelineForecastClient(session, limiter=limiter)
+        features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN, ForecastFeature.PM10_DMEAN]
+        await asyncio.gather(*[_timed(client.get_data(features, p), latencies) for p in positions],
+                             return_exceptions=True)
+    elif name == 'forecast_raster':
+        client = IrcelineForecastClient(session, limiter=limiter)
+        features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN, ForecastFeature.PM10_DMEAN]
+        await asyncio.gather(_timed(client.get_data_many(features, positions), latencies), return_exceptions=True)
+    else:
+        raise ValueError(f"Unknown scenario {name}")
+
+
+async def _run(name: str, n: int, port: int, max_in_flight: int) -> dict:
+    positions = _positions(n)
+    latencies = list()
+    base_url = f'http://127.0.0.1:{port}'
+    connector = aiohttp.TCPConnector(limit=max_in_flight * 2)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with session.get(f'{base_url}/stats') as r:
+            before = await r.json()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        await _scenario(name, _LocalSession(session, base_url), positions,
+                        RequestLimiter(max_in_flight=max_in_flight, backoff=0.05), latencies)
+        duration = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        async with session.get(f'{base_url}/stats') as r:
+            after = await r.json()
+
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {'client': name,
+            'positions': n,
+            'duration_s': round(duration, 6),
+            'positions_per_s': round(n / duration, 3),
+            'requests': after['requests'] - before['requests'],
+            'server_errors': after['errors'] - before['errors'],
+            'requests_per_s': round((after['requests'] - before['requests']) / duration, 3),
+            'latency_p50_s': round(quantiles[49], 6),
+            'latency_p99_s': round(quantiles[98], 6),
+            'peak_memory_bytes': peak}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', nargs='+', default=['rio', 'rio_many', 'rio_ifdm', 'forecast', 'forecast_raster'])
+    parser.add_argument('--positions', nargs='+', type=int, default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--max-in-flight', type=int, default=32)
+    parser.add_argument('--output', default=None, help="file to append the JSON lines to, stdout if not set")
+    args = parser.parse_args()
+
+    port = _free_port()
+    server = multiprocessing.Process(target=_run_server, args=(port, args.latency, args.jitter, args.error_rate),
+                                     daemon=True)
+    server.start()
+    try:
+        _wait_for_port(port)
+        run = {'date': datetime.now(UTC).isoformat(),
+               'version': __version__,
+               'python': platform.python_version(),
+               'latency_s': args.latency,
+               'jitter_s': args.jitter,
+               'error_rate': args.error_rate,
+               'max_in_flight': args.max_in_flight}
+        for name in args.clients:
+            for n in args.positions:
+                line = json.dumps(run | asyncio.run(_run(name, n, port, args.max_in_flight)))
+                if args.output is None:
+                    print(line, flush=True)
+                else:
+                    with open(args.output, 'a') as file:
+                        file.write(line + '\n')
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Microbenchmark of the EPSG:4326 -> EPSG:31370 coordinate transformation.
+Prints the per-point cost of the scalar, memoized scalar, list and NumPy paths for 1, 1k and 100k points.
+The list column passes a list to epsg_transform_many, which transforms the points one by one; the NumPy column passes
+an array of shape (n, 2), which is transformed with vectorized NumPy operations (n/a if NumPy is not installed).
+The memoized column looks up the same points again, drawn from at most as many distinct points as the cache of
+epsg_transform holds (16384): with more distinct points than that, every lookup misses and the memoized cost is the
+scalar cost.
+
+Usage: python -m benchmarks.bench_epsg_transform
+"""
+import random
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from src.open_irceline.utils import epsg_transform, epsg_transform_many, _epsg_transform_cached
+
+
+def _positions(n: int, distinct: int | None = None) -> list:
+    """
+    :return: n random positions, drawn from a pool of distinct positions (n by default)
+    """
+    rng = random.Random(42)
+    pool = [(rng.uniform(49.5, 51.5), rng.uniform(2.5, 6.4)) for _ in range(distinct or n)]
+    return pool if distinct is None else [rng.choice(pool) for _ in range(n)]
+
+
+def _per_point(fn, positions: list) -> float:
+    start = time.perf_counter()
+    fn(positions)
+    return (time.perf_counter() - start) / len(positions) * 1e6
+
+
+def main() -> None:
+    cache_size = _epsg_transform_cached.cache_info().maxsize
+    print(f"{'points':>8} {'scalar (µs)':>12} {'memoized (µs)':>14} {'list (µs)':>10} {'NumPy (µs)':>11}")
+    for n in [1, 1_000, 100_000]:
+        positions = _positions(n)
+        _epsg_transform_cached.cache_clear()
+        scalar = _per_point(lambda p: [epsg_transform(x) for x in p], positions)
+        # Repeated lookups of points that fit in the cache, warmed up by a first pass
+        repeated = _positions(n, min(n, cache_size))
+        for x in repeated:
+            epsg_transform(x)
+        memoized = _per_point(lambda p: [epsg_transform(x) for x in p], repeated)
+        listed = _per_point(epsg_transform_many, positions)
+        vectorized = f"{_per_point(epsg_transform_many, np.array(positions)):.2f}" if np is not None else 'n/a'
+        print(f"{n:>8} {scalar:>12.2f} {memoized:>14.2f} {listed:>10.2f} {vectorized:>11}")
+
+
+if __name__ == '__main__':
+    main()
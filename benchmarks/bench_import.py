@@ -0,0 +1,49 @@
+"""
+Benchmark of the cost of importing the package in a fresh interpreter, compared with an empty interpreter and with the
+pyproj transformer that used to be built at import time.  Prints the median wall time and the peak resident memory of
+each variant.
+
+Usage: python -m benchmarks.bench_import --runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+_variants = {
+    'python': "pass",
+    'open_irceline': "import src.open_irceline",
+    'open_irceline + epsg_transform': ("from src.open_irceline.utils import epsg_transform; "
+                                       "epsg_transform((50.85, 4.35))"),
+    'pyproj transformer': "from pyproj import Transformer; Transformer.from_crs('EPSG:4326', 'EPSG:31370')",
+}
+
+_report = "import resource, sys; sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))"
+
+
+def _run(code: str) -> tuple:
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', f"{code}\n{_report}"], check=True, capture_output=True, text=True)
+    return time.perf_counter() - start, int(out.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'variant':<32} {'time (ms)':>10} {'max RSS (MiB)':>14}")
+    for name, code in _variants.items():
+        try:
+            runs = [_run(code) for _ in range(args.runs)]
+        except subprocess.CalledProcessError:
+            print(f"{name:<32} {'n/a':>10} {'n/a':>14}")
+            continue
+        duration = statistics.median(r[0] for r in runs) * 1000
+        rss = statistics.median(r[1] for r in runs) / 1024
+        print(f"{name:<32} {duration:>10.1f} {rss:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
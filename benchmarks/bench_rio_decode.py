@@ -0,0 +1,88 @@
+"""
+Benchmark of the decoding of large RIO WFS responses: JSON decoding and IrcelineRioClient._format_result, compared to
+the previous implementation of _format_result.
+
+Usage: python -m benchmarks.bench_rio_decode
+"""
+import gc
+import json
+import time
+from datetime import datetime, date, timedelta, UTC
+
+from src.open_irceline import IrcelineRioClient, RioFeature
+from src.open_irceline.utils import json_loads
+
+
+def _payload(features: list, cells: int, days: int) -> bytes:
+    start = datetime(2024, 6, 1, tzinfo=UTC)
+    result = list()
+    for feature in features:
+        name = feature.split(':')[1]
+        for cell in range(cells):
+            x, y = 22000 + 4000 * (cell % 70), 20000 + 4000 * (cell // 70)
+            for hour in range(24 * days):
+                result.append({
+                    "type": "Feature",
+                    "id": f"{name}.fid-280be381_1901cca3e5c_{len(result):x}",
+                    "geometry": {"type": "Polygon",
+                                 "coordinates": [[[x, y], [x, y + 4000], [x + 4000, y + 4000], [x + 4000, y],
+                                                  [x, y]]]},
+                    "geometry_name": "the_geom",
+                    "properties": {"id": cell,
+                                   "timestamp": (start + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                   "value": hour % 50,
+                                   "network": "Wallonia"}})
+    return json.dumps({"type": "FeatureCollection", "features": result}).encode()
+
+
+def _previous_format_result(prefix: str, data: dict, features: list) -> dict:
+    features_api = data.get('features', [])
+    result = dict()
+    for f in features_api:
+        props = f.get('properties', {})
+        if f.get('id', None) is None or props.get('value', None) is None:
+            continue
+        if props.get('timestamp', None) is None and props.get('date', None) is None:
+            continue
+        try:
+            if 'timestamp' in props.keys():
+                timestamp = datetime.fromisoformat(props.get('timestamp'))
+            else:
+                timestamp = date.fromisoformat(props.get('date')[:-1])
+            value = float(props.get('value'))
+        except (TypeError, ValueError):
+            continue
+        name = f"{prefix}:{f.get('id').split('.')[0]}"
+        if name not in [f'{f}' for f in features]:
+            continue
+        if name not in result or result[name]['timestamp'] < timestamp:
+            result[name] = dict(timestamp=timestamp, value=value)
+    return result
+
+
+def _timed(fn, *args) -> tuple:
+    gc.collect()
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN, RioFeature.PM10_HMEAN, RioFeature.PM25_HMEAN,
+                RioFeature.BC_HMEAN]
+    print(f"JSON decoder: {json_loads.__module__}")
+    print(f"{'features':>9} {'MB':>6} {'json (ms)':>10} {'fast json (ms)':>15} {'previous (ms)':>14} "
+          f"{'format (ms)':>12}")
+    for cells, days in [(1, 7), (1, 31), (10, 31), (50, 31)]:
+        payload = _payload(features, cells, days)
+        fast_ms = _timed(json_loads, payload)[1]
+        data, json_ms = _timed(json.loads, payload)
+        previous, previous_ms = _timed(_previous_format_result, 'rio', data, features)
+        result, format_ms = _timed(IrcelineRioClient._format_result, 'rio', data, features)
+        assert previous == result
+        print(f"{len(data['features']):>9} {len(payload) / 1e6:>6.1f} {json_ms:>10.1f} {fast_ms:>15.1f} "
+              f"{previous_ms:>14.1f} {format_ms:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Local stand-in for the IRCEL - CELINE WFS, WMS and WCS endpoints, built from the test fixtures, with configurable
+latency, jitter and error rate.
+
+Usage: python -m benchmarks.server --port 8080 --latency 0.05 --jitter 0.02 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+from math import floor
+
+from aiohttp import web
+
+_fixtures = 'tests/fixtures'
+_cell_size = 4000
+_point = re.compile(r'\(?(-?\d+(?:\.\d+)?) (-?\d+(?:\.\d+)?)\)?')
+
+
+def _fixture(name: str) -> str:
+    with open(f'{_fixtures}/{name}', 'r') as file:
+        return file.read()
+
+
+def _cell_features(type_names: list, x: float, y: float, timestamps: list) -> list:
+    x0, y0 = floor(x / _cell_size) * _cell_size, floor(y / _cell_size) * _cell_size
+    result = list()
+    for type_name in type_names:
+        name = type_name.split(':')[-1]
+        for k, timestamp in enumerate(timestamps):
+            result.append({
+                "type": "Feature",
+                "id": f"{name}.fid-{x0:x}_{y0:x}_{k}",
+                "geometry": {"type": "Polygon",
+                             "coordinates": [[[x0, y0], [x0, y0 + _cell_size], [x0 + _cell_size, y0 + _cell_size],
+                                              [x0 + _cell_size, y0], [x0, y0]]]},
+                "geometry_name": "the_geom",
+                "properties": {"id": (x0 // _cell_size) * 1000 + y0 // _cell_size,
+                               "timestamp": timestamp,
+                               "value": (x0 + y0) // _cell_size % 50 + k,
+                               "network": "Wallonia"}})
+    return result
+
+
+async def _wfs(request: web.Request) -> web.Response:
+    if request.query.get('request') == 'GetCapabilities':
+        return web.Response(text=_fixture('rio_capabilities.xml'), content_type='text/xml')
+
+    type_names = request.query.get('typeName', '').split(',')
+    cql_filter = request.query.get('cql_filter', '')
+    points = _point.findall(cql_filter[cql_filter.find('POINT'):]) if 'POINT' in cql_filter else []
+    cells = {(floor(float(x) / _cell_size), floor(float(y) / _cell_size)): (float(x), float(y)) for x, y in points}
+
+    features = list()
+    for x, y in cells.values():
+        features += _cell_features(type_names, x, y, ["2024-06-15T15:00:00Z", "2024-06-15T16:00:00Z"])
+
+    start = int(request.query.get('startIndex', 0))
+    count = int(request.query.get('count', len(features)))
+    features = features[start:start + count]
+    return web.json_response({"type": "FeatureCollection",
+                              "features": features,
+                              "totalFeatures": len(features),
+                              "numberMatched": len(features),
+                              "numberReturned": len(features),
+                              "timeStamp": "2024-06-15T16:55:03.419Z",
+                              "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::31370"}}})
+
+
+def _wms(capabilities: str, feature_info: str):
+    async def handler(request: web.Request) -> web.Response:
+        if request.query.get('request') == 'GetCapabilities':
+            return web.Response(text=_fixture(capabilities), content_type='application/vnd.ogc.wms_xml')
+        return web.Response(text=_fixture(feature_info), content_type='application/json')
+
+    return handler
+
+
+async def _wcs(request: web.Request) -> web.Response:
+    bbox = request.query.get('bbox', '2.5,49.45,6.45,51.55')
+    lon_min, lat_min, lon_max, lat_max = (float(v) for v in bbox.split(','))
+    resolution = float(request.query.get('resx', '0.01'))
+    ncols, nrows = round((lon_max - lon_min) / resolution), round((lat_max - lat_min) / resolution)
+    lines = [f"NCOLS {ncols}", f"NROWS {nrows}", f"XLLCORNER {lon_min}", f"YLLCORNER {lat_min}",
+             f"CELLSIZE {resolution}", "NODATA_VALUE -9999"]
+    lines += [" ".join(f"{(r + c) % 100 / 2}" for c in range(ncols)) for r in range(nrows)]
+    return web.Response(text="\n".join(lines), content_type='text/plain')
+
+
+def create_app(latency: float = 0., jitter: float = 0., error_rate: float = 0., seed: int | None = None
+               ) -> web.Application:
+    """
+    Create the stand-in server application
+    :param latency: delay in seconds added to every response
+    :param jitter: maximum random delay in seconds added on top of the latency
+    :param error_rate: probability of answering with a 503 error
+    :param seed: seed of the random generator, for reproducible runs
+    :return: aiohttp application serving /wfs, /forecast/wms, /forecast/wcs and /rioifdm/wms
+    """
+    rng = random.Random(seed)
+    stats = {'requests': 0, 'errors': 0}
+
+    @web.middleware
+    async def degrade(request: web.Request, handler):
+        if request.path == '/stats':
+            return await handler(request)
+        stats['requests'] += 1
+        await asyncio.sleep(latency + rng.uniform(0, jitter))
+        if rng.random() < error_rate:
+            stats['errors'] += 1
+            raise web.HTTPServiceUnavailable()
+        return await handler(request)
+
+    async def get_stats(_: web.Request) -> web.Response:
+        return web.Response(text=json.dumps(stats), content_type='application/json')
+
+    app = web.Application(middlewares=[degrade])
+    app.router.add_get('/wfs', _wfs)
+    app.router.add_get('/forecast/wms', _wms('forecast_wms_capabilities.xml', 'forecast_wms_feature_info.json'))
+    app.router.add_get('/forecast/wcs', _wcs)
+    app.router.add_get('/rioifdm/wms', _wms('rio_ifdm_capabilities.xml', 'ifdm_interpolation_feature_info.json'))
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--jitter', type=float, default=0.)
+    parser.add_argument('--error-rate', type=float, default=0.)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    web.run_app(create_app(args.latency, args.jitter, args.error_rate, args.seed), host=args.host, port=args.port,
+                print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 from .api import IrcelineApiError
-from .data import RioFeature, ForecastFeature, FeatureValue, RioIfdmFeature
+from .belaqi import belaqi_index, belaqi_index_many, belaqi_index_from_result, belaqi_index_table
+from .cache import RioCellCache, ResponseCache, SqliteCache
+from .data import RioFeature, ForecastFeature, FeatureValue, RioIfdmFeature, TimeSeries, FeatureTable, BelAqiIndex
 from .forecast import IrcelineForecastClient
+from .grid import RegularGrid
+from .limiter import RequestLimiter, CircuitBreaker
+from .metrics import Instrumentation, MetricsCollector, RequestRecord
 from .rio import IrcelineRioClient, IrcelineRioIfdmClient
+from .scheduler import PrefetchScheduler, Subscription
+from .session import create_session, irceline_session, warm_up
+from .transport import Transport, RecordingTransport, ReplayTransport
 
 __version__ = '3.0.2'
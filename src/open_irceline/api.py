@@ -1,18 +1,32 @@
 import asyncio
+import json
 import socket
+import time
 from abc import ABC, abstractmethod
-from typing import Tuple, List, Set
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial
+from itertools import count
+from typing import Tuple, List, Set, Callable, Any, Dict, Hashable, AsyncIterator, Iterable, Awaitable
+from urllib.parse import urlencode
 from xml.etree import ElementTree
 
 import aiohttp
 import async_timeout
 from aiohttp import ClientResponse
+from multidict import CIMultiDict
 
-from .data import IrcelineFeature
+from .cache import ResponseCache, SqliteCache
+from .data import IrcelineFeature, FeatureValue
+from .limiter import RequestLimiter, CircuitBreaker
+from .metrics import Instrumentation, RequestRecord
+from .transport import Transport, _BufferedResponse
 
 _rio_wfs_base_url = 'https://geo.irceline.be/wfs'
 _forecast_wms_base_url = 'https://geo.irceline.be/forecast/wms'
+_forecast_wcs_base_url = 'https://geo.irceline.be/forecast/wcs'
 _rio_ifdm_wms_base_url = 'https://geobelair.irceline.be/rioifdm/wms'
+_rio_ifdm_wcs_base_url = 'https://geobelair.irceline.be/rioifdm/wcs'
 _user_agent = 'github.com/jdejaegh/python-irceline'
 
 
@@ -20,9 +34,126 @@ class IrcelineApiError(Exception):
     """Exception to indicate an API error."""
 
 
+class _InstrumentedResponse(_BufferedResponse):
+    """Buffered response reporting the time spent decoding its body to the instrumentation"""
+
+    def __init__(self, status: int, headers: dict, body: bytes, record: RequestRecord,
+                 instrumentation: Instrumentation) -> None:
+        super().__init__(status, headers, body)
+        self._record = record
+        self._instrumentation = instrumentation
+
+    async def text(self, encoding: str | None = None) -> str:
+        start = time.perf_counter()
+        try:
+            return await super().text(encoding)
+        finally:
+            self._parsed(start)
+
+    async def json(self, *, encoding: str | None = None, loads: Callable[[str], Any] = json.loads, **_) -> Any:
+        start = time.perf_counter()
+        try:
+            return await super().json(encoding=encoding, loads=loads)
+        finally:
+            self._parsed(start)
+
+    def _parsed(self, start: float) -> None:
+        self._record.parse = time.perf_counter() - start
+        self._instrumentation.on_parse(self._record)
+
+
+class _CapabilitiesParser:
+    """
+    Incremental parser of GetCapabilities XML documents keeping only the text of the elements matching the path.
+    Elements are discarded as soon as they are parsed so that the memory used does not depend on the document size.
+    """
+
+    def __init__(self, path: Tuple[str, ...]) -> None:
+        """
+        :param path: tags of the wanted elements and of their ancestors, e.g. ('Layer', 'Name') for the Name children
+            of Layer elements, at any depth in the document
+        """
+        self._path = list(path)
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self._stack: List[str] = list()
+        self._names: Set[str] = set()
+        self._error = False
+
+    def feed(self, data: str | bytes) -> None:
+        if self._error:
+            return
+        try:
+            self._parser.feed(data)
+            self._read_events()
+        except ElementTree.ParseError:
+            self._error = True
+
+    def close(self) -> Set[str]:
+        """
+        :return: set of texts of the elements matching the path, empty set if the document is not valid
+        """
+        if not self._error:
+            try:
+                self._parser.close()
+                self._read_events()
+            except ElementTree.ParseError:
+                self._error = True
+        return set() if self._error else self._names
+
+    def _read_events(self) -> None:
+        n = len(self._path)
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                self._stack.append(elem.tag)
+                continue
+            # The root element is not considered by the path, as with './/' in ElementTree.findall
+            if len(self._stack) > n and self._stack[-n:] == self._path and elem.text is not None:
+                self._names.add(elem.text)
+            self._stack.pop()
+            elem.clear()
+
+
 class IrcelineBaseClient(ABC):
-    def __init__(self, session: aiohttp.ClientSession) -> None:
+    # Publication period of the data in seconds, cached responses expire at the end of the period
+    _cache_period = 3600
+
+    def __init__(self,
+                 session: aiohttp.ClientSession,
+                 cache: ResponseCache | None = None,
+                 limiter: RequestLimiter | None = None,
+                 instrumentation: Instrumentation | None = None,
+                 disk_cache: SqliteCache | None = None,
+                 transport: Transport | None = None,
+                 breaker: CircuitBreaker | None = None) -> None:
+        """
+        :param session: aiohttp session to use for the requests, can be None when a transport is set
+        :param cache: optional cache of the responses, shared by identical concurrent requests
+        :param limiter: optional limiter of the concurrency and rate of the requests, retrying throttled requests
+        :param instrumentation: optional hooks receiving the measures of every request and the errors replaced by
+            missing values.  When set, the body of every response is read before being returned.
+        :param disk_cache: optional on-disk cache of the responses, that can be shared by several processes.  When both
+            caches are set, the disk cache is only read upon a miss of the in-process cache.
+        :param transport: optional transport sending the requests instead of the session, e.g. to record the responses
+            or to replay them offline (see RecordingTransport and ReplayTransport)
+        :param breaker: optional circuit breaker, failing the requests immediately while the server is degraded.
+            Combine it with a ResponseCache with max_stale to keep serving the last values during the incident.
+        """
         self._session = session
+        self._transport = transport if transport is not None else session
+        self._cache = cache
+        self._disk_cache = disk_cache
+        self._limiter = limiter
+        self._instrumentation = instrumentation
+        self._breaker = breaker
+        # (feature names, ETag, Last-Modified) of the last GetCapabilities response
+        self._capabilities: Tuple[Set[str], str | None, str | None] | None = None
+
+    @property
+    def cache_period(self) -> int:
+        """
+        :return: publication period of the data in seconds, cached responses expire at the end of the period
+        """
+        return self._cache_period
 
     @abstractmethod
     async def get_data(self,
@@ -34,34 +165,202 @@ class IrcelineBaseClient(ABC):
     def get_capabilities(self) -> Set[str]:
         pass
 
-    async def _api_wrapper(self, url: str, querystring: dict = None, headers: dict = None, method: str = 'GET'):
+    async def _api_wrapper(self, url: str, querystring: dict = None, headers: dict = None, method: str = 'GET',
+                           fetch: Callable[[], Awaitable[_BufferedResponse]] | None = None):
         """
-        Call the URL with the specified query string. Raises exception for >= 400 response code
+        Call the URL with the specified query string. Raises exception for >= 400 response code.  If a cache is set,
+        the response is served from the cache when possible and its body is read before being returned.  A stale
+        response served by the cache has its stale_age set.
         :param url: base URL
         :param querystring: dict to build the query string
+        :param fetch: coroutine function getting the response, with its body read, upon a miss of the in-process cache
+            instead of the disk cache and the API (e.g. to read and store the content in the disk cache by cell)
         :return: response from the client
         """
+        if self._cache is None and self._disk_cache is None and fetch is None:
+            return await self._request(url, querystring, headers, method)
+
+        key = (method, url, tuple(sorted((querystring or dict()).items())))
+        if fetch is None:
+            fetch = partial(self._fetch_buffered, key, querystring, headers)
+        if self._cache is None:
+            return await fetch()
+        r, age = await self._cache.get_or_fetch_stale(key, self._cache_period, fetch, self._stale_key(key))
+        if age is not None:
+            # The cached response is shared, mark a copy of it
+            r = _BufferedResponse(r.status, r.headers, r.body)
+            r.stale_age = age
+        return r
+
+    def _stale_key(self, key: tuple) -> Hashable:
+        """
+        Key of the requests whose responses can be served as stale responses for the request, see
+        ResponseCache.get_or_fetch_stale
+        :param key: (method, URL, sorted query string items) of the request
+        :return: stale key, the key itself by default
+        """
+        return key
+
+    @staticmethod
+    def _stale_age(response) -> float | None:
+        """
+        :return: age in seconds of the response if it is a stale response served from the cache, None otherwise
+        """
+        return response.stale_age if isinstance(response, _BufferedResponse) else None
+
+    @staticmethod
+    def _mark_stale(response, values: Iterable[FeatureValue]) -> None:
+        """
+        Set the stale_age of the values read from a stale response
+        :param response: response the values were read from
+        :param values: FeatureValue to mark
+        """
+        age = IrcelineBaseClient._stale_age(response)
+        if age is not None:
+            for value in values:
+                value['stale_age'] = age
+
+    async def _fetch_buffered(self, key: tuple, querystring: dict | None, headers: dict | None) -> _BufferedResponse:
+        """
+        Get the response from the disk cache if it is set and contains it, from the API otherwise
+        :param key: (method, URL, sorted query string items) of the request
+        :param querystring: dict to build the query string
+        :param headers: headers of the request
+        :return: response with its body already read
+        """
+        method, url, items = key
+        if self._disk_cache is None:
+            return await self._request(url, querystring, headers, method, buffered=True)
+
+        disk_key = f"{method} {url}?{urlencode(items)}"
+        stored = await asyncio.to_thread(self._disk_cache.get, disk_key)
+        if stored is not None:
+            status, stored_headers, body = stored
+            return _BufferedResponse(status, CIMultiDict(stored_headers), body)
+
+        r = await self._request(url, querystring, headers, method, buffered=True)
+        await asyncio.to_thread(self._disk_cache.put, disk_key, self._cache_period, r.status,
+                                list(r.headers.items()), r.body)
+        return r
+
+    async def _get_capabilities(self, url: str, querystring: dict, path: Tuple[str, ...]) -> Set[str]:
+        """
+        Fetch the GetCapabilities document and extract the feature names from it.  The names are kept in memory and the
+        document is only downloaded and parsed again if it changed since the last call (ETag or Last-Modified).
+        :param url: base URL
+        :param querystring: dict to build the query string
+        :param path: tags of the name elements and of their ancestors, see _CapabilitiesParser
+        :return: set of feature names
+        """
+        headers = dict()
+        if self._capabilities is not None:
+            _, etag, last_modified = self._capabilities
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+        # The response cache is bypassed as a 304 response is only meaningful for this client
+        r: ClientResponse = await self._request(url, querystring, headers)
+        if r.status == 304 and self._capabilities is not None:
+            r.release()
+            return set(self._capabilities[0])
+
+        parser = _CapabilitiesParser(path)
+        if isinstance(r, ClientResponse):
+            async for chunk in r.content.iter_chunked(65536):
+                parser.feed(chunk)
+        else:
+            parser.feed(await r.text())
+        names = parser.close()
+
+        self._capabilities = (names, r.headers.get('ETag', None), r.headers.get('Last-Modified', None))
+        return set(names)
+
+    async def _request(self, url: str, querystring: dict = None, headers: dict = None, method: str = 'GET',
+                       buffered: bool = False):
+        if self._breaker is not None and not self._breaker.allow(url):
+            raise IrcelineApiError("Circuit open, request not sent")
         if headers is None:
             headers = dict()
         if 'User-Agent' not in headers:
             headers |= {'User-Agent': _user_agent}
-        try:
-            async with async_timeout.timeout(60):
-                response = await self._session.request(
-                    method=method,
-                    url=url,
-                    params=querystring,
-                    headers=headers
-                )
-                response.raise_for_status()
-                return response
-
-        except asyncio.TimeoutError as exception:
-            raise IrcelineApiError("Timeout error fetching information") from exception
-        except (aiohttp.ClientError, socket.gaierror) as exception:
-            raise IrcelineApiError("Error fetching information") from exception
-        except Exception as exception:  # pylint: disable=broad-except
-            raise IrcelineApiError(f"Something really wrong happened! {exception}") from exception
+
+        record, kwargs = None, dict()
+        if self._instrumentation is not None:
+            record = RequestRecord(method, url)
+            kwargs['trace_request_ctx'] = record
+
+        for attempt in count():
+            try:
+                start = time.perf_counter()
+                async with self._limiter.slot(url) if self._limiter is not None else nullcontext():
+                    async with async_timeout.timeout(60):
+                        sent = time.perf_counter()
+                        response = await self._transport.request(
+                            method=method,
+                            url=url,
+                            params=querystring,
+                            headers=headers,
+                            **kwargs
+                        )
+                        if record is not None:
+                            record.wait += sent - start
+                            record.ttfb = time.perf_counter() - sent
+                            record.status = response.status
+                            record.retries = attempt
+                        if (self._limiter is None or attempt >= self._limiter.max_retries or
+                                response.status not in self._limiter.retry_statuses):
+                            response.raise_for_status()
+                            if self._breaker is not None:
+                                self._breaker.record_success(url)
+                            if record is not None:
+                                return await self._read_instrumented(response, record)
+                            if buffered:
+                                return _BufferedResponse(response.status, response.headers, await response.read())
+                            return response
+                        delay = self._limiter.retry_delay(attempt, response.headers.get('Retry-After'))
+                        response.release()
+
+            except asyncio.TimeoutError as exception:
+                self._report_request(url, record, exception)
+                raise IrcelineApiError("Timeout error fetching information") from exception
+            except (aiohttp.ClientError, socket.gaierror) as exception:
+                self._report_request(url, record, exception)
+                raise IrcelineApiError("Error fetching information") from exception
+            except Exception as exception:  # pylint: disable=broad-except
+                self._report_request(url, record, exception)
+                raise IrcelineApiError(f"Something really wrong happened! {exception}") from exception
+
+            await asyncio.sleep(delay)
+
+    async def _read_instrumented(self, response: ClientResponse, record: RequestRecord) -> _InstrumentedResponse:
+        start = time.perf_counter()
+        body = await response.read()
+        record.body = time.perf_counter() - start
+        record.size = len(body)
+        self._instrumentation.on_request(record)
+        return _InstrumentedResponse(response.status, response.headers, body, record, self._instrumentation)
+
+    def _report_request(self, url: str, record: RequestRecord | None, exception: BaseException) -> None:
+        if self._breaker is not None:
+            # A 4xx response is an error of the request, not of the server
+            if isinstance(exception, aiohttp.ClientResponseError) and exception.status < 500:
+                self._breaker.record_success(url)
+            else:
+                self._breaker.record_failure(url)
+        if record is not None:
+            record.error = exception
+            self._instrumentation.on_request(record)
+
+    def _report_feature_error(self, feature: IrcelineFeature, exception: BaseException) -> None:
+        """
+        Report to the instrumentation an error that was replaced by a missing value for the feature
+        :param feature: feature of which the value is missing
+        :param exception: exception that was caught
+        """
+        if self._instrumentation is not None:
+            self._instrumentation.on_feature_error(type(self).__name__, f'{feature}', exception)
 
 
 class IrcelineBaseWmsClient(IrcelineBaseClient, ABC):
@@ -76,17 +375,109 @@ class IrcelineBaseWmsClient(IrcelineBaseClient, ABC):
                             "Y": "1"}
     _epsilon = 0.00001
     _base_url = None
+    _max_layers_per_request = 28
 
-    @staticmethod
-    def _parse_capabilities(xml_string: str) -> Set[str]:
+    _capabilities_path = ('Capability', 'Layer', 'Layer', 'Name')
+
+    def __init__(self, session: aiohttp.ClientSession, multi_layer: bool = False, **kwargs) -> None:
+        """
+        :param session: aiohttp session to use for the requests
+        :param multi_layer: if True, query up to _max_layers_per_request layers in a single GetFeatureInfo request
+            instead of one request per layer, falling back to one request per layer if the server does not answer with
+            one feature per layer
+        :param kwargs: see IrcelineBaseClient
+        """
+        super().__init__(session, **kwargs)
+        self._multi_layer = multi_layer
+
+    async def _get_feature_info(self, base_querystring: dict, layers: List[str]) -> List[FeatureValue] | None:
+        """
+        Get the values of several layers with a single GetFeatureInfo request.  The server answers with one feature per
+        queried layer, in the order of query_layers.  Multi-layer requests are disabled for this client if the server
+        refuses them with a 4xx status.  If the answer cannot be split by layer (e.g. fewer features than layers), the
+        layers are requested separately for this call only, as the features of the response do not identify their layer.
+        :param base_querystring: GetFeatureInfo query string with the bbox of the position
+        :param layers: names of the layers to query
+        :return: list of FeatureValue in the order of the layers or None if the layers must be requested separately
+        """
+        names = ",".join(layers)
+        querystring = base_querystring | {"layers": names,
+                                          "query_layers": names,
+                                          "feature_count": f"{len(layers)}"}
         try:
-            root = ElementTree.fromstring(xml_string)
-        except ElementTree.ParseError:
-            return set()
+            r: ClientResponse = await self._api_wrapper(self._base_url, querystring)
+            data: dict = await r.json()
+        except (IrcelineApiError, aiohttp.ClientResponseError) as e:
+            # Keep multi-layer requests for transient errors, but not if the server refused the request
+            cause = e.__cause__ if isinstance(e, IrcelineApiError) else e
+            if isinstance(cause, aiohttp.ClientResponseError) and 400 <= cause.status < 500:
+                self._multi_layer = False
+            return None
+        except ValueError:
+            return None
+
+        features = data.get('features', None) if isinstance(data, dict) else None
+        if not isinstance(features, list) or len(features) != len(layers):
+            return None
+        try:
+            values = [self._feature_value(data, k) for k in range(len(layers))]
+        except (ValueError, AttributeError):
+            return None
+        self._mark_stale(r, values)
+        return values
+
+    async def _iter_completed(self,
+                              tasks: List[asyncio.Task],
+                              keys: Dict[Hashable, IrcelineFeature],
+                              deadline: float | None) -> AsyncIterator[Tuple[Hashable, FeatureValue]]:
+        """
+        Yield the values returned by the tasks as soon as each task completes.  The tasks still running after the
+        deadline are cancelled and their keys are yielded with a missing value.  If the iteration is stopped early
+        (e.g. aclose or break), the tasks still running are cancelled and nothing more is yielded.
+        :param tasks: tasks each returning a dict of key -> FeatureValue
+        :param keys: every key expected from the tasks -> feature of the key
+        :param deadline: maximum time in seconds to wait for the tasks, no limit if None
+        :return: async iterator of (key, FeatureValue)
+        """
+        missing = dict(keys)
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=deadline):
+                for key, value in (await next_done).items():
+                    missing.pop(key, None)
+                    yield key, value
+        except asyncio.TimeoutError as e:
+            for feature in set(missing.values()):
+                self._report_feature_error(feature, e)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        for key in missing:
+            yield key, FeatureValue(value=None, timestamp=None)
 
-        path = './/Capability/Layer/Layer/Name'
-        feature_type_names = {t.text for t in root.findall(path)}
-        return feature_type_names
+    @staticmethod
+    def _feature_value(data: dict, index: int) -> FeatureValue:
+        """
+        Extract the value of a feature from a GetFeatureInfo JSON response.  Raises IndexError if there is no such
+        feature in the response
+        :param data: JSON dict value as returned by the API
+        :param index: index of the feature in the response
+        :return: FeatureValue with the value and the timestamp of the response
+        """
+        return FeatureValue(
+            value=data.get('features', [{}])[index].get('properties', {}).get('GRAY_INDEX'),
+            timestamp=datetime.fromisoformat(data.get('timeStamp')) if 'timeStamp' in data else None)
+
+    @staticmethod
+    def _parse_capabilities(xml_string: str) -> Set[str]:
+        """
+        From an XML string obtained with GetCapabilities, generate a set of layer names
+        :param xml_string: XML string to parse
+        :return: set of layer names found in the XML document
+        """
+        parser = _CapabilitiesParser(IrcelineBaseWmsClient._capabilities_path)
+        parser.feed(xml_string)
+        return parser.close()
 
     async def get_capabilities(self) -> Set[str]:
         """
@@ -96,6 +487,4 @@ class IrcelineBaseWmsClient(IrcelineBaseClient, ABC):
         querystring = {"service": "WMS",
                        "version": "1.1.1",
                        "request": "GetCapabilities"}
-        r: ClientResponse = await self._api_wrapper(self._base_url, querystring)
-
-        return self._parse_capabilities(await r.text())
+        return await self._get_capabilities(self._base_url, querystring, self._capabilities_path)
@@ -0,0 +1,131 @@
+from array import array
+from bisect import bisect_left
+from math import isnan, nan
+from typing import Dict, Sequence
+
+from .data import BelAqiIndex, FeatureValue, FeatureTable, RioFeature, RioIfdmFeature
+
+# Upper bound (included) of the concentration in µg/m³ of each component for the indexes 1 to 9, above the last bound
+# the index is 10
+_thresholds = {
+    'pm10': (5, 15, 25, 35, 45, 60, 70, 80, 100),
+    'pm25': (2.5, 5, 7.5, 10, 15, 25, 35, 40, 50),
+    'o3': (30, 60, 80, 100, 120, 140, 160, 190, 240),
+    'no2': (10, 20, 40, 50, 60, 80, 100, 125, 150),
+}
+
+# Features to use for each component of the index
+RIO_COMPONENTS = {'pm10': RioFeature.PM10_24HMEAN,
+                  'pm25': RioFeature.PM25_24HMEAN,
+                  'o3': RioFeature.O3_HMEAN,
+                  'no2': RioFeature.NO2_HMEAN}
+
+RIO_IFDM_COMPONENTS = {'pm10': RioIfdmFeature.PM10_HMEAN,
+                       'pm25': RioIfdmFeature.PM25_HMEAN,
+                       'o3': RioIfdmFeature.O3_HMEAN,
+                       'no2': RioIfdmFeature.NO2_HMEAN}
+
+
+def belaqi_index(pm10: float, pm25: float, o3: float, no2: float) -> BelAqiIndex:
+    """
+    Compute the BelAQI index based on the components PM10, PM2.5, O3 and NO2, the highest index of the components is
+    used.  Raises ValueError if a component is missing or negative.
+    See https://www.irceline.be/en/air-quality/measurements/air-quality-index-real-time
+    :param pm10: PM10 concentration in µg/m³
+    :param pm25: PM2.5 concentration in µg/m³
+    :param o3: O3 concentration in µg/m³
+    :param no2: NO2 concentration in µg/m³
+    :return: BelAQI index
+    """
+    components = {'pm10': pm10, 'pm25': pm25, 'o3': o3, 'no2': no2}
+    if any(v is None or isnan(v) for v in components.values()):
+        raise ValueError("All the components should be valued (at least one is None here)")
+    if any(v < 0 for v in components.values()):
+        raise ValueError("All the components should have a positive value")
+    return BelAqiIndex(max(bisect_left(_thresholds[c], v) + 1 for c, v in components.items()))
+
+
+def belaqi_index_many(pm10: Sequence[float],
+                      pm25: Sequence[float],
+                      o3: Sequence[float],
+                      no2: Sequence[float]) -> Sequence[int]:
+    """
+    Compute the BelAQI index for many sets of components at once, see belaqi_index
+    :param pm10: PM10 concentrations in µg/m³
+    :param pm25: PM2.5 concentrations in µg/m³
+    :param o3: O3 concentrations in µg/m³
+    :param no2: NO2 concentrations in µg/m³
+    :return: array of indexes (NumPy array for NumPy input), 0 where a component is missing (None or NaN) or negative
+    """
+    if hasattr(pm10, 'shape'):
+        return _belaqi_index_numpy(pm10, pm25, o3, no2)
+
+    pm10_t, pm25_t, o3_t, no2_t = (_thresholds[c] for c in ('pm10', 'pm25', 'o3', 'no2'))
+    result = array('b', bytes(len(pm10)))
+    for k, (a, b, c, d) in enumerate(zip(pm10, pm25, o3, no2)):
+        if a is None or b is None or c is None or d is None:
+            continue
+        if not (a >= 0 and b >= 0 and c >= 0 and d >= 0):
+            # Also excludes NaN
+            continue
+        result[k] = max(bisect_left(pm10_t, a), bisect_left(pm25_t, b), bisect_left(o3_t, c),
+                        bisect_left(no2_t, d)) + 1
+    return result
+
+
+def _belaqi_index_numpy(pm10, pm25, o3, no2):
+    import numpy as np
+
+    result = np.zeros(len(pm10), dtype=np.int8)
+    valid = np.ones(len(pm10), dtype=bool)
+    for c, values in (('pm10', pm10), ('pm25', pm25), ('o3', o3), ('no2', no2)):
+        values = np.asarray(values, dtype=np.float64)
+        valid &= values >= 0
+        result = np.maximum(result, np.searchsorted(_thresholds[c], values, side='left') + 1)
+    return np.where(valid, result, 0).astype(np.int8)
+
+
+def belaqi_index_from_result(result: Dict[str, FeatureValue],
+                             components: Dict[str, str] = None) -> BelAqiIndex | None:
+    """
+    Compute the BelAQI index from the result of IrcelineRioClient.get_data or IrcelineRioIfdmClient.get_data
+    :param result: dict where key is the feature and value is a FeatureValue
+    :param components: feature to use for each component, RIO_COMPONENTS if None
+    :return: BelAQI index or None if a component is missing
+    """
+    if components is None:
+        components = RIO_COMPONENTS
+    values = {c: result.get(f, FeatureValue(value=None, timestamp=None))['value'] for c, f in components.items()}
+    try:
+        return belaqi_index(**values)
+    except ValueError:
+        return None
+
+
+def belaqi_index_table(table: FeatureTable,
+                       components: Dict[str, str] = None,
+                       feature: str = 'belaqi') -> FeatureTable:
+    """
+    Compute the BelAQI index for every position and timestamp of a FeatureTable (e.g. built from get_data_many or
+    get_timeseries results)
+    :param table: FeatureTable with the features of the components
+    :param components: feature to use for each component, RIO_COMPONENTS if None
+    :param feature: name of the feature of the index in the returned table
+    :return: FeatureTable with the same positions and timestamps and the index as single feature (NaN if a component
+        is missing)
+    """
+    if components is None:
+        components = RIO_COMPONENTS
+    n = len(table.positions) * len(table.timestamps)
+
+    columns = dict()
+    for c, f in components.items():
+        if f in table.features:
+            offset = table.features.index(f) * n
+            columns[c] = table.values[offset:offset + n]
+        else:
+            columns[c] = array('d', [nan]) * n
+
+    indexes = belaqi_index_many(columns['pm10'], columns['pm25'], columns['o3'], columns['no2'])
+    values = array('d', (i if i > 0 else nan for i in indexes))
+    return FeatureTable(table.positions, [feature], list(table.timestamps), values)
@@ -0,0 +1,443 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from math import floor
+from typing import List, Tuple, Dict, Any, Callable, Awaitable, Hashable, Iterable
+
+from .data import RioFeature, FeatureValue
+from .utils import CellIndex
+
+
+def _period_end(now: float, period: int) -> float:
+    """
+    Compute the end of the publication period containing now
+    :param now: POSIX timestamp
+    :param period: length of the period in seconds
+    :return: POSIX timestamp of the end of the period
+    """
+    # Periods are aligned on local time, as the dates of the forecasts are
+    offset = time.localtime(now).tm_gmtoff
+    return (floor((now + offset) / period) + 1) * period - offset
+
+
+class RioCellCache:
+    """
+    In-process cache of the RIO cells received from the WFS API.  The cells are indexed by their EPSG:31370 bounding box
+    and by the time filter used to fetch them (i.e. the publication hour or day), so that any point inside a known cell
+    can be answered locally.  Only the max_periods most recent time filters are kept.
+    """
+
+    def __init__(self, max_periods: int = 2) -> None:
+        self._max_periods = max_periods
+        # period -> (index of the cells, {bbox: cell entry})
+        self._periods: OrderedDict[str, Tuple[CellIndex, Dict[tuple, dict]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(cells) for _, cells in self._periods.values())
+
+    def get(self,
+            features: List[RioFeature],
+            period: str,
+            point: Tuple[int, int]) -> Dict[RioFeature, FeatureValue] | None:
+        """
+        Get the cached values for the cell containing the point
+        :param features: RioFeatures wanted
+        :param period: time filter used to fetch the data
+        :param point: EPSG:31370 coordinates
+        :return: dict as returned by IrcelineRioClient.get_data or None if the cell or one of the features is unknown
+        """
+        if period not in self._periods:
+            return None
+        self._periods.move_to_end(period)
+        entry = self._periods[period][0].find(point)
+        if entry is None or not {f'{f}' for f in features} <= entry['features']:
+            return None
+        return {f'{f}': entry['result'][f'{f}'] for f in features if f'{f}' in entry['result']}
+
+    def put(self,
+            features: List[RioFeature],
+            period: str,
+            bbox: Tuple[float, float, float, float],
+            result: Dict[RioFeature, FeatureValue]) -> None:
+        """
+        Store the values of a cell in the cache
+        :param features: RioFeatures that were requested for this cell, even if they are missing from the result
+        :param period: time filter used to fetch the data
+        :param bbox: EPSG:31370 bounding box of the cell
+        :param result: dict as returned by IrcelineRioClient._format_result for this cell
+        """
+        if period not in self._periods:
+            self._periods[period] = (CellIndex(), dict())
+            while len(self._periods) > self._max_periods:
+                self._periods.popitem(last=False)
+        self._periods.move_to_end(period)
+
+        index, cells = self._periods[period]
+        if bbox not in cells:
+            cells[bbox] = {'features': set(), 'result': dict()}
+            index.add(bbox, cells[bbox])
+        cells[bbox]['features'] |= {f'{f}' for f in features}
+        cells[bbox]['result'] |= result
+
+    def clear(self) -> None:
+        self._periods.clear()
+
+
+class ResponseCache:
+    """
+    In-process cache of the API responses with request coalescing: concurrent calls for the same request share a single
+    in-flight fetch.  Entries expire at the end of the publication period they were fetched in (e.g. at the end of the
+    hour for an hourly period or at midnight for a daily period) and the least recently used entries are evicted when
+    max_entries is reached.
+    With max_stale, the last value fetched for a request is kept max_stale seconds after its expiration and served
+    right away (stale-while-revalidate) while a fresh value is fetched in the background.
+    The hits, misses, coalesced and stale counters can be used to monitor the efficiency of the cache.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_stale: float = 0.) -> None:
+        """
+        :param max_entries: maximum number of entries kept
+        :param max_stale: time in seconds during which an expired value can still be served, never if 0
+        """
+        self._max_entries = max_entries
+        self._max_stale = max_stale
+        # key -> (expiration timestamp, value)
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        # stale key -> (end of the stale period, time the value was stored, value)
+        self._stale: OrderedDict[Hashable, Tuple[float, float, Any]] = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Task] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_or_fetch(self, key: Hashable, period: int, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get the value from the cache or call fetch to get it.  Exceptions raised by fetch are propagated to all the
+        callers waiting for this key and nothing is cached.
+        :param key: key identifying the request
+        :param period: publication period of the data in seconds, entries expire at the end of the current period
+        :param fetch: coroutine function to call to get the value upon cache miss
+        :return: cached or fetched value
+        """
+        value, _ = await self.get_or_fetch_stale(key, period, fetch)
+        return value
+
+    async def get_or_fetch_stale(self,
+                                 key: Hashable,
+                                 period: int,
+                                 fetch: Callable[[], Awaitable[Any]],
+                                 stale_key: Hashable | None = None) -> Tuple[Any, float | None]:
+        """
+        Get the value like get_or_fetch, or the last value stored under the stale key if the value is not in the cache
+        and a stale value is available.  In that case, fetch is still called in the background to refresh the cache.
+        :param key: key identifying the request
+        :param period: publication period of the data in seconds, entries expire at the end of the current period
+        :param fetch: coroutine function to call to get the value upon cache miss
+        :param stale_key: key identifying the requests that can answer each other with a stale value (e.g. the same
+            request for another publication period), the key itself if None
+        :return: (value, age in seconds of the value if it is stale, None if it is fresh)
+        """
+        now = time.time()
+        if key in self._entries:
+            expires, value = self._entries[key]
+            if expires > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value, None
+            del self._entries[key]
+
+        stale_key = key if stale_key is None else stale_key
+        if key in self._in_flight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, period, fetch, stale_key))
+            # Retrieve the exception in case every caller waiting for this key was cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._in_flight[key] = task
+
+        if stale_key in self._stale:
+            stale_until, stored, value = self._stale[stale_key]
+            if stale_until > now:
+                self.stale += 1
+                return value, now - stored
+            del self._stale[stale_key]
+
+        return await asyncio.shield(self._in_flight[key]), None
+
+    async def _fetch(self, key: Hashable, period: int, fetch: Callable[[], Awaitable[Any]],
+                     stale_key: Hashable) -> Any:
+        try:
+            value = await fetch()
+            self.put(key, period, value, stale_key)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def put(self, key: Hashable, period: int, value: Any, stale_key: Hashable | None = None) -> None:
+        """
+        Store a value in the cache
+        :param key: key identifying the request
+        :param period: publication period of the data in seconds, the entry expires at the end of the current period
+        :param value: value to store
+        :param stale_key: see get_or_fetch_stale
+        """
+        now = time.time()
+        expires = _period_end(now, period)
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+        if self._max_stale > 0:
+            stale_key = key if stale_key is None else stale_key
+            self._stale[stale_key] = (expires + self._max_stale, now, value)
+            self._stale.move_to_end(stale_key)
+            while len(self._stale) > self._max_entries:
+                self._stale.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._stale.clear()
+
+
+class SqliteCache:
+    """
+    On-disk cache of the API responses in an SQLite database in WAL mode, that can be shared by several processes (e.g.
+    the workers of a web server) so that each response is only downloaded once per publication period by all of them.
+    Entries expire at the end of the publication period they were fetched in, like in ResponseCache, and the least
+    recently used entries are evicted when the total size of the bodies exceeds max_bytes.  Database errors (e.g. a
+    locked or full database) are ignored: the cache then behaves as if it was empty.
+    Besides whole responses, the cache stores cells (e.g. the RIO cells) keyed by service, sorted features, time filter
+    and bounding box, so that every position inside a cell is answered by the same entry, see get_cells and put_cells.
+    The hits and misses counters are kept per process.
+    """
+    # Minimum time in seconds between two updates of the access time of an entry, to avoid writing on every read
+    _touch_interval = 60
+    _tables = ('responses', 'cells')
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, timeout: float = 5.) -> None:
+        """
+        :param path: path of the database file, created if it does not exist
+        :param max_bytes: maximum total size of the cached bodies
+        :param timeout: maximum time in seconds to wait for a lock held by another process
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection cannot be used in a child process after a fork: open a new one for each process
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                               "key TEXT PRIMARY KEY, "
+                               "expires REAL NOT NULL, "
+                               "accessed REAL NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "status INTEGER NOT NULL, "
+                               "headers TEXT NOT NULL, "
+                               "body BLOB NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            connection.execute("CREATE TABLE IF NOT EXISTS cells ("
+                               "key TEXT PRIMARY KEY, "
+                               "service TEXT NOT NULL, "
+                               "features TEXT NOT NULL, "
+                               "period TEXT NOT NULL, "
+                               "min_x REAL NOT NULL, "
+                               "min_y REAL NOT NULL, "
+                               "max_x REAL NOT NULL, "
+                               "max_y REAL NOT NULL, "
+                               "expires REAL NOT NULL, "
+                               "accessed REAL NOT NULL, "
+                               "size INTEGER NOT NULL, "
+                               "body BLOB NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS cells_lookup ON cells (service, features, period, min_x)")
+            connection.execute("CREATE INDEX IF NOT EXISTS cells_accessed ON cells (accessed)")
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def __len__(self) -> int:
+        with self._lock:
+            try:
+                connection = self._connect()
+                return sum(connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                           for table in self._tables)
+            except sqlite3.Error:
+                return 0
+
+    def get(self, key: str) -> Tuple[int, List[Tuple[str, str]], bytes] | None:
+        """
+        Get a response from the cache
+        :param key: key identifying the request
+        :return: (status, headers, body) or None if the response is not in the cache or expired
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                connection = self._connect()
+                row = connection.execute("SELECT status, headers, body, accessed FROM responses "
+                                         "WHERE key = ? AND expires > ?", (key, now)).fetchone()
+                if row is not None and row[3] < now - self._touch_interval:
+                    connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.Error:
+                row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], [tuple(h) for h in json.loads(row[1])], row[2]
+
+    def put(self, key: str, period: int, status: int, headers: Iterable[Tuple[str, str]], body: bytes) -> None:
+        """
+        Store a response in the cache and evict the least recently used entries if the cache is full
+        :param key: key identifying the request
+        :param period: publication period of the data in seconds, the entry expires at the end of the current period
+        :param status: HTTP status of the response
+        :param headers: (name, value) pairs of the response headers
+        :param body: body of the response
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                connection = self._connect()
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       (key, _period_end(now, period), now, len(body), status,
+                                        json.dumps(list(headers)), body))
+                    self._evict(connection, now)
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                pass
+
+    @staticmethod
+    def _cell_key(service: str, features: str, period: str, bbox: Tuple[float, float, float, float]) -> str:
+        return f"{service} {features} {period} {','.join(f'{c}' for c in bbox)}"
+
+    def get_cells(self,
+                  service: str,
+                  features: Iterable[str],
+                  period: str,
+                  points: List[Tuple[float, float]]
+                  ) -> Dict[Tuple[float, float], Tuple[Tuple[float, float, float, float], bytes]]:
+        """
+        Get the cached cells containing the points
+        :param service: name of the service the cells come from (e.g. rio)
+        :param features: names of the features that were requested for the cells
+        :param period: time filter used to fetch the cells
+        :param points: coordinates, in the same system as the bounding boxes of the cells
+        :return: dict where key is a point found in a cell and value is (bounding box of the cell, body of the cell)
+        """
+        names = ','.join(sorted(features))
+        now = time.time()
+        result = dict()
+        with self._lock:
+            try:
+                connection = self._connect()
+                touched = set()
+                for x, y in points:
+                    row = connection.execute("SELECT key, min_x, min_y, max_x, max_y, body, accessed FROM cells "
+                                             "WHERE service = ? AND features = ? AND period = ? AND expires > ? "
+                                             "AND min_x <= ? AND ? <= max_x AND min_y <= ? AND ? <= max_y LIMIT 1",
+                                             (service, names, period, now, x, x, y, y)).fetchone()
+                    if row is not None:
+                        result[(x, y)] = (tuple(row[1:5]), row[5])
+                        if row[6] < now - self._touch_interval:
+                            touched.add(row[0])
+                connection.executemany("UPDATE cells SET accessed = ? WHERE key = ?", [(now, k) for k in touched])
+            except sqlite3.Error:
+                pass
+
+        self.hits += len(result)
+        self.misses += len(points) - len(result)
+        return result
+
+    def put_cells(self,
+                  service: str,
+                  features: Iterable[str],
+                  period: str,
+                  cache_period: int,
+                  cells: Dict[Tuple[float, float, float, float], bytes]) -> None:
+        """
+        Store cells in the cache, one entry per cell, and evict the least recently used entries if the cache is full
+        :param service: name of the service the cells come from (e.g. rio)
+        :param features: names of the features that were requested for the cells
+        :param period: time filter used to fetch the cells
+        :param cache_period: publication period of the data in seconds, the entries expire at the end of the current
+            period
+        :param cells: dict where key is the bounding box of the cell and value is the body to store for the cell
+        """
+        names = ','.join(sorted(features))
+        now = time.time()
+        expires = _period_end(now, cache_period)
+        with self._lock:
+            try:
+                connection = self._connect()
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    connection.executemany("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                           [(self._cell_key(service, names, period, bbox), service, names, period,
+                                             *bbox, expires, now, len(body), body) for bbox, body in cells.items()])
+                    self._evict(connection, now)
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                pass
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        total = sum(connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+                    for table in self._tables)
+        if total <= self._max_bytes:
+            return
+        for table in self._tables:
+            total -= connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table} WHERE expires <= ?",
+                                        (now,)).fetchone()[0]
+            connection.execute(f"DELETE FROM {table} WHERE expires <= ?", (now,))
+        evicted = {table: list() for table in self._tables}
+        for table, key, size, _ in connection.execute("SELECT 'responses', key, size, accessed FROM responses "
+                                                      "UNION ALL SELECT 'cells', key, size, accessed FROM cells "
+                                                      "ORDER BY accessed").fetchall():
+            if total <= self._max_bytes:
+                break
+            evicted[table].append((key,))
+            total -= size
+        for table, keys in evicted.items():
+            connection.executemany(f"DELETE FROM {table} WHERE key = ?", keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                connection = self._connect()
+                for table in self._tables:
+                    connection.execute(f"DELETE FROM {table}")
+            except sqlite3.Error:
+                pass
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
@@ -1,6 +1,8 @@
-from datetime import datetime, date
-from enum import StrEnum
-from typing import TypedDict
+from array import array
+from datetime import datetime, date, UTC
+from enum import StrEnum, IntEnum
+from math import nan, isnan
+from typing import TypedDict, NotRequired, List, Tuple, Dict
 
 
 class IrcelineFeature(StrEnum):
@@ -48,7 +50,204 @@ class ForecastFeature(IrcelineFeature):
     BELAQI = 'forecast:belaqi'
 
 
+class BelAqiIndex(IntEnum):
+    EXCELLENT = 1
+    VERY_GOOD = 2
+    GOOD = 3
+    FAIRLY_GOOD = 4
+    MODERATE = 5
+    POOR = 6
+    VERY_POOR = 7
+    BAD = 8
+    VERY_BAD = 9
+    HORRIBLE = 10
+
+
 class FeatureValue(TypedDict):
     # Timestamp at which the value was computed
     timestamp: datetime | date | None
     value: int | float | None
+    # Only set when the value comes from a stale cached response: age in seconds of the response
+    stale_age: NotRequired[float]
+
+
+class TimeSeries:
+    """
+    Columnar time series of a feature: timestamps as POSIX seconds (dates are stored as midnight UTC) in an array of
+    64-bit integers and values in an array of doubles, sorted by timestamp
+    """
+    __slots__ = ('timestamps', 'values')
+
+    def __init__(self, timestamps: array | None = None, values: array | None = None) -> None:
+        self.timestamps = timestamps if timestamps is not None else array('q')
+        self.values = values if values is not None else array('d')
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, TimeSeries) and
+                self.timestamps == other.timestamps and
+                self.values == other.values)
+
+    def __repr__(self) -> str:
+        return f"TimeSeries(timestamps={self.timestamps!r}, values={self.values!r})"
+
+    def datetimes(self) -> List[datetime]:
+        """
+        :return: timestamps as timezone aware datetime objects
+        """
+        return [datetime.fromtimestamp(t, UTC) for t in self.timestamps]
+
+    @staticmethod
+    def posix_timestamp(timestamp: datetime | date) -> int:
+        """
+        Convert a datetime or a date to the POSIX timestamp used in the time series
+        :param timestamp: timezone aware datetime or date
+        :return: number of seconds since the epoch
+        """
+        if not isinstance(timestamp, datetime):
+            timestamp = datetime(timestamp.year, timestamp.month, timestamp.day, tzinfo=UTC)
+        return round(timestamp.timestamp())
+
+
+class FeatureTable:
+    """
+    Columnar container of the values of several features at several positions and timestamps.  The values are stored
+    in a single array of doubles (NaN when missing), feature by feature, then position by position, then timestamp by
+    timestamp, and the timestamps are stored once as POSIX seconds in an array of 64-bit integers.
+    The buffers can be exported without copy to NumPy (to_numpy) or Arrow (to_arrow).
+    """
+    __slots__ = ('positions', 'features', 'timestamps', 'values', '_position_index', '_feature_index',
+                 '_timestamp_index')
+
+    def __init__(self,
+                 positions: List[Tuple[float, float]],
+                 features: List[str],
+                 timestamps: List[int],
+                 values: array | None = None) -> None:
+        """
+        :param positions: positions of the table
+        :param features: features of the table
+        :param timestamps: POSIX timestamps of the table, see TimeSeries.posix_timestamp
+        :param values: array of doubles of size len(features) * len(positions) * len(timestamps), NaN if None
+        """
+        size = len(features) * len(positions) * len(timestamps)
+        if values is None:
+            values = array('d', [nan]) * size
+        if len(values) != size:
+            raise ValueError(f"Expected {size} values, got {len(values)}")
+        self.positions = list(positions)
+        self.features = list(features)
+        self.timestamps = array('q', timestamps)
+        self.values = values
+        self._position_index = {p: i for i, p in enumerate(self.positions)}
+        self._feature_index = {f: i for i, f in enumerate(self.features)}
+        self._timestamp_index = {t: i for i, t in enumerate(self.timestamps)}
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """
+        :return: (number of positions, number of features, number of timestamps)
+        """
+        return len(self.positions), len(self.features), len(self.timestamps)
+
+    def _index(self, position: Tuple[float, float], feature: str, timestamp: datetime | date | int) -> int:
+        if not isinstance(timestamp, int):
+            timestamp = TimeSeries.posix_timestamp(timestamp)
+        return ((self._feature_index[feature] * len(self.positions) + self._position_index[position]) *
+                len(self.timestamps) + self._timestamp_index[timestamp])
+
+    def get(self, position: Tuple[float, float], feature: str, timestamp: datetime | date | int) -> float | None:
+        """
+        Get a value from the table.  Raises KeyError if the position, feature or timestamp is not in the table
+        :param position: position of the value
+        :param feature: feature of the value
+        :param timestamp: datetime, date or POSIX timestamp of the value
+        :return: value or None if it is missing
+        """
+        value = self.values[self._index(position, feature, timestamp)]
+        return None if isnan(value) else value
+
+    def set(self, position: Tuple[float, float], feature: str, timestamp: datetime | date | int, value: float) -> None:
+        """
+        Set a value of the table.  Raises KeyError if the position, feature or timestamp is not in the table
+        """
+        self.values[self._index(position, feature, timestamp)] = value
+
+    @classmethod
+    def from_results(cls, results: Dict[Tuple[float, float], dict]) -> 'FeatureTable':
+        """
+        Build a table from the results of the clients for several positions (e.g. get_data_many).  The keys of the
+        result dicts are either features (RIO, RIO IFDM), the timestamp being the one of the FeatureValue, or
+        (feature, date) tuples (forecasts), the timestamp being the date of the forecast.
+        :param results: dict where key is the position and value is the result of a client for the position
+        :return: FeatureTable with the values of the results
+        """
+        rows = list()
+        features, timestamps = dict(), set()
+        for position, result in results.items():
+            for key, v in result.items():
+                feature, timestamp = key if isinstance(key, tuple) else (key, v['timestamp'])
+                features.setdefault(feature, None)
+                if timestamp is None or v['value'] is None:
+                    continue
+                timestamp = TimeSeries.posix_timestamp(timestamp)
+                timestamps.add(timestamp)
+                rows.append((position, feature, timestamp, v['value']))
+
+        table = cls(list(results), list(features), sorted(timestamps))
+        for position, feature, timestamp, value in rows:
+            table.set(position, feature, timestamp, value)
+        return table
+
+    @classmethod
+    def from_timeseries(cls, series: Dict[Tuple[float, float], Dict[str, TimeSeries]]) -> 'FeatureTable':
+        """
+        Build a table from time series for several positions (e.g. get_timeseries)
+        :param series: dict where key is the position and value is a dict of TimeSeries by feature
+        :return: FeatureTable with the values of the time series
+        """
+        features, timestamps = dict(), set()
+        for by_feature in series.values():
+            for feature, s in by_feature.items():
+                features.setdefault(feature, None)
+                timestamps.update(s.timestamps)
+
+        table = cls(list(series), list(features), sorted(timestamps))
+        for position, by_feature in series.items():
+            for feature, s in by_feature.items():
+                for timestamp, value in zip(s.timestamps, s.values):
+                    table.set(position, feature, timestamp, value)
+        return table
+
+    def to_numpy(self):
+        """
+        Export the table to NumPy without copying the values.  Requires NumPy to be installed.
+        :return: tuple (values, timestamps) where values is a float64 array view of shape (positions, features,
+            timestamps) and timestamps is an array of datetime64[s]
+        """
+        import numpy as np
+
+        values = np.frombuffer(self.values, dtype=np.float64)
+        values = values.reshape(len(self.features), len(self.positions), len(self.timestamps)).transpose(1, 0, 2)
+        return values, np.frombuffer(self.timestamps, dtype=np.int64).view('datetime64[s]')
+
+    def to_arrow(self):
+        """
+        Export the table to an Arrow record batch with one row per position and timestamp and one column per feature.
+        The feature columns share the memory of the table, missing values are nulls.  Requires pyarrow to be
+        installed.
+        :return: pyarrow.RecordBatch with position (index in positions), timestamp and feature columns
+        """
+        import pyarrow as pa
+
+        n = len(self.positions) * len(self.timestamps)
+        buffer = pa.py_buffer(self.values)
+        # Validity bitmap of all the values, sliced with the same offset as the values of each feature
+        validity = pa.array([not isnan(v) for v in self.values], pa.bool_()).buffers()[1]
+        columns = [pa.array([p for p in range(len(self.positions)) for _ in self.timestamps], pa.int32()),
+                   pa.array(list(self.timestamps) * len(self.positions), pa.timestamp('s', tz='UTC'))]
+        columns += [pa.Array.from_buffers(pa.float64(), n, [validity, buffer], offset=i * n)
+                    for i in range(len(self.features))]
+        return pa.RecordBatch.from_arrays(columns, ['position', 'timestamp'] + [f'{f}' for f in self.features])
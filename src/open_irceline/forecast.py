@@ -1,16 +1,36 @@
 import asyncio
-from datetime import date, timedelta, datetime
+from datetime import date, timedelta
 from itertools import product
-from typing import List, Tuple, Dict
+from math import nan, isnan
+from typing import List, Tuple, Dict, AsyncIterator
 
+import aiohttp
 from aiohttp import ClientResponse, ClientResponseError
 
-from .api import IrcelineApiError, IrcelineBaseWmsClient, _forecast_wms_base_url
+from .api import IrcelineApiError, IrcelineBaseWmsClient, _forecast_wms_base_url, _forecast_wcs_base_url
 from .data import ForecastFeature, FeatureValue
+from .grid import RegularGrid
 
 
 class IrcelineForecastClient(IrcelineBaseWmsClient):
     _base_url = _forecast_wms_base_url
+    # (lon min, lat min, lon max, lat max) of the grids downloaded in raster mode
+    _grid_bbox = (2.5, 49.45, 6.45, 51.55)
+    _grid_resolution = 0.01
+    _cache_period = 86400
+
+    def __init__(self, session: aiohttp.ClientSession, raster: bool = False, **kwargs) -> None:
+        """
+        :param session: aiohttp session to use for the requests
+        :param raster: if True, get_data downloads the whole grid of each layer once per day and samples it locally
+            instead of sending one GetFeatureInfo request per feature and day
+        :param kwargs: see IrcelineBaseWmsClient (e.g. multi_layer to query several features and days in a single
+            GetFeatureInfo request)
+        """
+        super().__init__(session, **kwargs)
+        self._raster = raster
+        # (feature, day offset) -> (date of download, task fetching the grid)
+        self._grids: Dict[Tuple[ForecastFeature, int], Tuple[date, asyncio.Task]] = dict()
 
     async def get_data(self,
                        features: List[ForecastFeature],
@@ -23,19 +43,137 @@ class IrcelineForecastClient(IrcelineBaseWmsClient):
         :param position: (lat, long)
         :return: dict where key is (ForecastFeature, date of the forecast) and value is a FeatureValue
         """
-        timestamp = date.today()
         result = dict()
+        for r in await asyncio.gather(*self._feature_tasks(features, position, date.today())):
+            result |= r
+
+        return result
+
+    async def iter_data(self,
+                        features: List[ForecastFeature],
+                        position: Tuple[float, float],
+                        deadline: float | None = None
+                        ) -> AsyncIterator[Tuple[Tuple[ForecastFeature, date], FeatureValue]]:
+        """
+        Get forecasted concentrations like get_data, yielding the values as soon as they are received instead of
+        waiting for all of them
+        :param features: pollutants to get the forecasts for
+        :param position: (lat, long)
+        :param deadline: maximum time in seconds to wait for the values, the values not received in time are cancelled
+            and yielded as missing (value and timestamp None)
+        :return: async iterator of ((ForecastFeature, date of the forecast), FeatureValue)
+        """
+        timestamp = date.today()
+        keys = {(feature, timestamp + timedelta(days=d)): feature for feature, d in product(features, range(4))}
+        async for key, value in self._iter_completed(self._feature_tasks(features, position, timestamp), keys,
+                                                     deadline):
+            yield key, value
+
+    def _feature_tasks(self,
+                       features: List[ForecastFeature],
+                       position: Tuple[float, float],
+                       timestamp: date) -> List[asyncio.Task]:
+        """
+        Start the tasks getting the forecasts of the features at the position, each task returning a part of the dict
+        returned by get_data
+        """
+        if self._raster:
+            return [asyncio.create_task(self._get_grid_value(feature, d, timestamp, position))
+                    for feature, d in product(features, range(4))]
+
         lat, lon = position
         base_querystring = (self._default_querystring |
                             {"bbox": f"{lon},{lat},{lon + self._epsilon},{lat + self._epsilon}"})
 
-        tasks = [asyncio.create_task(self._get_single_feature(base_querystring, d, feature, timestamp))
-                 for feature, d in product(features, range(4))]
-        results = await asyncio.gather(*tasks)
+        if self._multi_layer:
+            keys = list(product(features, range(4)))
+            n = self._max_layers_per_request
+            return [asyncio.create_task(self._get_multi_layer(base_querystring, keys[i:i + n], timestamp))
+                    for i in range(0, len(keys), n)]
+        return [asyncio.create_task(self._get_single_feature(base_querystring, d, feature, timestamp))
+                for feature, d in product(features, range(4))]
 
-        for r in results:
-            result |= r
+    async def get_data_many(self,
+                            features: List[ForecastFeature],
+                            positions: List[Tuple[float, float]]
+                            ) -> Dict[Tuple[float, float], Dict[Tuple[ForecastFeature, date], FeatureValue]]:
+        """
+        Get forecasted concentrations for the given features at many positions.  The grid of each feature and day is
+        downloaded once per day and kept in memory, the positions are then looked up locally in the grids
+        :param features: pollutants to get the forecasts for
+        :param positions: list of (lat, long)
+        :return: dict where key is the position and value is a dict as returned by get_data for that position
+        """
+        timestamp = date.today()
+        keys = list(product(features, range(4)))
+        grids = await asyncio.gather(*[self._get_grid(feature, d, timestamp) for feature, d in keys])
+
+        result = {position: dict() for position in positions}
+        for (feature, d), grid in zip(keys, grids):
+            day = timestamp + timedelta(days=d)
+            values = grid.nearest_many(positions) if grid is not None else [nan] * len(positions)
+            for position, value in zip(positions, values):
+                result[position][(feature, day)] = FeatureValue(
+                    value=None if isnan(value) else value,
+                    timestamp=day if grid is not None else None)
+        return result
 
+    async def _get_grid(self, feature: ForecastFeature, d: int, timestamp: date) -> RegularGrid | None:
+        """
+        Get the grid for the feature and day offset, downloading it if it was not already downloaded today.  Concurrent
+        calls for the same grid share the same download.
+        """
+        if (feature, d) not in self._grids or self._grids[(feature, d)][0] != timestamp:
+            self._grids[(feature, d)] = (timestamp, asyncio.create_task(self._download_grid(feature, d)))
+
+        task = self._grids[(feature, d)][1]
+        result = await asyncio.shield(task)
+        if result is None and self._grids.get((feature, d), (None, None))[1] is task:
+            # Do not keep failed downloads, the next call will try again
+            del self._grids[(feature, d)]
+        return result
+
+    async def _get_grid_value(self, feature: ForecastFeature, d: int, timestamp: date,
+                              position: Tuple[float, float]) -> dict:
+        grid = await self._get_grid(feature, d, timestamp)
+        day = timestamp + timedelta(days=d)
+        if grid is None:
+            return {(feature, day): FeatureValue(value=None, timestamp=None)}
+        # The timestamp is the date of the forecast, as the keys of the result
+        return {(feature, day): FeatureValue(value=grid.nearest(position), timestamp=day)}
+
+    async def _download_grid(self, feature: ForecastFeature, d: int) -> RegularGrid | None:
+        lon_min, lat_min, lon_max, lat_max = self._grid_bbox
+        querystring = {"service": "WCS",
+                       "version": "1.0.0",
+                       "request": "GetCoverage",
+                       "coverage": f"{feature}_d{d}",
+                       "crs": "EPSG:4326",
+                       "bbox": f"{lon_min},{lat_min},{lon_max},{lat_max}",
+                       "resx": f"{self._grid_resolution}",
+                       "resy": f"{self._grid_resolution}",
+                       "format": "ArcGrid"}
+        try:
+            r: ClientResponse = await self._api_wrapper(_forecast_wcs_base_url, querystring)
+            return RegularGrid.from_arcgrid(await r.text())
+        except (IrcelineApiError, ClientResponseError, ValueError) as e:
+            self._report_feature_error(feature, e)
+            return None
+
+    async def _get_multi_layer(self, base_querystring: dict, keys: List[Tuple[ForecastFeature, int]],
+                               timestamp: date) -> dict:
+        """
+        Get the values of several (feature, day offset) with a single GetFeatureInfo request, or with one request per
+        layer if the server does not support it
+        """
+        values = await self._get_feature_info(base_querystring, [f"{feature}_d{d}" for feature, d in keys])
+        if values is not None:
+            return {(feature, timestamp + timedelta(days=d)): value for (feature, d), value in zip(keys, values)}
+
+        result = dict()
+        for r in await asyncio.gather(*[self._get_single_feature(base_querystring, d, feature, timestamp)
+                                        for feature, d in keys]):
+            result |= r
         return result
 
     async def _get_single_feature(self, base_querystring: dict, d: int, feature: ForecastFeature,
@@ -46,10 +184,10 @@ class IrcelineForecastClient(IrcelineBaseWmsClient):
                                           "query_layers": f"{feature}_d{d}"}
         try:
             r: ClientResponse = await self._api_wrapper(self._base_url, querystring)
-            r: dict = await r.json()
-            result[(feature, timestamp + timedelta(days=d))] = FeatureValue(
-                value=r.get('features', [{}])[0].get('properties', {}).get('GRAY_INDEX'),
-                timestamp=datetime.fromisoformat(r.get('timeStamp')) if 'timeStamp' in r else None)
-        except (IrcelineApiError, ClientResponseError, IndexError):
+            value = self._feature_value(await r.json(), 0)
+            self._mark_stale(r, [value])
+            result[(feature, timestamp + timedelta(days=d))] = value
+        except (IrcelineApiError, ClientResponseError, IndexError) as e:
+            self._report_feature_error(feature, e)
             result[(feature, timestamp + timedelta(days=d))] = FeatureValue(value=None, timestamp=None)
         return result
@@ -0,0 +1,242 @@
+from array import array
+from collections import Counter
+from math import nan, isnan, floor
+from typing import Tuple, Sequence
+
+
+class RegularGrid:
+    """
+    Values on a regular grid of nodes, stored row-major in a compact array of doubles.  Node (i, j) is located at
+    (origin[0] + i * step[0], origin[1] + j * step[1]), using the same coordinate order as the positions that are looked
+    up (e.g. (lat, lon) for EPSG:4326).  Missing values are stored as NaN.
+    """
+    __slots__ = ('origin', 'step', 'shape', 'values')
+
+    def __init__(self,
+                 origin: Tuple[float, float],
+                 step: Tuple[float, float],
+                 shape: Tuple[int, int],
+                 values: array | None = None) -> None:
+        """
+        :param origin: coordinates of the node (0, 0)
+        :param step: distance between two nodes along each axis
+        :param shape: number of nodes along each axis
+        :param values: row-major array of doubles of size shape[0] * shape[1], filled with NaN if None
+        """
+        if values is None:
+            values = array('d', [nan]) * (shape[0] * shape[1])
+        if len(values) != shape[0] * shape[1]:
+            raise ValueError(f"Expected {shape[0] * shape[1]} values, got {len(values)}")
+        self.origin = origin
+        self.step = step
+        self.shape = shape
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _index(self, position: Tuple[float, float]) -> int | None:
+        i = round((position[0] - self.origin[0]) / self.step[0])
+        j = round((position[1] - self.origin[1]) / self.step[1])
+        if 0 <= i < self.shape[0] and 0 <= j < self.shape[1]:
+            return i * self.shape[1] + j
+        return None
+
+    def nearest(self, position: Tuple[float, float]) -> float | None:
+        """
+        Get the value of the node nearest to the position
+        :param position: coordinates, in the same order and system as the origin
+        :return: value of the nearest node or None if the position is outside the grid or the value is missing
+        """
+        index = self._index(position)
+        if index is None or isnan(self.values[index]):
+            return None
+        return self.values[index]
+
+    def bilinear(self, position: Tuple[float, float]) -> float | None:
+        """
+        Get the value at the position by bilinear interpolation of the four surrounding nodes.  Missing nodes are
+        ignored and the weights of the remaining nodes are normalized.
+        :param position: coordinates, in the same order and system as the origin
+        :return: interpolated value or None if the position is outside the grid or all the surrounding nodes are missing
+        """
+        value = self.bilinear_many([position])[0]
+        return None if isnan(value) else value
+
+    def nearest_many(self, positions: Sequence[Tuple[float, float]]) -> Sequence[float]:
+        """
+        Get the value of the node nearest to each position
+        :param positions: sequence of coordinates or NumPy array of shape (n, 2)
+        :return: array of doubles (NumPy array for NumPy input) with NaN where the value is missing
+        """
+        if hasattr(positions, 'shape'):
+            return self._nearest_numpy(positions)
+
+        (o0, o1), (s0, s1), (n0, n1) = self.origin, self.step, self.shape
+        values = self.values
+        result = array('d', [nan]) * len(positions)
+        for k, (p0, p1) in enumerate(positions):
+            i, j = round((p0 - o0) / s0), round((p1 - o1) / s1)
+            if 0 <= i < n0 and 0 <= j < n1:
+                result[k] = values[i * n1 + j]
+        return result
+
+    def bilinear_many(self, positions: Sequence[Tuple[float, float]]) -> Sequence[float]:
+        """
+        Get the value at each position by bilinear interpolation, see bilinear
+        :param positions: sequence of coordinates or NumPy array of shape (n, 2)
+        :return: array of doubles (NumPy array for NumPy input) with NaN where the value is missing
+        """
+        if hasattr(positions, 'shape'):
+            return self._bilinear_numpy(positions)
+
+        (o0, o1), (s0, s1), (n0, n1) = self.origin, self.step, self.shape
+        values = self.values
+        result = array('d', [nan]) * len(positions)
+        for k, (p0, p1) in enumerate(positions):
+            f0, f1 = (p0 - o0) / s0, (p1 - o1) / s1
+            if not (0 <= f0 <= n0 - 1 and 0 <= f1 <= n1 - 1):
+                continue
+            i, j = min(floor(f0), max(n0 - 2, 0)), min(floor(f1), max(n1 - 2, 0))
+            t0, t1 = f0 - i, f1 - j
+            total, weights = 0., 0.
+            for di, dj, w in ((0, 0, (1 - t0) * (1 - t1)), (0, 1, (1 - t0) * t1),
+                              (1, 0, t0 * (1 - t1)), (1, 1, t0 * t1)):
+                if w == 0 or i + di >= n0 or j + dj >= n1:
+                    continue
+                v = values[(i + di) * n1 + j + dj]
+                if not isnan(v):
+                    total += w * v
+                    weights += w
+            if weights > 0:
+                result[k] = total / weights
+        return result
+
+    def _nearest_numpy(self, positions):
+        import numpy as np
+
+        values = np.frombuffer(self.values, dtype=np.float64)
+        i = np.rint((positions[:, 0] - self.origin[0]) / self.step[0]).astype(np.int64)
+        j = np.rint((positions[:, 1] - self.origin[1]) / self.step[1]).astype(np.int64)
+        inside = (i >= 0) & (i < self.shape[0]) & (j >= 0) & (j < self.shape[1])
+        result = np.full(len(positions), np.nan)
+        result[inside] = values[i[inside] * self.shape[1] + j[inside]]
+        return result
+
+    def _bilinear_numpy(self, positions):
+        import numpy as np
+
+        n0, n1 = self.shape
+        values = np.frombuffer(self.values, dtype=np.float64)
+        f0 = (positions[:, 0] - self.origin[0]) / self.step[0]
+        f1 = (positions[:, 1] - self.origin[1]) / self.step[1]
+        inside = (f0 >= 0) & (f0 <= n0 - 1) & (f1 >= 0) & (f1 <= n1 - 1)
+        i = np.clip(np.floor(f0), 0, max(n0 - 2, 0)).astype(np.int64)
+        j = np.clip(np.floor(f1), 0, max(n1 - 2, 0)).astype(np.int64)
+        t0, t1 = f0 - i, f1 - j
+
+        total, weights = np.zeros(len(positions)), np.zeros(len(positions))
+        for di, dj, w in ((0, 0, (1 - t0) * (1 - t1)), (0, 1, (1 - t0) * t1),
+                          (1, 0, t0 * (1 - t1)), (1, 1, t0 * t1)):
+            ii, jj = np.minimum(i + di, n0 - 1), np.minimum(j + dj, n1 - 1)
+            v = values[ii * n1 + jj]
+            valid = inside & (w > 0) & ~np.isnan(v)
+            total += np.where(valid, w * np.nan_to_num(v), 0)
+            weights += np.where(valid, w, 0)
+
+        result = np.full(len(positions), np.nan)
+        np.divide(total, weights, out=result, where=weights > 0)
+        return result
+
+    @classmethod
+    def from_csv(cls, text: str, delimiter: str = ';',
+                 step: Tuple[float, float] | None = None) -> 'RegularGrid':
+        """
+        Parse a gridded CSV file with id;lat;lon;value lines (such as the IRCEL forecast grids) into a RegularGrid.
+        Invalid lines are ignored, nodes without a line are missing.  Raises ValueError if no valid line is found or if
+        a point does not lie on the grid.
+        :param text: content of the CSV file
+        :param delimiter: delimiter between the fields
+        :param step: (lat, lon) distance between two nodes, inferred from the most common distance between consecutive
+            coordinates if None
+        :return: RegularGrid in (lat, lon) order
+        """
+        points = list()
+        for line in text.splitlines():
+            parts = line.split(delimiter)
+            if len(parts) != 4:
+                continue
+            try:
+                lat, lon, value = float(parts[1]), float(parts[2]), float(parts[3])
+            except ValueError:
+                continue
+            points.append((lat, lon, value))
+
+        if not points:
+            raise ValueError("No valid line in gridded CSV")
+
+        origin, steps, shape = list(), list(), list()
+        for axis in range(2):
+            coords = sorted({p[axis] for p in points})
+            if step is not None:
+                s = step[axis]
+            else:
+                # Most common distance between consecutive coordinates, the smallest one in case of a tie
+                diffs = Counter(round(b - a, 9) for a, b in zip(coords, coords[1:]) if b - a > 1e-9)
+                s = min(diffs, key=lambda d: (-diffs[d], d)) if diffs else 1.
+            for c in coords:
+                k = (c - coords[0]) / s
+                if abs(k - round(k)) > 1e-6:
+                    raise ValueError(f"Coordinate {c} is not on the grid of step {s} from {coords[0]}")
+            origin.append(coords[0])
+            steps.append(s)
+            shape.append(round((coords[-1] - coords[0]) / s) + 1)
+
+        grid = cls((origin[0], origin[1]), (steps[0], steps[1]), (shape[0], shape[1]))
+        for lat, lon, value in points:
+            grid.values[grid._index((lat, lon))] = value
+        return grid
+
+    @classmethod
+    def from_arcgrid(cls, text: str) -> 'RegularGrid':
+        """
+        Parse an ESRI ASCII grid (ArcGrid format) into a RegularGrid.  Raises ValueError if the text is not valid.
+        :param text: content of the ArcGrid file
+        :return: RegularGrid with one node per cell, located at the center of the cell, in (y, x) order (i.e. (lat, lon)
+            for EPSG:4326)
+        """
+        lines = iter(text.splitlines())
+        header = dict()
+        for line in lines:
+            parts = line.split()
+            if len(parts) == 2 and parts[0][0].isalpha():
+                header[parts[0].lower()] = float(parts[1])
+            elif parts:
+                break
+        else:
+            raise ValueError("No data in ArcGrid")
+
+        try:
+            ncols, nrows = int(header['ncols']), int(header['nrows'])
+            dx = header.get('dx', header.get('cellsize'))
+            dy = header.get('dy', header.get('cellsize'))
+            x0 = header['xllcenter'] if 'xllcenter' in header else header['xllcorner'] + dx / 2
+            y0 = header['yllcenter'] if 'yllcenter' in header else header['yllcorner'] + dy / 2
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid ArcGrid header: {e}") from e
+        nodata = header.get('nodata_value', None)
+
+        rows = [parts] + [line.split() for line in lines if line.strip()]
+        if len(rows) != nrows or any(len(r) != ncols for r in rows):
+            raise ValueError(f"Expected {nrows} rows of {ncols} values in ArcGrid")
+
+        values = array('d')
+        # ArcGrid rows are written from north to south
+        for r in reversed(rows):
+            values.extend(float(v) for v in r)
+        if nodata is not None:
+            for k, v in enumerate(values):
+                if v == nodata:
+                    values[k] = nan
+
+        return cls((y0, x0), (dy, dx), (nrows, ncols), values)
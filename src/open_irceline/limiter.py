@@ -0,0 +1,140 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, AsyncIterator
+from urllib.parse import urlsplit
+
+
+class RequestLimiter:
+    """
+    Limits the requests sent to each host: at most max_in_flight concurrent requests and, if rate is set, a sustained
+    rate of rate requests per second with bursts of at most burst requests (token bucket).  Requests answered with a
+    status in retry_statuses are retried up to max_retries times with exponential backoff and full jitter.
+    The same limiter can be shared by several clients to apply the limits to all of them.
+    """
+    retry_statuses = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self,
+                 max_in_flight: int = 8,
+                 rate: float | None = None,
+                 burst: int = 1,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.) -> None:
+        """
+        :param max_in_flight: maximum number of concurrent requests per host
+        :param rate: maximum number of requests per second per host, unlimited if None
+        :param burst: maximum number of requests that can be sent at once when the rate allows it
+        :param max_retries: maximum number of retries for a request
+        :param backoff: base delay in seconds before the first retry, doubled for each new retry
+        :param max_backoff: maximum delay in seconds between two retries
+        """
+        self._max_in_flight = max_in_flight
+        self._rate = rate
+        self._burst = burst
+        self.max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._semaphores: Dict[str, asyncio.Semaphore] = dict()
+        # host -> [available tokens, time of the last refill]
+        self._buckets: Dict[str, list] = dict()
+        self._bucket_locks: Dict[str, asyncio.Lock] = dict()
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """
+        Wait until a request can be sent to the host of the URL and hold the slot while the request is in flight
+        :param url: URL of the request
+        """
+        host = urlsplit(url).hostname or ''
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self._max_in_flight))
+        async with semaphore:
+            if self._rate is not None:
+                await self._take_token(host)
+            yield
+
+    async def _take_token(self, host: str) -> None:
+        loop = asyncio.get_running_loop()
+        lock = self._bucket_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            bucket = self._buckets.setdefault(host, [float(self._burst), loop.time()])
+            while True:
+                now = loop.time()
+                bucket[0] = min(float(self._burst), bucket[0] + (now - bucket[1]) * self._rate)
+                bucket[1] = now
+                if bucket[0] >= 1:
+                    bucket[0] -= 1
+                    return
+                await asyncio.sleep((1 - bucket[0]) / self._rate)
+
+    def retry_delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        Compute the delay before retrying a request
+        :param attempt: number of the attempt that failed, starting at 0
+        :param retry_after: value of the Retry-After header of the response, if any
+        :return: delay in seconds
+        """
+        delay = random.uniform(0, min(self._max_backoff, self._backoff * 2 ** attempt))
+        try:
+            return max(delay, min(self._max_backoff, float(retry_after)))
+        except (TypeError, ValueError):
+            return delay
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an endpoint (host and path of the URL) after failure_threshold consecutive failed
+    requests (timeouts, connection errors and responses with a 5xx status), so that the callers fail immediately
+    instead of waiting for a degraded server.  While the circuit of an endpoint is open, a single probe request is let
+    through every reset_timeout seconds and the circuit closes again as soon as a request succeeds.
+    The same breaker can be shared by several clients to apply it to all of them.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.) -> None:
+        """
+        :param failure_threshold: number of consecutive failures opening the circuit of an endpoint
+        :param reset_timeout: delay in seconds between two probe requests while the circuit is open
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        # endpoint -> number of consecutive failures
+        self._failures: Dict[str, int] = dict()
+        # endpoint of an open circuit -> time.monotonic() from which the next probe request is allowed
+        self._next_probe: Dict[str, float] = dict()
+
+    @staticmethod
+    def _endpoint(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.hostname}{parts.path}"
+
+    def is_open(self, url: str) -> bool:
+        return self._endpoint(url) in self._next_probe
+
+    def allow(self, url: str) -> bool:
+        """
+        Check if a request can be sent to the endpoint of the URL.  When the circuit is open and a probe is due, the
+        request is allowed and counts as the probe.
+        :param url: URL of the request
+        :return: True if the request can be sent
+        """
+        endpoint = self._endpoint(url)
+        next_probe = self._next_probe.get(endpoint, None)
+        if next_probe is None:
+            return True
+        now = time.monotonic()
+        if now < next_probe:
+            return False
+        self._next_probe[endpoint] = now + self._reset_timeout
+        return True
+
+    def record_success(self, url: str) -> None:
+        endpoint = self._endpoint(url)
+        self._failures.pop(endpoint, None)
+        self._next_probe.pop(endpoint, None)
+
+    def record_failure(self, url: str) -> None:
+        endpoint = self._endpoint(url)
+        self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+        if self._failures[endpoint] >= self._failure_threshold:
+            self._next_probe[endpoint] = time.monotonic() + self._reset_timeout
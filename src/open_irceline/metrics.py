@@ -0,0 +1,201 @@
+import time
+from bisect import bisect_left
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+class RequestRecord:
+    """
+    Measures of a single API request, including its retries.  Durations are in seconds and are None when they could not
+    be measured (e.g. connect is only measured when the trace config of the instrumentation is set on the session and a
+    new connection was opened, body is None when the request failed before the body was read).
+    """
+    __slots__ = ('method', 'url', 'status', 'size', 'retries', 'wait', 'connect', 'ttfb', 'body', 'parse', 'error')
+
+    def __init__(self, method: str, url: str) -> None:
+        self.method = method
+        self.url = url
+        self.status: int | None = None
+        self.size: int | None = None
+        self.retries = 0
+        # Time spent waiting for a slot of the RequestLimiter
+        self.wait = 0.
+        # Time spent opening new connections (DNS, TCP and TLS)
+        self.connect: float | None = None
+        # Time between sending the request and receiving the response headers, including connect
+        self.ttfb: float | None = None
+        # Time spent reading the response body
+        self.body: float | None = None
+        # Time spent decoding the response body (JSON or text)
+        self.parse: float | None = None
+        self.error: BaseException | None = None
+
+    def __repr__(self) -> str:
+        return (f"RequestRecord({self.method} {self.url}, status={self.status}, size={self.size}, "
+                f"retries={self.retries}, wait={self.wait}, connect={self.connect}, ttfb={self.ttfb}, "
+                f"body={self.body}, parse={self.parse}, error={self.error!r})")
+
+
+class Instrumentation:
+    """
+    Hooks called by the clients to report their requests.  Subclass it and override the hooks needed, every hook does
+    nothing by default.  Set the same instance on several clients to aggregate their measures.
+    To measure the connection times, add the result of trace_config to the trace_configs of the aiohttp session.
+    """
+
+    def on_request(self, record: RequestRecord) -> None:
+        """
+        Called when a request completed or failed, once its body is read
+        :param record: measures of the request, record.parse is still None at this point
+        """
+
+    def on_parse(self, record: RequestRecord) -> None:
+        """
+        Called each time the body of a response is decoded
+        :param record: measures of the request, with record.parse set
+        """
+
+    def on_feature_error(self, client: str, feature: str, exception: BaseException) -> None:
+        """
+        Called when a client could not get the value of a feature and returned a missing value instead of raising
+        :param client: name of the client class
+        :param feature: name of the feature
+        :param exception: exception that caused the missing value
+        """
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Create an aiohttp trace config measuring the time spent opening connections, to add to the trace_configs of
+        the session used by the clients
+        :return: trace config setting RequestRecord.connect
+        """
+
+        async def on_connection_create_start(_session, ctx, _params) -> None:
+            ctx.connect_start = time.perf_counter()
+
+        async def on_connection_create_end(_session, ctx, _params) -> None:
+            record = ctx.trace_request_ctx
+            if isinstance(record, RequestRecord) and hasattr(ctx, 'connect_start'):
+                record.connect = (record.connect or 0.) + time.perf_counter() - ctx.connect_start
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket bounds, keeping the count, sum, minimum and maximum of the observed values.  Quantiles
+    are estimated by linear interpolation inside the bucket.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        """
+        :param bounds: sorted upper bounds of the buckets (inclusive), values above the last bound are counted in an
+            extra bucket
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min: float | None = None
+        self.max: float | None = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Estimate the quantile of the observed values
+        :param q: quantile between 0 and 1 (e.g. 0.99 for p99)
+        :return: estimated value or None if nothing was observed
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for k, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.min if k == 0 else max(self.bounds[k - 1], self.min)
+                upper = self.max if k == len(self.bounds) else min(self.bounds[k], self.max)
+                return lower + (upper - lower) * max(rank - seen, 0) / n
+            seen += n
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.quantile(.5),
+                'p90': self.quantile(.9),
+                'p99': self.quantile(.99)}
+
+
+# Bucket bounds of the measures, in seconds, bytes and number of retries
+_duration_bounds = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+_bounds = {'size': tuple(float(2 ** k) for k in range(8, 27)),
+           'retries': (0., 1., 2., 3., 5., 10.)}
+
+
+class MetricsCollector(Instrumentation):
+    """
+    Instrumentation keeping in memory a histogram of each measure (wait, connect, ttfb, body, parse, size and retries)
+    per endpoint, as well as the number of requests per status and the number of missing values per feature.
+    """
+
+    def __init__(self) -> None:
+        # (measure, endpoint) -> histogram, endpoint being the host and path of the URL
+        self.histograms: Dict[Tuple[str, str], Histogram] = dict()
+        # (endpoint, status or exception name) -> number of requests
+        self.requests: Dict[Tuple[str, int | str], int] = dict()
+        # (client, feature) -> number of missing values
+        self.feature_errors: Dict[Tuple[str, str], int] = dict()
+
+    def _observe(self, measure: str, endpoint: str, value: float | None) -> None:
+        if value is None:
+            return
+        if (measure, endpoint) not in self.histograms:
+            self.histograms[(measure, endpoint)] = Histogram(_bounds.get(measure, _duration_bounds))
+        self.histograms[(measure, endpoint)].observe(value)
+
+    @staticmethod
+    def _endpoint(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.hostname}{parts.path}"
+
+    def on_request(self, record: RequestRecord) -> None:
+        endpoint = self._endpoint(record.url)
+        outcome = record.status if record.error is None else type(record.error).__name__
+        self.requests[(endpoint, outcome)] = self.requests.get((endpoint, outcome), 0) + 1
+        for measure in ('wait', 'connect', 'ttfb', 'body', 'size', 'retries'):
+            self._observe(measure, endpoint, getattr(record, measure))
+
+    def on_parse(self, record: RequestRecord) -> None:
+        self._observe('parse', self._endpoint(record.url), record.parse)
+
+    def on_feature_error(self, client: str, feature: str, exception: BaseException) -> None:
+        self.feature_errors[(client, feature)] = self.feature_errors.get((client, feature), 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, dict]]:
+        """
+        :return: dict where key is the endpoint and value is a dict of the summary of each measure (count, sum, min,
+            max, p50, p90 and p99)
+        """
+        result = dict()
+        for (measure, endpoint), histogram in sorted(self.histograms.items()):
+            result.setdefault(endpoint, dict())[measure] = histogram.summary()
+        return result
+
+    def clear(self) -> None:
+        self.histograms.clear()
+        self.requests.clear()
+        self.feature_errors.clear()
@@ -1,13 +1,44 @@
 import asyncio
+import json
+import re
+from array import array
 from datetime import datetime, date, UTC, timedelta
-from typing import List, Tuple, Dict, Set
+from email.utils import parsedate_to_datetime
+from functools import partial
+from math import isnan, floor
+from typing import List, Tuple, Dict, Set, Iterator, AsyncIterator, Hashable, Callable
 from xml.etree import ElementTree
 
+import aiohttp
 from aiohttp import ClientResponse, ClientResponseError
+from multidict import CIMultiDict
 
-from .api import IrcelineBaseClient, _rio_wfs_base_url, IrcelineApiError, _rio_ifdm_wms_base_url, IrcelineBaseWmsClient
-from .data import RioFeature, FeatureValue, RioIfdmFeature
-from .utils import epsg_transform
+from .api import (IrcelineBaseClient, _rio_wfs_base_url, IrcelineApiError, _rio_ifdm_wms_base_url,
+                  _rio_ifdm_wcs_base_url, IrcelineBaseWmsClient, _CapabilitiesParser)
+from .cache import RioCellCache
+from .data import RioFeature, FeatureValue, RioIfdmFeature, TimeSeries
+from .grid import RegularGrid
+from .transport import _BufferedResponse
+from .utils import epsg_transform, epsg_transform_many, geometry_bbox, CellIndex, json_loads, _lambert72
+
+# Time filter of the requests for the latest values at positions, see IrcelineRioClient._stale_key
+_period_clause = re.compile(r"^(timestamp|date)>='[^']*' AND (?=INTERSECTS\()")
+
+
+def _parse_timestamp(raw: str, is_date: bool) -> datetime | date | None:
+    """
+    Parse the timestamp or date property of a WFS feature
+    :param raw: value of the property
+    :param is_date: True if the property is a date, False if it is a timestamp
+    :return: parsed value or None if it is not valid
+    """
+    try:
+        if is_date:
+            # Cut last character as the date is written '2024-06-15Z' which is not ISO compliant
+            return date.fromisoformat(raw[:-1])
+        return datetime.fromisoformat(raw)
+    except (TypeError, ValueError):
+        return None
 
 
 class IrcelineRioClient(IrcelineBaseClient):
@@ -16,6 +47,35 @@ class IrcelineRioClient(IrcelineBaseClient):
     RIO is more coarse grained for interpolation than RIO IFDM and allows to request multiple features in the same
         request, which may be faster.
     """
+    _max_points_per_request = 200
+    _timeseries_chunk = timedelta(days=7)
+    _page_size = 1000
+    # (min lat, min lon, max lat, max lon) of the region covered by RIO
+    _belgium_bbox = (49.45, 2.5, 51.55, 6.45)
+    # noinspection HttpUrlsUsage
+    # We never connect to the URL, it is just the namespace in the XML
+    _capabilities_path = ('{http://www.opengis.net/wfs}FeatureTypeList',
+                          '{http://www.opengis.net/wfs}FeatureType',
+                          '{http://www.opengis.net/wfs}Name')
+
+    def __init__(self,
+                 session: aiohttp.ClientSession,
+                 cell_cache: RioCellCache | None = None,
+                 lean: bool = False,
+                 **kwargs) -> None:
+        """
+        :param session: aiohttp session to use for the requests
+        :param cell_cache: optional cache of the RIO cells, to answer requests for positions in already known cells
+            without calling the API
+        :param lean: if True, get_data and get_timeseries only request the value and the time attribute of the WFS
+            features, without their geometry, making the responses several times smaller.  get_data does not fill the
+            cell cache in this mode as the cells are unknown, get_data_many still requests the geometries it needs to
+            assign the cells to the positions.
+        :param kwargs: see IrcelineBaseClient
+        """
+        super().__init__(session, **kwargs)
+        self._cell_cache = cell_cache
+        self._lean = lean
 
     async def get_data(self,
                        features: List[RioFeature],
@@ -29,33 +89,401 @@ class IrcelineRioClient(IrcelineBaseClient):
         :param position: decimal degrees pair of coordinates
         :return: dict with the response (key is RioFeature, value is FeatureValue with actual value and timestamp)
         """
+        key, timestamp = self._timestamp_filter(timestamp)
+        lat, lon = epsg_transform(position)
+        period = f"{key}>='{timestamp}'"
+        if self._cell_cache is not None:
+            cached = self._cell_cache.get(features, period, (lat, lon))
+            if cached is not None:
+                return cached
+        querystring = self._wfs_querystring(features,
+                                            f"{period}"
+                                            f" AND "
+                                            f"INTERSECTS(the_geom, POINT ({lat} {lon}))",
+                                            key if self._lean else None)
+        # In lean mode, the cells are unknown: the disk cache stores the whole responses instead
+        fetch = None
+        if self._disk_cache is not None and not self._lean:
+            fetch = partial(self._fetch_cells, features, period, [(lat, lon)], lambda _: querystring)
+        r: ClientResponse = await self._api_wrapper(_rio_wfs_base_url, querystring, fetch=fetch)
+        data = await r.json(loads=json_loads)
+        stale = self._stale_age(r) is not None
+        if self._cell_cache is not None and not self._lean and not stale:
+            for bbox, cell_features in self._group_by_cell(data).items():
+                self._cell_cache.put(features, period, bbox, self._format_result(
+                    'rio', {'type': 'FeatureCollection', 'features': cell_features}, features))
+        result = self._format_result('rio', data, features)
+        self._mark_stale(r, result.values())
+        return result
+
+    async def get_data_many(self,
+                            features: List[RioFeature],
+                            positions: List[Tuple[float, float]],
+                            timestamp: datetime | date | None = None
+                            ) -> Dict[Tuple[float, float], Dict[RioFeature, FeatureValue]]:
+        """
+        Call the WFS API to get the interpolated level of RioFeature for many positions at once.  The positions are
+        sent in chunks of at most _max_points_per_request points, each chunk being a single WFS request.  The returned
+        RIO cells are then assigned back to the positions they contain.  Raises exception upon API error
+        :param timestamp: datetime for which to get the data for
+        :param features: list of RioFeature to fetch from the API
+        :param positions: list of decimal degrees pairs of coordinates or NumPy array of shape (n, 2)
+        :return: dict where key is the position (as a tuple for NumPy input) and value is a dict as returned by get_data
+            for that position
+        """
+        key, timestamp = self._timestamp_filter(timestamp)
+        period = f"{key}>='{timestamp}'"
+        transformed = epsg_transform_many(positions)
+        if hasattr(positions, 'shape'):
+            # Rows of NumPy arrays are not hashable
+            positions = [tuple(p) for p in positions.tolist()]
+        points = dict(zip(positions, transformed))
+
+        result = dict()
+        if self._cell_cache is not None:
+            for position, point in points.items():
+                cached = self._cell_cache.get(features, period, point)
+                if cached is not None:
+                    result[position] = cached
+
+        unique_points = list(dict.fromkeys(p for position, p in points.items() if position not in result))
+        chunks = [unique_points[i:i + self._max_points_per_request]
+                  for i in range(0, len(unique_points), self._max_points_per_request)]
+
+        tasks = [asyncio.create_task(self._get_cells(features, period, chunk)) for chunk in chunks]
+        results = await asyncio.gather(*tasks)
+
+        cells = CellIndex()
+        for r, grouped in results:
+            stale = self._stale_age(r) is not None
+            for bbox, cell_features in grouped.items():
+                formatted = self._format_result('rio', {'type': 'FeatureCollection', 'features': cell_features},
+                                                features)
+                self._mark_stale(r, formatted.values())
+                cells.add(bbox, formatted)
+                if self._cell_cache is not None and not stale:
+                    self._cell_cache.put(features, period, bbox, formatted)
+
+        for position, point in points.items():
+            if position not in result:
+                result[position] = dict(cells.find(point) or dict())
+
+        return result
+
+    async def get_latest_timestamp(self,
+                                   features: List[RioFeature],
+                                   position: Tuple[float, float]) -> datetime | None:
+        """
+        Get the timestamp of the most recent values published for the features at the position, bypassing the caches.
+        Only considers the hourly values published during the last two hours.  Raises exception upon API error
+        :param features: list of RioFeature to check (e.g. _hmean features)
+        :param position: decimal degrees pair of coordinates
+        :return: most recent timestamp or None if no value was published during the last two hours
+        """
+        key, timestamp = self._timestamp_filter(datetime.now(UTC))
+        x, y = epsg_transform(position)
+        querystring = self._wfs_querystring(features,
+                                            f"{key}>='{timestamp}'"
+                                            f" AND "
+                                            f"INTERSECTS(the_geom, POINT ({x} {y}))",
+                                            key)
+        r: ClientResponse = await self._request(_rio_wfs_base_url, querystring)
+        result = self._format_result('rio', await r.json(loads=json_loads), features)
+        return max((v['timestamp'] for v in result.values()), default=None)
+
+    async def get_timeseries(self,
+                             features: List[RioFeature],
+                             position: Tuple[float, float],
+                             start: datetime | date,
+                             end: datetime | date
+                             ) -> Dict[RioFeature, TimeSeries]:
+        """
+        Call the WFS API to get every value of the RioFeatures between start (included) and end (excluded).  The range
+        is split in chunks of _timeseries_chunk fetched concurrently, each chunk being paged with _page_size features
+        per request.  Raises exception upon API error
+        :param features: list of RioFeature to fetch from the API (e.g. only _hmean or only _dmean features)
+        :param position: decimal degrees pair of coordinates
+        :param start: first datetime (for hourly features) or date (for daily features) to get
+        :param end: datetime or date after the last one to get
+        :return: dict where key is RioFeature and value is the TimeSeries of the feature
+        """
+        if isinstance(start, datetime) and isinstance(end, datetime):
+            if (start.tzinfo is None) != (end.tzinfo is None):
+                raise IrcelineApiError("start and end must both be timezone-aware or both be naive datetimes")
+            key = 'timestamp'
+        elif (isinstance(start, date) and isinstance(end, date) and
+              not isinstance(start, datetime) and not isinstance(end, datetime)):
+            key = 'date'
+        else:
+            raise IrcelineApiError(f"Wrong parameter types for start and end: {type(start)}, {type(end)}")
+
+        x, y = epsg_transform(position)
+        bounds = list()
+        while start < end:
+            bounds.append((start, min(start + self._timeseries_chunk, end)))
+            start = bounds[-1][1]
+
+        tasks = [asyncio.create_task(self._get_pages(
+            features, key, f"{key}>='{lower.isoformat()}' AND {key}<'{upper.isoformat()}'"
+                           f" AND INTERSECTS(the_geom, POINT ({x} {y}))"))
+            for lower, upper in bounds]
+        results = await asyncio.gather(*tasks)
+
+        values = dict()
+        for r in results:
+            for name, timestamp, value in r:
+                values.setdefault(name, dict())[TimeSeries.posix_timestamp(timestamp)] = value
+
+        result = dict()
+        for name, series in values.items():
+            timestamps = sorted(series)
+            result[name] = TimeSeries(array('q', timestamps), array('d', (series[t] for t in timestamps)))
+        return result
+
+    async def get_grid(self,
+                       features: List[RioFeature],
+                       bbox: Tuple[float, float, float, float] | None = None,
+                       timestamp: datetime | date | None = None
+                       ) -> Dict[RioFeature, Tuple[datetime | date, RegularGrid]]:
+        """
+        Call the WFS API to get every RIO cell in a region with a single BBOX-filtered request per page of
+        _page_size features, and arrange the values of each feature in a grid of the cells.  Raises exception upon API
+        error
+        :param features: list of RioFeature to fetch from the API
+        :param bbox: (min lat, min lon, max lat, max lon) of the region in decimal degrees, the whole of Belgium if None
+        :param timestamp: datetime for which to get the data for, as in get_data
+        :return: dict where key is RioFeature and value is (most recent timestamp, grid).  The grid has one node per
+            cell, at the center of the cell, in EPSG:31370 (x, y) coordinates, holding the most recent value of the
+            cell (NaN where the cell is missing).  Features without any value are absent.  See sample_grid to get the
+            values at EPSG:4326 positions.
+        """
+        key, lower = self._timestamp_filter(timestamp)
+        lat_min, lon_min, lat_max, lon_max = bbox if bbox is not None else self._belgium_bbox
+        corners = epsg_transform_many([(lat_min, lon_min), (lat_min, lon_max), (lat_max, lon_min), (lat_max, lon_max)])
+        xs, ys = [c[0] for c in corners], [c[1] for c in corners]
+        cql_filter = f"{key}>='{lower}' AND BBOX(the_geom, {min(xs)}, {min(ys)}, {max(xs)}, {max(ys)})"
+
+        # feature name -> {cell bbox: (timestamp, value)}
+        cells: Dict[str, Dict[tuple, Tuple[datetime | date, float]]] = dict()
+        async for data in self._iter_pages(features, key, cql_filter, lean=False):
+            for cell, cell_features in self._group_by_cell(data).items():
+                collection = {'type': 'FeatureCollection', 'features': cell_features}
+                for name, t, value in self._iter_values('rio', collection, features):
+                    feature_cells = cells.setdefault(name, dict())
+                    if cell not in feature_cells or feature_cells[cell][0] < t:
+                        feature_cells[cell] = (t, value)
+
+        return {name: self._cells_to_grid(feature_cells) for name, feature_cells in cells.items()}
+
+    @staticmethod
+    def _cells_to_grid(cells: Dict[tuple, Tuple[datetime | date, float]]) -> Tuple[datetime | date, RegularGrid]:
+        """
+        Arrange the values of the cells in a grid with one node at the center of each cell
+        :param cells: dict where key is the bounding box of the cell and value is (timestamp, value)
+        :return: (most recent timestamp, grid in EPSG:31370 (x, y) coordinates)
+        """
+        width = min(c[2] - c[0] for c in cells)
+        height = min(c[3] - c[1] for c in cells)
+        x0, y0 = min(c[0] for c in cells), min(c[1] for c in cells)
+        x1, y1 = max(c[0] for c in cells), max(c[1] for c in cells)
+        shape = (round((x1 - x0) / width) + 1, round((y1 - y0) / height) + 1)
+
+        grid = RegularGrid((x0 + width / 2, y0 + height / 2), (width, height), shape)
+        for c, (_, value) in cells.items():
+            grid.values[round((c[0] - x0) / width) * shape[1] + round((c[1] - y0) / height)] = value
+        return max(t for t, _ in cells.values()), grid
+
+    @staticmethod
+    def sample_grid(grid: RegularGrid,
+                    positions: List[Tuple[float, float]],
+                    bilinear: bool = False) -> Dict[Tuple[float, float], float | None]:
+        """
+        Get the values of a grid returned by get_grid at EPSG:4326 positions
+        :param grid: grid in EPSG:31370 (x, y) coordinates
+        :param positions: list of decimal degrees pairs of coordinates
+        :param bilinear: if True, interpolate between the centers of the cells instead of taking the value of the cell
+            containing the position.  Outside the centers of the border cells, the value of the cell is taken.
+        :return: dict where key is the position and value is the value at the position or None if it is missing
+        """
+        points = epsg_transform_many(positions)
+        values = grid.nearest_many(points)
+        if bilinear:
+            values = [n if isnan(b) else b for b, n in zip(grid.bilinear_many(points), values)]
+        return {position: None if isnan(value) else value for position, value in zip(positions, values)}
+
+    async def _get_pages(self,
+                         features: List[RioFeature],
+                         key: str,
+                         cql_filter: str) -> List[Tuple[str, datetime | date, float]]:
+        """
+        Get all the values matching the filter, requesting successive pages until a page is not full
+        :param features: list of RioFeature to fetch from the API
+        :param key: name of the time attribute used to sort the features (timestamp or date)
+        :param cql_filter: CQL filter of the request
+        :return: list of (feature name, timestamp, value)
+        """
+        result = list()
+        async for data in self._iter_pages(features, key, cql_filter, self._lean):
+            result.extend(self._iter_values('rio', data, features))
+        return result
+
+    async def _iter_pages(self,
+                          features: List[RioFeature],
+                          key: str,
+                          cql_filter: str,
+                          lean: bool) -> AsyncIterator[dict]:
+        """
+        Request successive pages of the features matching the filter until a page is not full
+        :param features: list of RioFeature to fetch from the API
+        :param key: name of the time attribute used to sort the features (timestamp or date)
+        :param cql_filter: CQL filter of the request
+        :param lean: if True, only request the value and time attributes, see __init__
+        :return: async iterator of the JSON dict of each page
+        """
+        start_index = 0
+        while True:
+            querystring = (self._wfs_querystring(features, cql_filter, key if lean else None) |
+                           {"sortBy": key,
+                            "startIndex": f"{start_index}",
+                            "count": f"{self._page_size}"})
+            r: ClientResponse = await self._api_wrapper(_rio_wfs_base_url, querystring)
+            data = await r.json(loads=json_loads)
+            yield data
+
+            returned = len(data.get('features', [])) if isinstance(data.get('features', None), list) else 0
+            if returned < self._page_size:
+                return
+            start_index += returned
+
+    async def _get_cells(self,
+                         features: List[RioFeature],
+                         period: str,
+                         points: List[Tuple[int, int]]
+                         ) -> Tuple[ClientResponse, Dict[Tuple[float, float, float, float], List[dict]]]:
+        """
+        Get all the WFS features intersecting with the points, grouped by the bounding box of their RIO cell
+        :param features: list of RioFeature to fetch from the API
+        :param period: CQL filter on the time attribute
+        :param points: list of EPSG:31370 coordinates
+        :return: (response, dict where key is the bounding box of the cell and value is the list of WFS features for
+            that cell)
+        """
+        fetch = None
+        if self._disk_cache is not None:
+            fetch = partial(self._fetch_cells, features, period, points,
+                            lambda missing: self._cells_querystring(features, period, missing))
+        r: ClientResponse = await self._api_wrapper(_rio_wfs_base_url,
+                                                    self._cells_querystring(features, period, points),
+                                                    fetch=fetch)
+        return r, self._group_by_cell(await r.json(loads=json_loads))
+
+    def _cells_querystring(self, features: List[RioFeature], period: str, points: List[Tuple[int, int]]) -> dict:
+        """
+        :return: query string of the WFS request for the features intersecting with the points
+        """
+        multipoint = ", ".join(f"({x} {y})" for x, y in points)
+        return self._wfs_querystring(features,
+                                     f"{period}"
+                                     f" AND "
+                                     f"INTERSECTS(the_geom, MULTIPOINT ({multipoint}))")
+
+    async def _fetch_cells(self,
+                           features: List[RioFeature],
+                           period: str,
+                           points: List[Tuple[int, int]],
+                           querystring: Callable[[List[Tuple[int, int]]], dict]) -> _BufferedResponse:
+        """
+        Get the WFS features of the cells containing the points upon a miss of the in-process cache.  The cells are read
+        from the disk cache, only the points outside of the cached cells are requested and the cells received are
+        stored in the disk cache, one entry per cell.
+        :param features: list of RioFeature to fetch from the API
+        :param period: CQL filter on the time attribute
+        :param points: list of EPSG:31370 coordinates
+        :param querystring: function building the query string of the WFS request for a list of points
+        :return: response whose body is the collection of the WFS features of the cells
+        """
+        names = [f'{f}' for f in features]
+        stored = await asyncio.to_thread(self._disk_cache.get_cells, 'rio', names, period, points)
+        cells = {bbox: json_loads(body) for bbox, body in stored.values()}
+        missing = [p for p in points if p not in stored]
+        if missing:
+            r = await self._request(_rio_wfs_base_url, querystring(missing), buffered=True)
+            grouped = self._group_by_cell(json_loads(r.body))
+            await asyncio.to_thread(self._disk_cache.put_cells, 'rio', names, period, self._cache_period,
+                                    {bbox: json.dumps(c).encode() for bbox, c in grouped.items()})
+            if not cells:
+                return r
+            cells |= grouped
+
+        body = json.dumps({'type': 'FeatureCollection', 'features': [f for c in cells.values() for f in c]})
+        return _BufferedResponse(200, CIMultiDict(), body.encode())
+
+    @staticmethod
+    def _group_by_cell(data: dict) -> Dict[Tuple[float, float, float, float], List[dict]]:
+        """
+        Group the features of the JSON dict returned by the WFS service by the bounding box of their RIO cell
+        :param data: JSON dict value as returned by the API
+        :return: dict where key is the bounding box of the cell and value is the list of WFS features for that cell
+        """
+        result = dict()
+        if data.get('type', None) != 'FeatureCollection' or not isinstance(data.get('features', None), list):
+            return result
+        for f in data.get('features', []):
+            bbox = geometry_bbox(f.get('geometry', None))
+            if bbox is not None:
+                result.setdefault(bbox, list()).append(f)
+        return result
+
+    def _stale_key(self, key: tuple) -> Hashable:
+        """
+        The latest values at a position do not depend on the publication period of the request: the requests of
+        get_data and get_data_many only differing by the lower bound of their time filter can be answered with each
+        other's stale responses
+        :param key: (method, URL, sorted query string items) of the request
+        :return: key without the lower bound of the time filter
+        """
+        method, url, items = key
+        return method, url, tuple((k, _period_clause.sub(r'\1', v) if k == 'cql_filter' else v) for k, v in items)
+
+    @staticmethod
+    def _timestamp_filter(timestamp: datetime | date | None) -> Tuple[str, str]:
+        """
+        Compute the attribute name and the lower bound to use in the CQL filter for the given timestamp
+        :param timestamp: datetime or date for which to get the data for, now if None
+        :return: tuple with the attribute name (timestamp or date) and the ISO formatted lower bound
+        """
         if timestamp is None:
             timestamp = datetime.now(UTC)
         # Remove one hour/day from timestamp to handle case where the hour just passed but the data is not yet there
         # (e.g. 5.01 PM, but the most recent data is for 4.00 PM)
         if isinstance(timestamp, datetime):
             timestamp = timestamp.replace(microsecond=0, second=0, minute=0) - timedelta(hours=1)
-            timestamp = timestamp.isoformat()
-            key = 'timestamp'
+            return 'timestamp', timestamp.isoformat()
         elif isinstance(timestamp, date):
             timestamp = timestamp - timedelta(days=1)
-            timestamp = timestamp.isoformat()
-            key = 'date'
+            return 'date', timestamp.isoformat()
         else:
             raise IrcelineApiError(f"Wrong parameter type for timestamp: {type(timestamp)}")
 
-        lat, lon = epsg_transform(position)
+    @staticmethod
+    def _wfs_querystring(features: List[RioFeature], cql_filter: str, key: str | None = None) -> dict:
+        """
+        Build the query string of a GetFeature request
+        :param features: list of RioFeature to fetch from the API
+        :param cql_filter: CQL filter of the request
+        :param key: if set, only the value and this time attribute (timestamp or date) are requested, without geometry
+        :return: query string dict
+        """
         querystring = {"service": "WFS",
                        "version": "1.3.0",
                        "request": "GetFeature",
                        "outputFormat": "application/json",
                        "typeName": ",".join(features),
-                       "cql_filter":
-                           f"{key}>='{timestamp}'"
-                           f" AND "
-                           f"INTERSECTS(the_geom, POINT ({lat} {lon}))"}
-        r: ClientResponse = await self._api_wrapper(_rio_wfs_base_url, querystring)
-        return self._format_result('rio', await r.json(), features)
+                       "cql_filter": cql_filter}
+        if key is not None:
+            # One list of properties per type name
+            querystring["propertyName"] = f"(value,{key})" * len(features)
+        return querystring
 
     async def get_capabilities(self) -> Set[str]:
         """
@@ -65,9 +493,7 @@ class IrcelineRioClient(IrcelineBaseClient):
         querystring = {"service": "WFS",
                        "version": "1.3.0",
                        "request": "GetCapabilities"}
-        r: ClientResponse = await self._api_wrapper(_rio_wfs_base_url, querystring)
-
-        return self._parse_capabilities(await r.text())
+        return await self._get_capabilities(_rio_wfs_base_url, querystring, self._capabilities_path)
 
     @staticmethod
     def _parse_capabilities(xml_string: str) -> Set[str]:
@@ -76,18 +502,9 @@ class IrcelineRioClient(IrcelineBaseClient):
         :param xml_string: XML string to parse
         :return: set of FeatureType Names found in the XML document
         """
-        try:
-            root = ElementTree.fromstring(xml_string)
-        except ElementTree.ParseError:
-            return set()
-        # noinspection HttpUrlsUsage
-        # We never connect to the URL, it is just the namespace in the XML
-        namespaces = {
-            'wfs': 'http://www.opengis.net/wfs',
-        }
-        path = './/wfs:FeatureTypeList/wfs:FeatureType/wfs:Name'
-        feature_type_names = {t.text for t in root.findall(path, namespaces)}
-        return feature_type_names
+        parser = _CapabilitiesParser(IrcelineRioClient._capabilities_path)
+        parser.feed(xml_string)
+        return parser.close()
 
     @staticmethod
     def _format_result(prefix: str, data: dict, features: List[RioFeature]) -> dict:
@@ -99,45 +516,78 @@ class IrcelineRioClient(IrcelineBaseClient):
         :param features: RioFeatures wanted in the final dict
         :return: reduced dict, key is RioFeature, value is FeatureValue
         """
-        if data.get('type', None) != 'FeatureCollection' or not isinstance(data.get('features', None), list):
-            return dict()
-        features_api = data.get('features', [])
         result = dict()
-        for f in features_api:
+        for name, timestamp, value in IrcelineRioClient._iter_values(prefix, data, features):
+            if name not in result or result[name]['timestamp'] < timestamp:
+                result[name] = FeatureValue(timestamp=timestamp, value=value)
+
+        return result
+
+    @staticmethod
+    def _iter_values(prefix: str,
+                     data: dict,
+                     features: List[RioFeature]) -> Iterator[Tuple[str, datetime | date, float]]:
+        """
+        Iterate over the valid values of the wanted features in the JSON dict returned by the WFS service
+        :param prefix: namespace of the feature (e.g. rio), without the colon
+        :param data: JSON dict value as returned by the API
+        :param features: RioFeatures wanted
+        :return: iterator of (feature name, timestamp, value)
+        """
+        if data.get('type', None) != 'FeatureCollection' or not isinstance(data.get('features', None), list):
+            return
+        wanted = {f'{f}' for f in features}
+        prefix = f'{prefix}:'
+        # The same timestamps are repeated for every feature and cell: parse each of them only once
+        timestamps = dict()
+        for f in data['features']:
+            fid = f.get('id', None)
             props = f.get('properties', {})
-            if (f.get('id', None) is None or
-                    props.get('value', None) is None):
+            if fid is None or props.get('value', None) is None:
                 continue
-            if (props.get('timestamp', None) is None and
-                    props.get('date', None) is None):
+            name = prefix + fid.split('.', 1)[0]
+            if name not in wanted:
                 continue
 
-            try:
-                if 'timestamp' in props.keys():
-                    timestamp = datetime.fromisoformat(props.get('timestamp'))
-                else:
-                    # Cut last character as the date is written '2024-06-15Z' which is not ISO compliant
-                    timestamp = date.fromisoformat(props.get('date')[:-1])
-                value = float(props.get('value'))
-            except (TypeError, ValueError):
+            if 'timestamp' in props:
+                raw, is_date = props['timestamp'], False
+            else:
+                raw, is_date = props.get('date', None), True
+            if raw is None:
+                continue
+            if (raw, is_date) not in timestamps:
+                timestamps[(raw, is_date)] = _parse_timestamp(raw, is_date)
+            timestamp = timestamps[(raw, is_date)]
+            if timestamp is None:
                 continue
 
-            name = f"{prefix}:{f.get('id').split('.')[0]}"
-            if name not in [f'{f}' for f in features]:
+            try:
+                value = float(props['value'])
+            except (TypeError, ValueError):
                 continue
-            if name not in result or result[name]['timestamp'] < timestamp:
-                result[name] = FeatureValue(timestamp=timestamp, value=value)
 
-        return result
+            yield name, timestamp, value
 
 
 class IrcelineRioIfdmClient(IrcelineBaseWmsClient):
     """
     API client for RIO IFDM interpolated IRCEL - CELINE open data
-    RIO IFDM is more fine-grained for interpolation than RIO but only allows one feature to be request at a time, which
-    may be slower
+    RIO IFDM is more fine-grained for interpolation than RIO.  By default, one request is sent per feature; with
+    multi_layer=True, all the features are queried in the same request.  get_data_many downloads the values of the
+    pixels around the positions with WCS instead, see get_data_many.
     """
     _base_url = _rio_ifdm_wms_base_url
+    # Number of pixels along each side of the tiles downloaded by get_data_many
+    _tile_pixels = 64
+
+    def __init__(self, session: aiohttp.ClientSession, **kwargs) -> None:
+        """
+        :param session: aiohttp session to use for the requests
+        :param kwargs: see IrcelineBaseWmsClient
+        """
+        super().__init__(session, **kwargs)
+        # coverage name -> pixel grid of the coverage, see _parse_pixel_grids
+        self._pixel_grids: Dict[str, Tuple[Tuple[float, float], Tuple[float, float], Tuple[int, int]]] = dict()
 
     async def get_data(self,
                        features: List[RioIfdmFeature],
@@ -149,28 +599,240 @@ class IrcelineRioIfdmClient(IrcelineBaseWmsClient):
         :param position: (lat, long)
         :return: dict where key is RioIfdmFeature and value is a FeatureValue
         """
-        result = dict()
         lat, lon = position
-        base_querystring = (self._default_querystring |
-                            {"bbox": f"{lon},{lat},{lon + self._epsilon},{lat + self._epsilon}"})
+        return await self._get_position(features, f"{lon},{lat},{lon + self._epsilon},{lat + self._epsilon}")
 
-        tasks = [asyncio.create_task(self._get_single_feature(base_querystring, feature)) for feature in features]
-        results = await asyncio.gather(*tasks)
+    async def get_data_many(self,
+                            features: List[RioIfdmFeature],
+                            positions: List[Tuple[float, float]]
+                            ) -> Dict[Tuple[float, float], Dict[RioIfdmFeature, FeatureValue]]:
+        """
+        Get interpolated concentrations for the given features at many positions.  The pixel grid of the features is
+        read once with WCS DescribeCoverage.  The positions are then grouped by pixel and the pixels by tile of
+        _tile_pixels x _tile_pixels pixels: a single WCS GetCoverage request per feature and tile returns the values of
+        every pixel of the tile at the native resolution, and the positions in the same pixel share the same value.
+        The values are those of the pixels read by get_data, their timestamp is the time the response was generated
+        (Date header), as the timeStamp of the GetFeatureInfo responses.
+        :param features: pollutants to get the forecasts for
+        :param positions: list of (lat, long) or NumPy array of shape (n, 2)
+        :return: dict where key is the position (as a tuple for NumPy input) and value is a dict as returned by get_data
+            for that position
+        """
+        if hasattr(positions, 'shape'):
+            # Rows of NumPy arrays are not hashable
+            positions = [tuple(p) for p in positions.tolist()]
+        # Not rounded to the metre as epsg_transform, to find the same pixel as the server near the pixel borders
+        points = {position: _lambert72(*position) for position in positions}
+        grids = await self._get_pixel_grids(features)
 
-        for r in results:
+        result = {position: dict() for position in points}
+        tasks = list()
+        n = self._tile_pixels
+        for feature in features:
+            grid = grids.get(f'{feature}', None)
+            # tile -> {pixel: positions in the pixel}
+            tiles: Dict[Tuple[int, int], Dict[Tuple[int, int], List[Tuple[float, float]]]] = dict()
+            for position, point in points.items():
+                pixel = self._pixel(grid, point) if grid is not None else None
+                if pixel is None:
+                    result[position][feature] = FeatureValue(value=None, timestamp=None)
+                else:
+                    tiles.setdefault((pixel[0] // n, pixel[1] // n), dict()).setdefault(pixel, list()).append(position)
+            tasks.extend(asyncio.create_task(self._get_tile(feature, grid, tile, pixels))
+                         for tile, pixels in tiles.items())
+
+        for r in await asyncio.gather(*tasks):
+            for position, values in r.items():
+                result[position] |= values
+        return result
+
+    async def _get_pixel_grids(self, features: List[RioIfdmFeature]
+                               ) -> Dict[str, Tuple[Tuple[float, float], Tuple[float, float], Tuple[int, int]]]:
+        """
+        Get the pixel grids of the features, requesting those that are not known yet with a single DescribeCoverage
+        request.  The features whose grid cannot be read are reported and absent from the result.
+        :param features: features whose coverages are wanted
+        :return: dict where key is the coverage name and value is its pixel grid, see _parse_pixel_grids
+        """
+        missing = [f'{f}' for f in features if f'{f}' not in self._pixel_grids]
+        if missing:
+            querystring = {"service": "WCS",
+                           "version": "1.0.0",
+                           "request": "DescribeCoverage",
+                           "coverage": ",".join(missing)}
+            try:
+                r: ClientResponse = await self._api_wrapper(_rio_ifdm_wcs_base_url, querystring)
+                self._pixel_grids |= self._parse_pixel_grids(await r.text())
+            except (IrcelineApiError, ClientResponseError, ValueError) as e:
+                for feature in features:
+                    if f'{feature}' in missing:
+                        self._report_feature_error(feature, e)
+        return {f'{f}': self._pixel_grids[f'{f}'] for f in features if f'{f}' in self._pixel_grids}
+
+    @staticmethod
+    def _parse_pixel_grids(xml_string: str
+                           ) -> Dict[str, Tuple[Tuple[float, float], Tuple[float, float], Tuple[int, int]]]:
+        """
+        From an XML string obtained with WCS 1.0.0 DescribeCoverage, read the pixel grid of each coverage.  Raises
+        ValueError if the document is not valid XML, the coverages without a valid grid are skipped.
+        :param xml_string: XML string to parse
+        :return: dict where key is the coverage name and value is (EPSG:31370 (x, y) of the center of the pixel (0, 0),
+            (x, y) offset between two pixels, (number of columns, number of rows))
+        """
+        ns = {'wcs': 'http://www.opengis.net/wcs', 'gml': 'http://www.opengis.net/gml'}
+        try:
+            root = ElementTree.fromstring(xml_string)
+        except ElementTree.ParseError as e:
+            raise ValueError(f"Invalid DescribeCoverage document: {e}") from e
+
+        result = dict()
+        for offering in root.iterfind('wcs:CoverageOffering', ns):
+            name = offering.findtext('wcs:name', namespaces=ns)
+            grid = offering.find('.//gml:RectifiedGrid', ns)
+            if name is None or grid is None:
+                continue
+            try:
+                low = [int(v) for v in grid.findtext('gml:limits/gml:GridEnvelope/gml:low', namespaces=ns).split()]
+                high = [int(v) for v in grid.findtext('gml:limits/gml:GridEnvelope/gml:high', namespaces=ns).split()]
+                ox, oy = (float(v) for v in grid.findtext('gml:origin/gml:pos', namespaces=ns).split())
+                (dx, _), (_, dy) = ([float(v) for v in e.text.split()] for e in grid.findall('gml:offsetVector', ns))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            result[name] = ((ox, oy), (dx, dy), (high[0] - low[0] + 1, high[1] - low[1] + 1))
+        return result
+
+    @staticmethod
+    def _pixel(grid: Tuple[Tuple[float, float], Tuple[float, float], Tuple[int, int]],
+               point: Tuple[float, float]) -> Tuple[int, int] | None:
+        """
+        :return: (column, row) of the pixel of the grid containing the EPSG:31370 point or None if it is outside
+        """
+        (ox, oy), (dx, dy), (columns, rows) = grid
+        column, row = floor((point[0] - ox) / dx + .5), floor((point[1] - oy) / dy + .5)
+        if 0 <= column < columns and 0 <= row < rows:
+            return column, row
+        return None
+
+    async def _get_tile(self,
+                        feature: RioIfdmFeature,
+                        grid: Tuple[Tuple[float, float], Tuple[float, float], Tuple[int, int]],
+                        tile: Tuple[int, int],
+                        pixels: Dict[Tuple[int, int], List[Tuple[float, float]]]
+                        ) -> Dict[Tuple[float, float], Dict[RioIfdmFeature, FeatureValue]]:
+        """
+        Download the values of the pixels of a tile with WCS GetCoverage, the bbox of the request following the borders
+        of the pixels so that the server does not resample them
+        :param feature: feature to get
+        :param grid: pixel grid of the feature, see _parse_pixel_grids
+        :param tile: (column, row) of the tile
+        :param pixels: dict where key is a pixel of the tile and value is the list of the positions in that pixel
+        :return: dict where key is the position and value is a dict with the value of the feature at that position
+        """
+        (ox, oy), (dx, dy), (columns, rows) = grid
+        n = self._tile_pixels
+        c0, r0 = tile[0] * n, tile[1] * n
+        c1, r1 = min(c0 + n, columns), min(r0 + n, rows)
+        xs = (ox + (c0 - .5) * dx, ox + (c1 - .5) * dx)
+        ys = (oy + (r0 - .5) * dy, oy + (r1 - .5) * dy)
+        querystring = {"service": "WCS",
+                       "version": "1.0.0",
+                       "request": "GetCoverage",
+                       "coverage": f"{feature}",
+                       "crs": "EPSG:31370",
+                       "bbox": f"{min(xs)},{min(ys)},{max(xs)},{max(ys)}",
+                       "resx": f"{abs(dx)}",
+                       "resy": f"{abs(dy)}",
+                       "format": "ArcGrid"}
+        try:
+            r: ClientResponse = await self._api_wrapper(_rio_ifdm_wcs_base_url, querystring)
+            raster = RegularGrid.from_arcgrid(await r.text())
+        except (IrcelineApiError, ClientResponseError, ValueError) as e:
+            self._report_feature_error(feature, e)
+            return {position: {feature: FeatureValue(value=None, timestamp=None)}
+                    for positions in pixels.values() for position in positions}
+
+        timestamp = self._response_time(r)
+        result = dict()
+        for (column, row), positions in pixels.items():
+            # The nodes of the raster are in (y, x) order
+            value = raster.nearest((oy + row * dy, ox + column * dx))
+            for position in positions:
+                result[position] = {feature: FeatureValue(value=value,
+                                                          timestamp=timestamp if value is not None else None)}
+                self._mark_stale(r, result[position].values())
+        return result
+
+    @staticmethod
+    def _response_time(response) -> datetime | None:
+        """
+        :return: time the response was generated, from its Date header, or None if it has no valid Date header
+        """
+        try:
+            return parsedate_to_datetime(response.headers['Date'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    async def iter_data(self,
+                        features: List[RioIfdmFeature],
+                        position: Tuple[float, float],
+                        deadline: float | None = None
+                        ) -> AsyncIterator[Tuple[RioIfdmFeature, FeatureValue]]:
+        """
+        Get interpolated concentrations like get_data, yielding the values as soon as they are received instead of
+        waiting for all of them
+        :param features: pollutants to get the values for
+        :param position: (lat, long)
+        :param deadline: maximum time in seconds to wait for the values, the values not received in time are cancelled
+            and yielded as missing (value and timestamp None)
+        :return: async iterator of (RioIfdmFeature, FeatureValue)
+        """
+        lat, lon = position
+        tasks = self._position_tasks(features, f"{lon},{lat},{lon + self._epsilon},{lat + self._epsilon}")
+        async for key, value in self._iter_completed(tasks, {feature: feature for feature in features}, deadline):
+            yield key, value
+
+    async def _get_position(self, features: List[RioIfdmFeature], bbox: str) -> Dict[RioIfdmFeature, FeatureValue]:
+        result = dict()
+        for r in await asyncio.gather(*self._position_tasks(features, bbox)):
             result |= r
 
         return result
 
+    def _position_tasks(self, features: List[RioIfdmFeature], bbox: str) -> List[asyncio.Task]:
+        """
+        Start the tasks getting the values of the features in the bbox, each task returning a part of the dict returned
+        by get_data
+        """
+        base_querystring = self._default_querystring | {"bbox": bbox}
+
+        if self._multi_layer:
+            return [asyncio.create_task(self._get_multi_layer(base_querystring,
+                                                              features[i:i + self._max_layers_per_request]))
+                    for i in range(0, len(features), self._max_layers_per_request)]
+        return [asyncio.create_task(self._get_single_feature(base_querystring, feature)) for feature in features]
+
+    async def _get_multi_layer(self, base_querystring: dict, features: List[RioIfdmFeature]) -> dict:
+        """
+        Get the values of several features with a single GetFeatureInfo request, or with one request per feature if
+        the server does not support it
+        """
+        values = await self._get_feature_info(base_querystring, [f"{feature}" for feature in features])
+        if values is not None:
+            return dict(zip(features, values))
+
+        result = dict()
+        for r in await asyncio.gather(*[self._get_single_feature(base_querystring, feature) for feature in features]):
+            result |= r
+        return result
+
     async def _get_single_feature(self, base_querystring: dict, feature: RioIfdmFeature) -> dict:
         result = dict()
         querystring = base_querystring | {"layers": f"{feature}", "query_layers": f"{feature}"}
         try:
             r: ClientResponse = await self._api_wrapper(self._base_url, querystring)
-            r: dict = await r.json()
-            result[feature] = FeatureValue(
-                value=r.get('features', [{}])[0].get('properties', {}).get('GRAY_INDEX'),
-                timestamp=datetime.fromisoformat(r.get('timeStamp')) if 'timeStamp' in r else None)
-        except (IrcelineApiError, ClientResponseError, IndexError):
+            result[feature] = self._feature_value(await r.json(loads=json_loads), 0)
+            self._mark_stale(r, [result[feature]])
+        except (IrcelineApiError, ClientResponseError, IndexError) as e:
+            self._report_feature_error(feature, e)
             result[feature] = FeatureValue(value=None, timestamp=None)
         return result
@@ -0,0 +1,169 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple, Dict, AsyncIterator, Hashable
+
+from .api import IrcelineBaseClient, IrcelineApiError
+from .cache import _period_end
+from .data import IrcelineFeature
+from .rio import IrcelineRioClient
+
+
+class Subscription:
+    """Features and positions to prefetch with a client, see PrefetchScheduler.subscribe"""
+    __slots__ = ('client', 'features', 'positions')
+
+    def __init__(self,
+                 client: IrcelineBaseClient,
+                 features: List[IrcelineFeature],
+                 positions: List[Tuple[float, float]]) -> None:
+        self.client = client
+        self.features = features
+        self.positions = positions
+
+    def __repr__(self) -> str:
+        return f"Subscription({type(self.client).__name__}, {len(self.features)} features, " \
+               f"{len(self.positions)} positions)"
+
+
+class PrefetchScheduler:
+    """
+    Prefetch the data of a set of subscriptions right after each new publication and stream the results.
+    New RIO publications are detected by probing the timestamp of the most recent values (one small request per client
+    every poll_interval seconds, and not before the next hour is due).  For the other clients, which have no cheap way
+    to detect a publication, the data is fetched again at the start of each publication period of the client (every
+    hour for RIO IFDM, every day for the forecasts).
+    The requests are sent by the clients, with their own session, caches and limiter: subscribe clients sharing the
+    same session and RequestLimiter to bound the load on the servers.
+
+    Usage:
+        scheduler = PrefetchScheduler()
+        scheduler.subscribe(rio_client, [RioFeature.NO2_HMEAN], positions)
+        async for subscription, result in scheduler:
+            ...
+    """
+
+    def __init__(self, poll_interval: float = 60., max_concurrent: int = 4) -> None:
+        """
+        :param poll_interval: delay in seconds between two probes for a publication that is due but not yet published
+        :param max_concurrent: maximum number of subscriptions probed or prefetched at the same time
+        """
+        self._poll_interval = poll_interval
+        self._max_concurrent = max_concurrent
+        self._subscriptions: List[Subscription] = list()
+        # id of the client -> (last publication seen, time of the next probe)
+        self._publications: Dict[int, Tuple[Hashable, float]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self,
+                  client: IrcelineBaseClient,
+                  features: List[IrcelineFeature],
+                  positions: List[Tuple[float, float]]) -> Subscription:
+        """
+        Add a subscription, its data is fetched on the next iteration of the stream and after each new publication
+        :param client: client to fetch the data with
+        :param features: features to fetch
+        :param positions: list of (lat, long) to fetch the features for
+        :return: subscription, to identify the results and to unsubscribe
+        """
+        subscription = Subscription(client, list(features), list(positions))
+        self._subscriptions.append(subscription)
+        # Fetch the data of the new subscription without waiting for the next publication
+        self._publications.pop(id(client), None)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.remove(subscription)
+        if all(s.client is not subscription.client for s in self._subscriptions):
+            self._publications.pop(id(subscription.client), None)
+
+    def __aiter__(self) -> AsyncIterator[Tuple[Subscription, dict]]:
+        return self.stream()
+
+    async def stream(self) -> AsyncIterator[Tuple[Subscription, dict]]:
+        """
+        Stream the results of the subscriptions, as they are fetched after each new publication.  Errors are not
+        raised: the publication is probed or fetched again after poll_interval seconds.
+        :return: async iterator of (subscription, result), where result is a dict as returned by the get_data_many
+            method of the client: key is the position and value is the dict returned by get_data for that position
+        """
+        semaphore = asyncio.Semaphore(self._max_concurrent)
+        while True:
+            now = time.time()
+            clients = {id(s.client): s.client for s in self._subscriptions}
+            due = [c for key, c in clients.items() if self._publications.get(key, (None, 0.))[1] <= now]
+
+            updated = await asyncio.gather(*[self._probe(client, semaphore) for client in due])
+            tasks = [asyncio.create_task(self._prefetch(s, publication, semaphore))
+                     for client, publication in zip(due, updated) if publication is not None
+                     for s in self._subscriptions if s.client is client]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    subscription, result = await task
+                    if result is not None:
+                        yield subscription, result
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+            next_probe = min((p[1] for p in self._publications.values()), default=now + self._poll_interval)
+            await asyncio.sleep(max(0., min(next_probe, time.time() + self._poll_interval) - time.time()))
+
+    async def _probe(self, client: IrcelineBaseClient, semaphore: asyncio.Semaphore) -> Hashable | None:
+        """
+        Check if a new publication is available for the client and plan the next probe
+        :return: the new publication or None if the last publication seen is still the most recent one
+        """
+        now = time.time()
+        last = self._publications.get(id(client), (None, 0.))[0]
+        period = client.cache_period
+
+        if isinstance(client, IrcelineRioClient):
+            features = list(dict.fromkeys(f for s in self._subscriptions if s.client is client for f in s.features))
+            position = next((s.positions[0] for s in self._subscriptions if s.client is client and s.positions), None)
+            try:
+                async with semaphore:
+                    publication = (await client.get_latest_timestamp(features, position)
+                                   if position is not None else None)
+            except IrcelineApiError:
+                publication = None
+            if publication is None or publication == last:
+                self._publications[id(client)] = (last, now + self._poll_interval)
+                return None
+            # The next values cannot be published before the end of the next period
+            next_probe = max(now + self._poll_interval, publication.timestamp() + period)
+        else:
+            publication = _period_end(now, period)
+            if publication == last:
+                self._publications[id(client)] = (last, publication)
+                return None
+            next_probe = publication
+
+        self._publications[id(client)] = (publication, next_probe)
+        return publication
+
+    async def _prefetch(self,
+                        subscription: Subscription,
+                        publication: Hashable,
+                        semaphore: asyncio.Semaphore) -> Tuple[Subscription, dict | None]:
+        client = subscription.client
+        try:
+            async with semaphore:
+                if isinstance(publication, datetime):
+                    # Ask for the values from the publication on: the request differs from those sent before the
+                    # publication and is not served from the caches
+                    timestamp = publication + timedelta(seconds=client.cache_period)
+                    result = await client.get_data_many(subscription.features, subscription.positions, timestamp)
+                else:
+                    result = await client.get_data_many(subscription.features, subscription.positions)
+        except IrcelineApiError:
+            # Forget the publication to fetch it again on the next probe
+            self._publications[id(client)] = (None, time.time() + self._poll_interval)
+            return subscription, None
+
+        if any('stale_age' in v for values in result.values() for v in values.values()):
+            # Stale values served by the cache of the client, fetch the fresh ones again on the next probe
+            self._publications[id(client)] = (None, time.time() + self._poll_interval)
+        return subscription, result
@@ -0,0 +1,92 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Sequence, AsyncIterator
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .api import _rio_wfs_base_url, _forecast_wms_base_url, _rio_ifdm_wms_base_url, _user_agent
+from .metrics import Instrumentation
+
+# URLs requested by warm_up, one per host used by the clients
+_warm_up_urls = (_rio_wfs_base_url, _forecast_wms_base_url, _rio_ifdm_wms_base_url)
+
+
+def create_session(limit_per_host: int = 8,
+                   limit: int = 32,
+                   ttl_dns_cache: int = 300,
+                   keepalive_timeout: float = 60.,
+                   instrumentation: Instrumentation | None = None,
+                   **kwargs) -> aiohttp.ClientSession:
+    """
+    Create an aiohttp session tuned for the clients: connections are kept open between the batches of requests and the
+    DNS resolutions are cached.  The caller is responsible for closing the session, see also irceline_session.
+    Must be called from a running event loop.
+    :param limit_per_host: maximum number of connections per host, matching the default max_in_flight of
+        RequestLimiter so that the concurrent requests of a batch do not wait for a connection
+    :param limit: maximum total number of connections
+    :param ttl_dns_cache: time in seconds to keep the DNS resolutions
+    :param keepalive_timeout: time in seconds to keep an idle connection open
+    :param instrumentation: if set, its trace config is added to the session to measure the connection times
+    :param kwargs: other arguments passed to aiohttp.ClientSession
+    :return: new session
+    """
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     use_dns_cache=True,
+                                     ttl_dns_cache=ttl_dns_cache,
+                                     keepalive_timeout=keepalive_timeout)
+    if instrumentation is not None:
+        kwargs['trace_configs'] = list(kwargs.get('trace_configs', None) or []) + [instrumentation.trace_config()]
+    return aiohttp.ClientSession(connector=connector, **kwargs)
+
+
+async def warm_up(session: aiohttp.ClientSession,
+                  connections: int = 1,
+                  urls: Sequence[str] = _warm_up_urls,
+                  timeout: float = 10.) -> Dict[str, bool]:
+    """
+    Open connections to the hosts of the URLs ahead of the first requests, so that they do not pay for the DNS
+    resolution and the TCP and TLS handshakes.  A HEAD request is sent on each connection, its status is ignored.
+    :param session: session whose connection pool is filled
+    :param connections: number of connections to open per host (at most the limit per host of the session)
+    :param urls: URLs to request, only the first URL of each host is used
+    :param timeout: maximum time in seconds to wait for the connections
+    :return: dict where key is the host and value is True if all its connections could be opened
+    """
+    hosts = dict()
+    for url in urls:
+        hosts.setdefault(urlsplit(url).hostname, url)
+
+    async def head(url: str) -> bool:
+        try:
+            async with session.head(url, headers={'User-Agent': _user_agent}, allow_redirects=False,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                await r.read()
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            return False
+
+    results = await asyncio.gather(*[head(url) for url in hosts.values() for _ in range(connections)])
+    return {host: all(results[k * connections:(k + 1) * connections]) for k, host in enumerate(hosts)}
+
+
+@asynccontextmanager
+async def irceline_session(warm_up_connections: int = 0, **kwargs) -> AsyncIterator[aiohttp.ClientSession]:
+    """
+    Context manager creating a session with create_session, optionally warmed up, and closing it on exit
+
+    Usage:
+        async with irceline_session(warm_up_connections=2) as session:
+            client = IrcelineRioClient(session)
+    :param warm_up_connections: number of connections to open per host before entering the context, none if 0
+    :param kwargs: see create_session
+    :return: async context manager of the session
+    """
+    session = create_session(**kwargs)
+    try:
+        if warm_up_connections > 0:
+            await warm_up(session, warm_up_connections)
+        yield session
+    finally:
+        await session.close()
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from typing import Callable, Any, Dict, List, Collection
+from urllib.parse import urlencode
+
+import aiohttp
+from multidict import CIMultiDict
+from yarl import URL
+
+
+class _BufferedResponse:
+    """Response of which the body was already read, mimicking the reading methods of aiohttp.ClientResponse"""
+
+    def __init__(self, status: int, headers: dict, body: bytes) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # Age in seconds of the response when it is a stale response served from a cache, None otherwise
+        self.stale_age: float | None = None
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self, encoding: str | None = None) -> str:
+        return self.body.decode(encoding or 'utf-8')
+
+    async def json(self, *, encoding: str | None = None, loads: Callable[[str], Any] = json.loads, **_) -> Any:
+        return loads(self.body if encoding is None else self.body.decode(encoding))
+
+    def release(self) -> None:
+        pass
+
+
+class _TransportResponse(_BufferedResponse):
+    """
+    Buffered response returned by the transports, with the status handling methods of aiohttp.ClientResponse.  The
+    first read of the body waits for body_delay seconds, to replay the time it originally took.
+    """
+
+    def __init__(self, method: str, url: str, status: int, reason: str | None, headers: CIMultiDict, body: bytes,
+                 body_delay: float = 0.) -> None:
+        super().__init__(status, headers, body)
+        self.method = method
+        self.url = URL(url)
+        self.reason = reason
+        self._body_delay = body_delay
+
+    async def _wait(self) -> None:
+        if self._body_delay > 0:
+            delay, self._body_delay = self._body_delay, 0.
+            await asyncio.sleep(delay)
+
+    async def read(self) -> bytes:
+        await self._wait()
+        return await super().read()
+
+    async def text(self, encoding: str | None = None) -> str:
+        await self._wait()
+        return await super().text(encoding)
+
+    async def json(self, *, encoding: str | None = None, loads: Callable[[str], Any] = json.loads, **_) -> Any:
+        await self._wait()
+        return await super().json(encoding=encoding, loads=loads)
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            request_info = aiohttp.RequestInfo(self.url, self.method, CIMultiDict(), self.url)
+            raise aiohttp.ClientResponseError(request_info, (), status=self.status, message=self.reason or '',
+                                              headers=self.headers)
+
+
+def _request_key(method: str, url: str, params: dict | None, ignore_params: Collection[str] = ()) -> str:
+    """
+    :return: key identifying the request in an archive, the query string items being sorted
+    """
+    items = sorted((k, v) for k, v in (params or dict()).items() if k not in ignore_params)
+    return f"{method} {url}?{urlencode(items)}"
+
+
+class Transport(ABC):
+    """
+    Sends the requests of the clients, in place of the aiohttp session given to the clients.  The request method has
+    the signature of aiohttp.ClientSession.request, any aiohttp session is thus a transport as well.
+    """
+
+    @abstractmethod
+    async def request(self, method: str, url: str, params: dict | None = None, headers: dict | None = None,
+                      **kwargs) -> _TransportResponse:
+        """
+        Send the request
+        :param method: HTTP method
+        :param url: base URL
+        :param params: dict to build the query string
+        :param headers: headers of the request
+        :param kwargs: other arguments of aiohttp.ClientSession.request
+        :return: response, with at least the status, headers, raise_for_status, release and the reading methods of
+            aiohttp.ClientResponse
+        """
+
+
+class RecordingTransport(Transport):
+    """
+    Transport sending the requests with an aiohttp session and recording the responses (status, headers, body and
+    timings) to be saved in an archive for ReplayTransport.  The archive is a zip file holding an index of the responses
+    and their bodies, compressed and stored once per distinct body.
+
+    Usage:
+        with RecordingTransport(session, 'traffic.zip') as transport:
+            client = IrcelineRioClient(session, transport=transport)
+            ...
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, path: str | os.PathLike) -> None:
+        """
+        :param session: aiohttp session sending the requests
+        :param path: path of the archive written by save, overwritten if it exists
+        """
+        self._session = session
+        self._path = path
+        self._entries: List[dict] = list()
+        # SHA-1 of the body -> body
+        self._bodies: Dict[str, bytes] = dict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __enter__(self) -> 'RecordingTransport':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.save()
+
+    async def request(self, method: str, url: str, params: dict | None = None, headers: dict | None = None,
+                      **kwargs) -> _TransportResponse:
+        start = time.perf_counter()
+        response = await self._session.request(method=method, url=url, params=params, headers=headers, **kwargs)
+        ttfb = time.perf_counter() - start
+        body = await response.read()
+        body_time = time.perf_counter() - start - ttfb
+        response.release()
+
+        digest = hashlib.sha1(body).hexdigest()
+        self._bodies[digest] = body
+        self._entries.append({'method': method,
+                              'url': url,
+                              'params': dict(params or dict()),
+                              'status': response.status,
+                              'reason': response.reason,
+                              'headers': list(response.headers.items()),
+                              'body': digest,
+                              'ttfb': ttfb,
+                              'body_time': body_time})
+        return _TransportResponse(method, url, response.status, response.reason, CIMultiDict(response.headers), body)
+
+    def save(self) -> None:
+        """
+        Write the responses recorded so far to the archive, replacing it atomically
+        """
+        tmp = f"{os.fspath(self._path)}.tmp"
+        with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('index.json', json.dumps(self._entries))
+            for digest, body in self._bodies.items():
+                archive.writestr(f'bodies/{digest}', body)
+        os.replace(tmp, self._path)
+
+
+class ReplayTransport(Transport):
+    """
+    Transport serving the responses saved by RecordingTransport, without any network access.  The responses recorded
+    for the same request are served in their recorded order, the last one being served again once they are exhausted.
+    A request that was not recorded fails with aiohttp.ClientConnectionError, as if the host could not be reached.
+    As the query strings of the clients depend on the current time (e.g. the timestamp filter of RIO), freeze the time
+    to the time of the recording or ignore the parameters that depend on it.
+    """
+
+    def __init__(self,
+                 path: str | os.PathLike,
+                 timing: bool = False,
+                 speed: float = 1.,
+                 ignore_params: Collection[str] = ()) -> None:
+        """
+        :param path: path of the archive written by RecordingTransport
+        :param timing: if True, wait for the recorded time to first byte before returning each response and for the
+            recorded body time when its body is first read
+        :param speed: factor dividing the recorded times, e.g. 2 to replay twice faster
+        :param ignore_params: names of the query string parameters not used to match the requests
+        """
+        self._timing = timing
+        self._speed = speed
+        self._ignore_params = frozenset(ignore_params)
+        # key of the request -> [number of responses served, recorded responses]
+        self._responses: Dict[str, list] = dict()
+        with zipfile.ZipFile(path, 'r') as archive:
+            bodies = {name.split('/', 1)[1]: archive.read(name) for name in archive.namelist()
+                      if name.startswith('bodies/')}
+            for entry in json.loads(archive.read('index.json')):
+                entry['body'] = bodies[entry['body']]
+                key = _request_key(entry['method'], entry['url'], entry['params'], self._ignore_params)
+                self._responses.setdefault(key, [0, list()])[1].append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _, entries in self._responses.values())
+
+    async def request(self, method: str, url: str, params: dict | None = None, headers: dict | None = None,
+                      **kwargs) -> _TransportResponse:
+        key = _request_key(method, url, params, self._ignore_params)
+        if key not in self._responses:
+            raise aiohttp.ClientConnectionError(f"No recorded response for {key}")
+
+        served = self._responses[key]
+        entry = served[1][min(served[0], len(served[1]) - 1)]
+        served[0] += 1
+
+        if self._timing:
+            await asyncio.sleep(entry['ttfb'] / self._speed)
+        return _TransportResponse(method, url, entry['status'], entry['reason'], CIMultiDict(entry['headers']),
+                                  entry['body'], entry['body_time'] / self._speed if self._timing else 0.)
@@ -16,8 +16,10 @@ def get_mock_session(json_file=None, text_file=None):
     mock_response = Mock()
     if json_file is not None:
         mock_response.json = AsyncMock(return_value=get_api_data(json_file))
+        mock_response.read = AsyncMock(return_value=get_api_data(json_file, plain=True).encode())
     if text_file is not None:
         mock_response.text = AsyncMock(return_value=get_api_data(text_file, plain=True))
+        mock_response.read = AsyncMock(return_value=get_api_data(text_file, plain=True).encode())
 
     mock_response.status = 200
     mock_response.headers = dict()
@@ -27,3 +29,38 @@ def get_mock_session(json_file=None, text_file=None):
     mock_session.request = AsyncMock(return_value=mock_response)
     return mock_session
 
+
+
+def pixel_value(x: float, y: float) -> float:
+    # Value of the pixel centered on the EPSG:31370 point in the coverages of get_mock_wcs_session
+    return round(x) * 1000000 + round(y)
+
+
+def get_mock_wcs_session(describe_coverage='ifdm_wcs_describe_coverage.xml'):
+    """
+    Mock session answering WCS 1.0.0 DescribeCoverage with the fixture and GetCoverage with an ArcGrid of the requested
+    bbox, where the value of each pixel is given by pixel_value
+    """
+    async def request(method, url, params, headers, **_):
+        response = Mock()
+        response.status = 200
+        response.headers = {'Date': 'Sun, 30 Jun 2024 15:43:07 GMT'}
+        if params['request'] == 'DescribeCoverage':
+            text = get_api_data(describe_coverage, plain=True)
+        else:
+            min_x, min_y, max_x, max_y = (float(v) for v in params['bbox'].split(','))
+            res_x, res_y = float(params['resx']), float(params['resy'])
+            columns, rows = round((max_x - min_x) / res_x), round((max_y - min_y) / res_y)
+            lines = [f"NCOLS {columns}", f"NROWS {rows}", f"XLLCORNER {min_x}", f"YLLCORNER {min_y}",
+                     f"CELLSIZE {res_x}", "NODATA_VALUE -9999"]
+            # Rows from north to south
+            lines.extend(" ".join(f"{pixel_value(min_x + (c + .5) * res_x, max_y - (r + .5) * res_y):.0f}"
+                                  for c in range(columns)) for r in range(rows))
+            text = "\n".join(lines)
+        response.text = AsyncMock(return_value=text)
+        response.read = AsyncMock(return_value=text.encode())
+        return response
+
+    mock_session = Mock(aiohttp.ClientSession)
+    mock_session.request = AsyncMock(side_effect=request)
+    return mock_session
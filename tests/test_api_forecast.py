@@ -1,11 +1,13 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, date, timedelta
 from itertools import product
-from unittest.mock import call
+from unittest.mock import Mock, call
 
+import aiohttp
 from freezegun import freeze_time
 
 from src.open_irceline import IrcelineForecastClient, ForecastFeature, FeatureValue
-from src.open_irceline.api import _user_agent, _forecast_wms_base_url
+from src.open_irceline.api import _user_agent, _forecast_wms_base_url, _forecast_wcs_base_url, _CapabilitiesParser
 from tests.conftest import get_api_data, get_mock_session
 
 
@@ -126,3 +128,172 @@ async def test_api_forecast():
 def test_parse_capabilities_with_error():
     result = IrcelineForecastClient._parse_capabilities("wow there no valid XML")
     assert result == set()
+
+
+async def test_api_forecast_raster():
+    inside, outside, nodata = (50.4657, 4.8647), (51.2, 4.4), (50.525, 4.975)
+    session = get_mock_session(text_file='forecast_wcs_arcgrid.asc')
+
+    client = IrcelineForecastClient(session, raster=True)
+
+    features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN]
+    result = await client.get_data_many(features, [inside, outside, nodata])
+
+    calls = [call(
+        method='GET',
+        url=_forecast_wcs_base_url,
+        params={"service": "WCS",
+                "version": "1.0.0",
+                "request": "GetCoverage",
+                "coverage": f"{feature}_d{d}",
+                "crs": "EPSG:4326",
+                "bbox": "2.5,49.45,6.45,51.55",
+                "resx": "0.01",
+                "resy": "0.01",
+                "format": "ArcGrid"},
+        headers={'User-Agent': _user_agent},
+    )
+        for feature, d in product(features, range(4))]
+
+    session.request.assert_has_calls(calls, any_order=True)
+    assert session.request.call_count == 8
+    assert len(result[inside]) == 8
+
+    for k, v in result[inside].items():
+        assert v['value'] == 22.5
+        assert v['timestamp'] == k[1]
+    for k, v in list(result[outside].items()) + list(result[nodata].items()):
+        assert v['value'] is None
+
+    # Grids are kept in memory for the rest of the day
+    single = await client.get_data(features, inside)
+    assert single == result[inside]
+    assert session.request.call_count == 8
+
+
+async def test_api_forecast_raster_error():
+    session = get_mock_session(text_file='forecast_wms_capabilities.xml')
+
+    client = IrcelineForecastClient(session, raster=True)
+    result = await client.get_data([ForecastFeature.NO2_DMEAN], (50.4657, 4.8647))
+
+    for k, v in result.items():
+        assert v == FeatureValue(timestamp=None, value=None)
+
+
+def test_parse_capabilities_chunks():
+    data = get_api_data('forecast_wms_capabilities.xml', plain=True)
+    parser = _CapabilitiesParser(IrcelineForecastClient._capabilities_path)
+    for i in range(0, len(data), 100):
+        parser.feed(data[i:i + 100].encode())
+
+    assert parser.close() == IrcelineForecastClient._parse_capabilities(data)
+
+
+@freeze_time(datetime.fromisoformat("2024-06-30T13:00:21.520Z"))
+async def test_api_forecast_multi_layer():
+    pos = (50.4657, 4.8647)
+    lat, lon = pos
+    session = get_mock_session('forecast_wms_feature_info_multi.json')
+
+    client = IrcelineForecastClient(session, multi_layer=True)
+
+    features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN]
+    result = await client.get_data(features, pos)
+
+    layers = ",".join(f"{feature}_d{d}" for feature, d in product(features, range(4)))
+    session.request.assert_called_once_with(
+        method='GET',
+        url=_forecast_wms_base_url,
+        params={"service": "WMS",
+                "version": "1.1.1",
+                "request": "GetFeatureInfo",
+                "info_format": "application/json",
+                "width": "1",
+                "height": "1",
+                "srs": "EPSG:4326",
+                "bbox": f"{lon},{lat},{lon + 0.00001},{lat + 0.00001}",
+                "X": "1",
+                "Y": "1",
+                "layers": layers,
+                "query_layers": layers,
+                "feature_count": "8"},
+        headers={'User-Agent': _user_agent},
+    )
+
+    timestamp = datetime.fromisoformat("2024-06-30T13:00:21.520Z")
+    expected = [10.5, 11.5, 12.5, 13.5, 40.25, 41.25, 42.25, 43.25]
+    assert len(result) == 8
+    for ((feature, d), value) in zip(product(features, range(4)), expected):
+        assert result[(feature, date(2024, 6, 30) + timedelta(days=d))] == FeatureValue(value=value,
+                                                                                        timestamp=timestamp)
+
+
+async def test_api_forecast_multi_layer_fallback():
+    pos = (50.4657, 4.8647)
+    # The server answers with a single feature: the response cannot be split by layer
+    session = get_mock_session('forecast_wms_feature_info.json')
+
+    client = IrcelineForecastClient(session, multi_layer=True)
+
+    features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN]
+    result = await client.get_data(features, pos)
+
+    assert session.request.call_count == 1 + 8
+    assert len(result) == 8
+    for k, v in result.items():
+        assert v['value'] == 10.853286743164062
+
+    # The fallback only applies to that call: multi-layer requests are tried again
+    await client.get_data(features, pos)
+    assert session.request.call_count == 2 * (1 + 8)
+
+
+async def test_api_forecast_multi_layer_refused():
+    pos = (50.4657, 4.8647)
+    session = get_mock_session('forecast_wms_feature_info.json')
+    response = session.request.return_value
+    refused = Mock(status=400, headers=dict())
+    refused.raise_for_status = Mock(side_effect=aiohttp.ClientResponseError(Mock(), (), status=400))
+
+    async def request(**kwargs):
+        return refused if ',' in kwargs['params']['layers'] else response
+
+    session.request.side_effect = request
+    client = IrcelineForecastClient(session, multi_layer=True)
+
+    features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN]
+    result = await client.get_data(features, pos)
+
+    assert session.request.call_count == 1 + 8
+    assert all(v['value'] == 10.853286743164062 for v in result.values())
+
+    # Multi-layer requests are not tried again once the server refused them
+    await client.get_data(features, pos)
+    assert session.request.call_count == 1 + 8 + 8
+
+
+async def test_api_forecast_iter_data_deadline():
+    pos = (50.4657, 4.8647)
+    session = get_mock_session('forecast_wms_feature_info.json')
+    response = session.request.return_value
+
+    async def request(**kwargs):
+        # O3 layers are slow to answer
+        await asyncio.sleep(1 if 'o3' in kwargs['params']['layers'] else 0)
+        return response
+
+    session.request.side_effect = request
+    client = IrcelineForecastClient(session)
+
+    features = [ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN]
+    received = [item async for item in client.iter_data(features, pos, deadline=0.1)]
+
+    assert len(received) == 8
+    # The fast layers are yielded first, then the ones that missed the deadline
+    assert all(key[0] == ForecastFeature.NO2_DMEAN and value['value'] == 10.853286743164062
+               for key, value in received[:4])
+    assert all(key[0] == ForecastFeature.O3_MAXHMEAN and value == FeatureValue(value=None, timestamp=None)
+               for key, value in received[4:])
+    assert {key for key, _ in received} == set(await IrcelineForecastClient(
+        get_mock_session('forecast_wms_feature_info.json')).get_data(features, pos))
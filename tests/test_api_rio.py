@@ -1,10 +1,15 @@
+import asyncio
+from array import array
 from datetime import datetime, date
+from unittest.mock import AsyncMock, Mock
 
+import aiohttp
+import pytest
 from freezegun import freeze_time
 
-from src.open_irceline import IrcelineRioClient
+from src.open_irceline import IrcelineRioClient, RioCellCache, ResponseCache, IrcelineApiError, SqliteCache
 from src.open_irceline.api import _rio_wfs_base_url, _user_agent
-from src.open_irceline.data import RioFeature, FeatureValue
+from src.open_irceline.data import RioFeature, FeatureValue, TimeSeries
 from src.open_irceline.utils import epsg_transform
 from tests.conftest import get_api_data, get_mock_session
 
@@ -116,6 +121,38 @@ async def test_api_rio():
     )
 
 
+@freeze_time(datetime.fromisoformat("2024-06-15T16:55:03.419Z"))
+async def test_api_rio_lean():
+    pos = (50.4657, 4.8647)
+    x, y = epsg_transform(pos)
+    session = get_mock_session('rio_wfs_lean.json')
+    cell_cache = RioCellCache()
+
+    client = IrcelineRioClient(session, cell_cache=cell_cache, lean=True)
+
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    result = await client.get_data(features, pos)
+    session.request.assert_called_once_with(
+        method='GET',
+        url=_rio_wfs_base_url,
+        params={"service": "WFS",
+                "version": "1.3.0",
+                "request": "GetFeature",
+                "outputFormat": "application/json",
+                "typeName": ",".join(features),
+                "cql_filter":
+                    f"timestamp>='2024-06-15T15:00:00+00:00'"
+                    f" AND "
+                    f"INTERSECTS(the_geom, POINT ({x} {y}))",
+                "propertyName": "(value,timestamp)(value,timestamp)"},
+        headers={'User-Agent': _user_agent}
+    )
+
+    # Same values as with the full response, but the cells are unknown
+    assert result == IrcelineRioClient._format_result('rio', get_api_data('rio_wfs.json'), features)
+    assert len(cell_cache) == 0
+
+
 async def test_api_rio_get_capabilities():
     session = get_mock_session(text_file='rio_capabilities.xml')
 
@@ -130,3 +167,350 @@ async def test_api_rio_get_capabilities():
                 "request": "GetCapabilities"},
         headers={'User-Agent': _user_agent}
     )
+
+
+async def test_api_rio_many():
+    inside = [(50.4657, 4.8647), (50.4667, 4.8657)]
+    outside = (50.85, 4.35)
+    points = [epsg_transform(p) for p in inside + [outside]]
+    session = get_mock_session('rio_wfs.json')
+
+    client = IrcelineRioClient(session)
+
+    d = date(2024, 6, 18)
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    result = await client.get_data_many(features, inside + [outside], d)
+
+    multipoint = ", ".join(f"({x} {y})" for x, y in points)
+    session.request.assert_called_once_with(
+        method='GET',
+        url=_rio_wfs_base_url,
+        params={"service": "WFS",
+                "version": "1.3.0",
+                "request": "GetFeature",
+                "outputFormat": "application/json",
+                "typeName": ",".join(features),
+                "cql_filter":
+                    f"date>='2024-06-17'"
+                    f" AND "
+                    f"INTERSECTS(the_geom, MULTIPOINT ({multipoint}))"},
+        headers={'User-Agent': _user_agent}
+    )
+
+    expected = IrcelineRioClient._format_result('rio', get_api_data('rio_wfs.json'), features)
+    for p in inside:
+        assert result[p] == expected
+    assert result[outside] == dict()
+
+
+async def test_api_rio_many_numpy():
+    np = pytest.importorskip('numpy')
+    positions = [(50.4657, 4.8647), (50.4667, 4.8657)]
+    session = get_mock_session('rio_wfs.json')
+
+    client = IrcelineRioClient(session)
+    result = await client.get_data_many([RioFeature.NO2_HMEAN], np.array(positions))
+
+    assert set(result) == set(positions)
+    assert result == await client.get_data_many([RioFeature.NO2_HMEAN], positions)
+
+
+async def test_api_rio_many_chunks():
+    positions = [(50.4657 + i * 0.0001, 4.8647) for i in range(5)]
+    session = get_mock_session('rio_wfs.json')
+
+    client = IrcelineRioClient(session)
+    client._max_points_per_request = 2
+
+    result = await client.get_data_many([RioFeature.NO2_HMEAN], positions)
+
+    assert session.request.call_count == 3
+    for p in positions:
+        assert result[p][RioFeature.NO2_HMEAN]['value'] == 4
+
+
+async def test_api_rio_cell_cache():
+    session = get_mock_session('rio_wfs.json')
+
+    client = IrcelineRioClient(session, cell_cache=RioCellCache())
+
+    d = date(2024, 6, 18)
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    first = await client.get_data(features, (50.4657, 4.8647), d)
+    # Another position in the same 4x4 km cell
+    second = await client.get_data(features, (50.4667, 4.8657), d)
+    many = await client.get_data_many(features, [(50.4657, 4.8647), (50.4667, 4.8657)], d)
+
+    assert session.request.call_count == 1
+    assert first == second
+    assert all(v == first for v in many.values())
+
+    _ = await client.get_data(features, (50.4657, 4.8647), date(2024, 6, 19))
+    assert session.request.call_count == 2
+
+
+async def test_api_rio_response_cache():
+    session = get_mock_session('rio_wfs.json')
+    cache = ResponseCache()
+
+    client = IrcelineRioClient(session, cache=cache)
+
+    d = date(2024, 6, 18)
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    results = await asyncio.gather(*[client.get_data(features, (50.4657, 4.8647), d) for _ in range(3)])
+
+    assert session.request.call_count == 1
+    assert (cache.misses, cache.coalesced) == (1, 2)
+    assert all(r == IrcelineRioClient._format_result('rio', get_api_data('rio_wfs.json'), features) for r in results)
+
+
+async def test_api_rio_disk_cache(tmp_path):
+    d = date(2024, 6, 18)
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    expected = IrcelineRioClient._format_result('rio', get_api_data('rio_wfs.json'), features)
+
+    session = get_mock_session('rio_wfs.json')
+    client = IrcelineRioClient(session, disk_cache=SqliteCache(str(tmp_path / 'cache.db')))
+    assert await client.get_data(features, (50.4657, 4.8647), d) == expected
+    assert session.request.call_count == 1
+
+    # Another client (e.g. in another worker process) with its own session gets the cell from the disk, for any
+    # position inside the cell
+    other_session = get_mock_session('rio_wfs.json')
+    disk_cache = SqliteCache(str(tmp_path / 'cache.db'))
+    other = IrcelineRioClient(other_session, cache=ResponseCache(), disk_cache=disk_cache)
+    assert await other.get_data(features, (50.4657, 4.8647), d) == expected
+    assert await other.get_data(features, (50.48, 4.84), d) == expected
+    assert await other.get_data_many(features, [(50.47, 4.85), (50.4657, 4.8647)], d) == {
+        (50.47, 4.85): expected, (50.4657, 4.8647): expected}
+    assert other_session.request.call_count == 0
+    assert disk_cache.hits == 4
+    # A single entry is stored for the cell
+    assert len(disk_cache) == 1
+
+    # Other features are a different entry
+    assert await other.get_data([RioFeature.NO2_HMEAN], (50.48, 4.84), d) is not None
+    assert other_session.request.call_count == 1
+
+
+async def test_api_rio_disk_cache_after_memory(tmp_path):
+    d = date(2024, 6, 18)
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    expected = IrcelineRioClient._format_result('rio', get_api_data('rio_wfs.json'), features)
+
+    session = get_mock_session('rio_wfs.json')
+    cache, disk_cache = ResponseCache(), SqliteCache(str(tmp_path / 'cache.db'))
+    client = IrcelineRioClient(session, cache=cache, disk_cache=disk_cache)
+    for _ in range(3):
+        assert await client.get_data(features, (50.4657, 4.8647), d) == expected
+    await client.get_data_many(features, [(50.4657, 4.8647)], d)
+    await client.get_data_many(features, [(50.4657, 4.8647)], d)
+
+    # The disk cache is only read upon a miss of the in-process cache
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert (disk_cache.hits, disk_cache.misses) == (1, 1)
+    assert session.request.call_count == 1
+
+
+async def test_api_rio_many_disk_cache(tmp_path):
+    d = date(2024, 6, 18)
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    expected = IrcelineRioClient._format_result('rio', get_api_data('rio_wfs.json'), features)
+
+    session = get_mock_session('rio_wfs.json')
+    client = IrcelineRioClient(session, disk_cache=SqliteCache(str(tmp_path / 'cache.db')))
+    await client.get_data_many(features, [(50.4657, 4.8647)], d)
+    assert session.request.call_count == 1
+
+    other_session = get_mock_session('rio_wfs.json')
+    other = IrcelineRioClient(other_session, cell_cache=RioCellCache(),
+                              disk_cache=SqliteCache(str(tmp_path / 'cache.db')))
+    assert await other.get_data(features, (50.48, 4.84), d) == expected
+    assert other_session.request.call_count == 0
+    # The cell read from the disk is kept in the cell cache
+    assert len(other._cell_cache) == 1
+
+
+async def test_api_rio_get_capabilities_revalidation():
+    session = get_mock_session(text_file='rio_capabilities.xml')
+    session.request.return_value.headers = {'ETag': '"v1"', 'Last-Modified': 'Sat, 15 Jun 2024 16:00:00 GMT'}
+
+    client = IrcelineRioClient(session)
+    first = await client.get_capabilities()
+
+    session.request.return_value.status = 304
+    session.request.return_value.text = AsyncMock(return_value='')
+    second = await client.get_capabilities()
+
+    assert first == second
+    assert len(first) > 0
+    session.request.return_value.release.assert_called_once()
+    session.request.assert_called_with(
+        method='GET',
+        url=_rio_wfs_base_url,
+        params={"service": "WFS",
+                "version": "1.3.0",
+                "request": "GetCapabilities"},
+        headers={'User-Agent': _user_agent,
+                 'If-None-Match': '"v1"',
+                 'If-Modified-Since': 'Sat, 15 Jun 2024 16:00:00 GMT'}
+    )
+
+
+async def test_api_rio_timeseries():
+    pos = (50.4657, 4.8647)
+    x, y = epsg_transform(pos)
+    session = get_mock_session('rio_wfs.json')
+
+    client = IrcelineRioClient(session)
+
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    start, end = datetime.fromisoformat("2024-06-15T00:00:00Z"), datetime.fromisoformat("2024-06-16T00:00:00Z")
+    result = await client.get_timeseries(features, pos, start, end)
+
+    session.request.assert_called_once_with(
+        method='GET',
+        url=_rio_wfs_base_url,
+        params={"service": "WFS",
+                "version": "1.3.0",
+                "request": "GetFeature",
+                "outputFormat": "application/json",
+                "typeName": ",".join(features),
+                "cql_filter":
+                    f"timestamp>='2024-06-15T00:00:00+00:00' AND timestamp<'2024-06-16T00:00:00+00:00'"
+                    f" AND INTERSECTS(the_geom, POINT ({x} {y}))",
+                "sortBy": "timestamp",
+                "startIndex": "0",
+                "count": "1000"},
+        headers={'User-Agent': _user_agent}
+    )
+
+    assert set(result.keys()) == set(features)
+    assert result[RioFeature.O3_HMEAN] == TimeSeries(
+        array('q', [TimeSeries.posix_timestamp(datetime.fromisoformat("2024-06-15T15:00:00Z")),
+                    TimeSeries.posix_timestamp(datetime.fromisoformat("2024-06-15T16:00:00Z"))]),
+        array('d', [74, 71]))
+    assert result[RioFeature.O3_HMEAN].datetimes() == [datetime.fromisoformat("2024-06-15T15:00:00Z"),
+                                                       datetime.fromisoformat("2024-06-15T16:00:00Z")]
+
+
+async def test_api_rio_timeseries_chunks():
+    session = get_mock_session('rio_wfs_dmean.json')
+
+    client = IrcelineRioClient(session)
+    result = await client.get_timeseries([RioFeature.PM10_DMEAN], (50.4657, 4.8647), date(2024, 6, 1),
+                                         date(2024, 6, 16))
+
+    # 15 days in chunks of 7 days
+    assert session.request.call_count == 3
+    filters = sorted(c.kwargs['params']['cql_filter'].split(' AND INTERSECTS')[0]
+                     for c in session.request.call_args_list)
+    assert filters == ["date>='2024-06-01' AND date<'2024-06-08'",
+                       "date>='2024-06-08' AND date<'2024-06-15'",
+                       "date>='2024-06-15' AND date<'2024-06-16'"]
+    assert list(result[RioFeature.PM10_DMEAN].values) == [4.8, 5.9]
+
+
+async def test_api_rio_timeseries_pages():
+    full, empty = Mock(), Mock()
+    full.json = AsyncMock(return_value=get_api_data('rio_wfs.json'))
+    empty.json = AsyncMock(return_value={"type": "FeatureCollection", "features": []})
+    session = get_mock_session('rio_wfs.json')
+    session.request = AsyncMock(side_effect=[full, empty])
+
+    client = IrcelineRioClient(session)
+    client._page_size = 6
+    result = await client.get_timeseries([RioFeature.NO2_HMEAN], (50.4657, 4.8647),
+                                         datetime.fromisoformat("2024-06-15T00:00:00Z"),
+                                         datetime.fromisoformat("2024-06-16T00:00:00Z"))
+
+    assert [c.kwargs['params']['startIndex'] for c in session.request.call_args_list] == ['0', '6']
+    assert len(result[RioFeature.NO2_HMEAN]) == 2
+
+
+async def test_api_rio_timeseries_wrong_types():
+    client = IrcelineRioClient(get_mock_session('rio_wfs.json'))
+    with pytest.raises(IrcelineApiError):
+        await client.get_timeseries([RioFeature.NO2_HMEAN], (50.4657, 4.8647),
+                                    date(2024, 6, 15), datetime.fromisoformat("2024-06-16T00:00:00Z"))
+    with pytest.raises(IrcelineApiError):
+        await client.get_timeseries([RioFeature.NO2_HMEAN], (50.4657, 4.8647),
+                                    datetime.fromisoformat("2024-06-15T00:00:00Z"), date(2024, 6, 16))
+    with pytest.raises(IrcelineApiError):
+        await client.get_timeseries([RioFeature.NO2_HMEAN], (50.4657, 4.8647),
+                                    datetime(2024, 6, 15), datetime.fromisoformat("2024-06-16T00:00:00Z"))
+
+
+def _cell_feature(name: str, x: int, y: int, timestamp: str, value: float) -> dict:
+    return {"type": "Feature",
+            "id": f"{name}.fid",
+            "geometry": {"type": "Polygon",
+                         "coordinates": [[[x, y], [x, y + 4000], [x + 4000, y + 4000], [x + 4000, y], [x, y]]]},
+            "properties": {"timestamp": timestamp, "value": value}}
+
+
+async def test_api_rio_grid():
+    first, second = Mock(), Mock()
+    first.json = AsyncMock(return_value={"type": "FeatureCollection", "features": [
+        _cell_feature('no2_hmean', 182000, 128000, "2024-06-15T14:00:00Z", 4),
+        _cell_feature('no2_hmean', 182000, 128000, "2024-06-15T15:00:00Z", 5),
+        _cell_feature('no2_hmean', 186000, 128000, "2024-06-15T15:00:00Z", 7)]})
+    second.json = AsyncMock(return_value={"type": "FeatureCollection", "features": [
+        _cell_feature('no2_hmean', 190000, 132000, "2024-06-15T15:00:00Z", 9),
+        _cell_feature('o3_hmean', 182000, 128000, "2024-06-15T15:00:00Z", 71)]})
+    session = get_mock_session('rio_wfs.json')
+    session.request = AsyncMock(side_effect=[first, second])
+
+    client = IrcelineRioClient(session)
+    client._page_size = 3
+    result = await client.get_grid([RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN, RioFeature.PM10_HMEAN],
+                                   (50.3, 4.6, 50.6, 5.1), datetime.fromisoformat("2024-06-15T14:00:00Z"))
+
+    params = [c.kwargs['params'] for c in session.request.call_args_list]
+    assert [p['startIndex'] for p in params] == ['0', '3']
+    assert params[0]['cql_filter'].startswith("timestamp>='2024-06-15T13:00:00+00:00' AND BBOX(the_geom, ")
+    assert 'propertyName' not in params[0]
+
+    assert set(result) == {RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN}
+    timestamp, grid = result[RioFeature.NO2_HMEAN]
+    assert timestamp == datetime.fromisoformat("2024-06-15T15:00:00Z")
+    assert grid.origin == (184000, 130000)
+    assert grid.step == (4000, 4000)
+    assert grid.shape == (3, 2)
+    assert grid.nearest((184000, 130000)) == 5
+    assert grid.nearest((188000, 130000)) == 7
+    assert grid.nearest((192000, 134000)) == 9
+    assert grid.nearest((184000, 134000)) is None
+
+    positions = [(50.4657, 4.8647), (51.2, 3.2)]
+    x, y = epsg_transform(positions[0])
+    assert 182000 <= x < 186000 and 128000 <= y < 132000
+    assert IrcelineRioClient.sample_grid(grid, positions) == {positions[0]: 5, positions[1]: None}
+
+    positions.append((50.4887, 4.8761))
+    result = IrcelineRioClient.sample_grid(grid, positions, bilinear=True)
+    assert result[positions[0]] == 5
+    assert result[positions[1]] is None
+    assert 5.9 < result[positions[2]] < 6.1
+
+
+async def test_api_rio_stale_while_revalidate():
+    session = get_mock_session('rio_wfs.json')
+    client = IrcelineRioClient(session, cache=ResponseCache(max_stale=3600))
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+
+    with freeze_time("2024-06-15T16:55:00Z") as frozen:
+        fresh = await client.get_data(features, (50.4657, 4.8647))
+        assert all('stale_age' not in v for v in fresh.values())
+
+        # The next hour is requested with another time filter, the previous response is served while it is refreshed
+        frozen.move_to("2024-06-15T17:05:00Z")
+        session.request = AsyncMock(side_effect=aiohttp.ClientConnectionError())
+        stale = await client.get_data(features, (50.4657, 4.8647))
+        await asyncio.sleep(0)
+        assert session.request.call_count == 1
+        assert stale == {k: v | {'stale_age': 600} for k, v in fresh.items()}
+
+        # Other positions do not share the stale response
+        with pytest.raises(IrcelineApiError):
+            await client.get_data(features, (51.2, 3.2))
@@ -3,10 +3,10 @@ from unittest.mock import call
 
 from freezegun import freeze_time
 
-from src.open_irceline.api import _rio_ifdm_wms_base_url, _user_agent
+from src.open_irceline.api import _rio_ifdm_wms_base_url, _rio_ifdm_wcs_base_url, _user_agent
 from src.open_irceline.data import RioIfdmFeature, FeatureValue
 from src.open_irceline.rio import IrcelineRioIfdmClient
-from tests.conftest import get_api_data, get_mock_session
+from tests.conftest import get_api_data, get_mock_session, get_mock_wcs_session, pixel_value
 
 
 def test_parse_capabilities():
@@ -100,3 +100,113 @@ async def test_api_forecast_no_field():
 
     for k, v in result.items():
         assert v == FeatureValue(timestamp=None, value=None)
+
+
+async def test_api_rio_ifdm_multi_layer():
+    pos = (50.4657, 4.8647)
+    lat, lon = pos
+    session = get_mock_session('ifdm_feature_info_multi.json')
+
+    client = IrcelineRioIfdmClient(session, multi_layer=True)
+
+    features = [RioIfdmFeature.NO2_HMEAN, RioIfdmFeature.O3_HMEAN, RioIfdmFeature.PM10_HMEAN,
+                RioIfdmFeature.PM25_HMEAN]
+    result = await client.get_data(features, pos)
+
+    layers = ",".join(f"{feature}" for feature in features)
+    session.request.assert_called_once_with(
+        method='GET',
+        url=_rio_ifdm_wms_base_url,
+        params={"service": "WMS",
+                "version": "1.1.1",
+                "request": "GetFeatureInfo",
+                "info_format": "application/json",
+                "width": "1",
+                "height": "1",
+                "srs": "EPSG:4326",
+                "bbox": f"{lon},{lat},{lon + 0.00001},{lat + 0.00001}",
+                "X": "1",
+                "Y": "1",
+                "layers": layers,
+                "query_layers": layers,
+                "feature_count": "4"},
+        headers={'User-Agent': _user_agent}
+    )
+
+    timestamp = datetime.fromisoformat("2024-06-30T15:43:07.222Z")
+    assert result == {RioIfdmFeature.NO2_HMEAN: FeatureValue(value=21.5, timestamp=timestamp),
+                      RioIfdmFeature.O3_HMEAN: FeatureValue(value=84.25, timestamp=timestamp),
+                      RioIfdmFeature.PM10_HMEAN: FeatureValue(value=17.75, timestamp=timestamp),
+                      RioIfdmFeature.PM25_HMEAN: FeatureValue(value=9.5, timestamp=timestamp)}
+
+
+async def test_api_rio_ifdm_many():
+    # The first two positions are in the same pixel, the third one in another pixel of the same tile
+    positions = [(50.4657, 4.8647), (50.4656, 4.8648), (50.4662, 4.8647), (50.8512, 4.3517)]
+    session = get_mock_wcs_session()
+
+    client = IrcelineRioIfdmClient(session)
+
+    features = [RioIfdmFeature.NO2_HMEAN, RioIfdmFeature.O3_HMEAN]
+    result = await client.get_data_many(features, positions)
+
+    # One DescribeCoverage request, then one GetCoverage request per feature and tile
+    assert session.request.call_count == 1 + 2 * 2
+    describe = session.request.call_args_list[0].kwargs
+    assert describe['url'] == _rio_ifdm_wcs_base_url
+    assert describe['params'] == {"service": "WCS",
+                                  "version": "1.0.0",
+                                  "request": "DescribeCoverage",
+                                  "coverage": "rioifdm:no2_hmean,rioifdm:o3_hmean"}
+
+    # The tiles follow the borders of the 100 m pixels of the coverage
+    coverages = [c.kwargs['params'] for c in session.request.call_args_list[1:]]
+    assert {p['bbox'] for p in coverages} == {"178950.0,126450.0,185350.0,132850.0",
+                                              "146950.0,164850.0,153350.0,171250.0"}
+    assert all(p['resx'] == p['resy'] == '100.0' and p['crs'] == 'EPSG:31370' for p in coverages)
+
+    timestamp = datetime.fromisoformat("2024-06-30T15:43:07Z")
+    centers = [(185200, 128400), (185200, 128400), (185200, 128500), (148800, 171200)]
+    assert set(result) == set(positions)
+    for position, center in zip(positions, centers):
+        for feature in features:
+            assert result[position][feature] == FeatureValue(value=pixel_value(*center), timestamp=timestamp)
+
+    # The pixel grids are only requested once
+    await client.get_data_many(features, positions)
+    assert session.request.call_count == 1 + 2 * 2 + 2 * 2
+
+
+async def test_api_rio_ifdm_many_missing():
+    session = get_mock_wcs_session()
+    client = IrcelineRioIfdmClient(session)
+
+    # Outside the coverage
+    result = await client.get_data_many([RioIfdmFeature.NO2_HMEAN], [(48.5, 2.0)])
+    assert result == {(48.5, 2.0): {RioIfdmFeature.NO2_HMEAN: FeatureValue(value=None, timestamp=None)}}
+    assert session.request.call_count == 1
+
+    # The coverage is not described by the server
+    result = await client.get_data_many([RioIfdmFeature.BELAQI], [(50.4657, 4.8647)])
+    assert result == {(50.4657, 4.8647): {RioIfdmFeature.BELAQI: FeatureValue(value=None, timestamp=None)}}
+    assert session.request.call_count == 2
+
+
+def test_parse_pixel_grids():
+    grids = IrcelineRioIfdmClient._parse_pixel_grids(get_api_data('ifdm_wcs_describe_coverage.xml', plain=True))
+
+    assert set(grids) == {f'{f}' for f in RioIfdmFeature if f != RioIfdmFeature.BELAQI}
+    assert grids['rioifdm:no2_hmean'] == ((19000., 248000.), (100., -100.), (2786, 2294))
+
+
+async def test_api_rio_ifdm_iter_data():
+    pos = (50.4657, 4.8647)
+    session = get_mock_session('ifdm_interpolation_feature_info.json')
+
+    client = IrcelineRioIfdmClient(session)
+
+    features = [RioIfdmFeature.NO2_HMEAN, RioIfdmFeature.O3_HMEAN]
+    received = dict([item async for item in client.iter_data(features, pos)])
+
+    assert received == await client.get_data(features, pos)
+    assert set(received) == set(features)
@@ -0,0 +1,89 @@
+from array import array
+from datetime import datetime
+
+import pytest
+
+from src.open_irceline import IrcelineRioClient, RioFeature, FeatureTable, BelAqiIndex
+from src.open_irceline.belaqi import (belaqi_index, belaqi_index_many, belaqi_index_from_result, belaqi_index_table,
+                                      RIO_IFDM_COMPONENTS)
+from src.open_irceline.data import RioIfdmFeature, FeatureValue
+from tests.conftest import get_api_data
+
+_hmean_components = {'pm10': RioFeature.PM10_HMEAN,
+                     'pm25': RioFeature.PM25_HMEAN,
+                     'o3': RioFeature.O3_HMEAN,
+                     'no2': RioFeature.NO2_HMEAN}
+
+
+@pytest.mark.parametrize("pm10, pm25, o3, no2, expected", [
+    (0, 0, 0, 0, BelAqiIndex.EXCELLENT),
+    (5, 2.5, 30, 10, BelAqiIndex.EXCELLENT),
+    (5.1, 2.5, 30, 10, BelAqiIndex.VERY_GOOD),
+    (7.3, 3.2, 73, 3, BelAqiIndex.GOOD),
+    (10, 12, 20, 5, BelAqiIndex.MODERATE),
+    (50, 5, 20, 5, BelAqiIndex.POOR),
+    (10, 5, 170, 5, BelAqiIndex.BAD),
+    (10, 5, 20, 130, BelAqiIndex.VERY_BAD),
+    (150, 5, 20, 5, BelAqiIndex.HORRIBLE),
+])
+def test_belaqi_index(pm10, pm25, o3, no2, expected):
+    assert belaqi_index(pm10, pm25, o3, no2) == expected
+    assert list(belaqi_index_many([pm10], [pm25], [o3], [no2])) == [expected]
+
+
+def test_belaqi_index_invalid():
+    with pytest.raises(ValueError):
+        belaqi_index(None, 1, 1, 1)
+    with pytest.raises(ValueError):
+        belaqi_index(1, -1, 1, 1)
+    assert list(belaqi_index_many([None, 1, float('nan')], [1, -1, 1], [1, 1, 1], [1, 1, 1])) == [0, 0, 0]
+
+
+def test_belaqi_index_many_numpy():
+    np = pytest.importorskip('numpy')
+    pm10 = np.array([0, 5.1, 50, np.nan, 150])
+    pm25 = np.array([0, 2.5, 5, 1, 5])
+    o3 = np.array([0, 30, 20, 1, 20])
+    no2 = np.array([0, 10, 5, 1, -5])
+
+    assert list(belaqi_index_many(pm10, pm25, o3, no2)) == list(
+        belaqi_index_many(pm10.tolist(), pm25.tolist(), o3.tolist(), no2.tolist()))
+
+
+def test_belaqi_index_from_rio_result():
+    data = get_api_data('rio_wfs_for_belaqi.json')
+    result = IrcelineRioClient._format_result('rio', data, list(_hmean_components.values()))
+
+    assert belaqi_index_from_result(result, _hmean_components) == BelAqiIndex.GOOD
+    assert belaqi_index_from_result(result) is None
+
+
+def test_belaqi_index_from_rio_ifdm_result():
+    ts = datetime.fromisoformat("2024-06-23T12:00:00Z")
+    result = {RioIfdmFeature.PM10_HMEAN: FeatureValue(timestamp=ts, value=7.3),
+              RioIfdmFeature.PM25_HMEAN: FeatureValue(timestamp=ts, value=3.2),
+              RioIfdmFeature.O3_HMEAN: FeatureValue(timestamp=ts, value=73),
+              RioIfdmFeature.NO2_HMEAN: FeatureValue(timestamp=ts, value=None)}
+
+    assert belaqi_index_from_result(result, RIO_IFDM_COMPONENTS) is None
+    result[RioIfdmFeature.NO2_HMEAN] = FeatureValue(timestamp=ts, value=3)
+    assert belaqi_index_from_result(result, RIO_IFDM_COMPONENTS) == BelAqiIndex.GOOD
+
+
+def test_belaqi_index_table():
+    positions = [(50.4657, 4.8647), (50.85, 4.35)]
+    features = list(_hmean_components.values())
+    # Values for the first position at both timestamps, then for the second position, feature by feature
+    values = array('d', [7.3, 7.3, 150, 10,
+                         3.3, 3.2, 5, 5,
+                         69, 73, 20, 20,
+                         4, 3, 5, float('nan')])
+    table = FeatureTable(positions, features, [0, 3600], values)
+
+    result = belaqi_index_table(table, _hmean_components)
+
+    assert result.shape == (2, 1, 2)
+    assert result.get(positions[0], 'belaqi', 0) == BelAqiIndex.GOOD
+    assert result.get(positions[0], 'belaqi', 3600) == BelAqiIndex.GOOD
+    assert result.get(positions[1], 'belaqi', 0) == BelAqiIndex.HORRIBLE
+    assert result.get(positions[1], 'belaqi', 3600) is None
@@ -0,0 +1,209 @@
+import asyncio
+import multiprocessing
+from datetime import datetime
+from unittest.mock import AsyncMock
+
+import pytest
+from freezegun import freeze_time
+
+from src.open_irceline.cache import RioCellCache, ResponseCache, SqliteCache
+from src.open_irceline.data import RioFeature, FeatureValue
+
+_bbox = (182000, 128000, 186000, 132000)
+_value = FeatureValue(timestamp=datetime.fromisoformat("2024-06-15T16:00:00Z"), value=4)
+
+
+def test_rio_cell_cache():
+    cache = RioCellCache()
+    cache.put([RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN], 'p1', _bbox, {str(RioFeature.NO2_HMEAN): _value})
+
+    assert cache.get([RioFeature.NO2_HMEAN], 'p1', (185211, 128437)) == {str(RioFeature.NO2_HMEAN): _value}
+    # Feature requested but absent from the API response is answered as absent
+    assert cache.get([RioFeature.O3_HMEAN], 'p1', (185211, 128437)) == dict()
+    assert cache.get([RioFeature.PM10_HMEAN], 'p1', (185211, 128437)) is None
+    assert cache.get([RioFeature.NO2_HMEAN], 'p1', (181999, 128437)) is None
+    assert cache.get([RioFeature.NO2_HMEAN], 'p2', (185211, 128437)) is None
+
+
+def test_rio_cell_cache_periods():
+    cache = RioCellCache(max_periods=2)
+    for period in ['p1', 'p2', 'p3']:
+        cache.put([RioFeature.NO2_HMEAN], period, _bbox, {str(RioFeature.NO2_HMEAN): _value})
+
+    assert len(cache) == 2
+    assert cache.get([RioFeature.NO2_HMEAN], 'p1', (185211, 128437)) is None
+    assert cache.get([RioFeature.NO2_HMEAN], 'p3', (185211, 128437)) is not None
+
+
+async def test_response_cache_coalescing():
+    cache = ResponseCache()
+    fetch = AsyncMock(return_value='value')
+
+    async def slow_fetch():
+        await asyncio.sleep(0.01)
+        return await fetch()
+
+    results = await asyncio.gather(*[cache.get_or_fetch('key', 3600, slow_fetch) for _ in range(5)])
+    assert results == ['value'] * 5
+    assert fetch.call_count == 1
+    assert (cache.hits, cache.misses, cache.coalesced) == (0, 1, 4)
+
+    assert await cache.get_or_fetch('key', 3600, slow_fetch) == 'value'
+    assert (cache.hits, cache.misses, cache.coalesced) == (1, 1, 4)
+
+
+async def test_response_cache_error():
+    cache = ResponseCache()
+    fetch = AsyncMock(side_effect=[ValueError('oops'), 'value'])
+
+    with pytest.raises(ValueError):
+        await cache.get_or_fetch('key', 3600, fetch)
+    assert await cache.get_or_fetch('key', 3600, fetch) == 'value'
+    assert cache.misses == 2
+
+
+async def test_response_cache_expiration():
+    cache = ResponseCache()
+    fetch = AsyncMock(return_value='value')
+
+    with freeze_time("2024-06-15T16:10:00+02:00") as frozen:
+        await cache.get_or_fetch('key', 3600, fetch)
+        frozen.move_to("2024-06-15T16:59:59+02:00")
+        await cache.get_or_fetch('key', 3600, fetch)
+        assert fetch.call_count == 1
+        frozen.move_to("2024-06-15T17:00:01+02:00")
+        await cache.get_or_fetch('key', 3600, fetch)
+        assert fetch.call_count == 2
+
+
+async def test_response_cache_eviction():
+    cache = ResponseCache(max_entries=2)
+    for key in ['a', 'b', 'a', 'c']:
+        await cache.get_or_fetch(key, 3600, AsyncMock(return_value=key))
+
+    assert len(cache) == 2
+    assert cache.misses == 3
+    assert await cache.get_or_fetch('b', 3600, AsyncMock(return_value='new')) == 'new'
+
+
+def test_sqlite_cache(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.db'))
+    assert cache.get('key') is None
+
+    cache.put('key', 3600, 200, [('Content-Type', 'application/json')], b'{"a": 1}')
+    assert cache.get('key') == (200, [('Content-Type', 'application/json')], b'{"a": 1}')
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Another instance (e.g. in another process) sees the same entries
+    assert SqliteCache(str(tmp_path / 'cache.db')).get('key') is not None
+
+
+def test_sqlite_cache_expiration(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.db'))
+    with freeze_time(datetime.fromisoformat("2024-06-15T16:10:00Z")):
+        cache.put('key', 3600, 200, [], b'value')
+    with freeze_time(datetime.fromisoformat("2024-06-15T16:59:00Z")):
+        assert cache.get('key') is not None
+    with freeze_time(datetime.fromisoformat("2024-06-15T17:00:01Z")):
+        assert cache.get('key') is None
+
+
+def test_sqlite_cache_eviction(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.db'), max_bytes=300)
+    for k in range(5):
+        with freeze_time(datetime.fromtimestamp(1718467200 + k)):
+            cache.put(f'key{k}', 3600, 200, [], b'x' * 100)
+
+    assert len(cache) == 3
+    with freeze_time(datetime.fromtimestamp(1718467200 + 5)):
+        assert cache.get('key0') is None
+        assert cache.get('key1') is None
+        assert cache.get('key4') is not None
+
+
+def test_sqlite_cache_cells(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.db'), max_bytes=300)
+    with freeze_time(datetime.fromtimestamp(1718467200)):
+        cache.put_cells('rio', ['rio:o3_hmean', 'rio:no2_hmean'], 'p1', 3600,
+                        {(0, 0, 4000, 4000): b'a' * 100, (4000, 0, 8000, 4000): b'b' * 100})
+
+    with freeze_time(datetime.fromtimestamp(1718467201)):
+        # Any point inside a cell finds it, whatever the order of the features
+        found = cache.get_cells('rio', ['rio:no2_hmean', 'rio:o3_hmean'], 'p1', [(10, 20), (5000, 3999), (9000, 0)])
+        assert found == {(10, 20): ((0, 0, 4000, 4000), b'a' * 100), (5000, 3999): ((4000, 0, 8000, 4000), b'b' * 100)}
+        assert (cache.hits, cache.misses) == (2, 1)
+        assert cache.get_cells('rio', ['rio:no2_hmean'], 'p1', [(10, 20)]) == dict()
+        assert cache.get_cells('rio', ['rio:no2_hmean', 'rio:o3_hmean'], 'p2', [(10, 20)]) == dict()
+
+    # The cells and the responses share the size limit
+    with freeze_time(datetime.fromtimestamp(1718467202)):
+        cache.put('key', 3600, 200, [], b'x' * 150)
+    assert len(cache) == 2
+    with freeze_time(datetime.fromtimestamp(1718467203)):
+        assert len(cache.get_cells('rio', ['rio:no2_hmean', 'rio:o3_hmean'], 'p1', [(10, 20), (5000, 20)])) == 1
+        assert cache.get('key') is not None
+
+
+def _write_entries(path: str, prefix: str) -> None:
+    cache = SqliteCache(path)
+    for k in range(50):
+        cache.put(f'{prefix}{k}', 3600, 200, [], b'value')
+
+
+def test_sqlite_cache_processes(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    SqliteCache(path).put('key', 3600, 200, [], b'value')
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_write_entries, args=(path, f'p{n}-')) for n in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+
+    assert len(SqliteCache(path)) == 4 * 50 + 1
+
+
+async def test_response_cache_stale():
+    cache = ResponseCache(max_stale=600)
+    refreshed = asyncio.Event()
+
+    async def refresh():
+        await refreshed.wait()
+        return 'new'
+
+    with freeze_time("2024-06-15T16:50:00+02:00") as frozen:
+        assert await cache.get_or_fetch_stale('key', 3600, AsyncMock(return_value='old')) == ('old', None)
+
+        # Served right away while the refresh is in flight
+        frozen.move_to("2024-06-15T17:00:00+02:00")
+        assert await cache.get_or_fetch_stale('key', 3600, refresh) == ('old', 600)
+        assert await cache.get_or_fetch_stale('key', 3600, refresh) == ('old', 600)
+        assert cache.stale == 2
+        assert cache.coalesced == 1
+
+        refreshed.set()
+        await asyncio.sleep(0)
+        assert await cache.get_or_fetch_stale('key', 3600, refresh) == ('new', None)
+
+        # Stale values are kept max_stale seconds after their expiration, whatever the refresh outcome
+        frozen.move_to("2024-06-15T18:05:00+02:00")
+        fetch = AsyncMock(side_effect=ValueError('oops'))
+        assert await cache.get_or_fetch_stale('key', 3600, fetch) == ('new', 3900)
+        frozen.move_to("2024-06-15T18:15:00+02:00")
+        with pytest.raises(ValueError):
+            await cache.get_or_fetch_stale('key', 3600, fetch)
+
+
+async def test_response_cache_stale_key():
+    cache = ResponseCache(max_stale=600)
+    with freeze_time("2024-06-15T16:50:00+02:00") as frozen:
+        await cache.get_or_fetch_stale('key-16h', 3600, AsyncMock(return_value='old'), 'key')
+        frozen.move_to("2024-06-15T17:00:00+02:00")
+        assert await cache.get_or_fetch_stale('key-17h', 3600, AsyncMock(return_value='new'), 'key') == ('old', 600)
+        # Without max_stale, nothing is kept after the expiration
+        cache = ResponseCache()
+        await cache.get_or_fetch_stale('key', 3600, AsyncMock(return_value='old'))
+        frozen.move_to("2024-06-15T18:00:00+02:00")
+        assert await cache.get_or_fetch_stale('key', 3600, AsyncMock(return_value='new')) == ('new', None)
@@ -0,0 +1,92 @@
+from array import array
+from datetime import datetime, date
+
+import pytest
+
+from src.open_irceline.data import FeatureTable, FeatureValue, TimeSeries, RioFeature, ForecastFeature
+
+_t0 = datetime.fromisoformat("2024-06-15T15:00:00Z")
+_t1 = datetime.fromisoformat("2024-06-15T16:00:00Z")
+_p0, _p1 = (50.4657, 4.8647), (50.85, 4.35)
+
+
+def _rio_results() -> dict:
+    return {
+        _p0: {RioFeature.NO2_HMEAN: FeatureValue(timestamp=_t1, value=4),
+              RioFeature.O3_HMEAN: FeatureValue(timestamp=_t0, value=71)},
+        _p1: {RioFeature.NO2_HMEAN: FeatureValue(timestamp=_t1, value=12),
+              RioFeature.O3_HMEAN: FeatureValue(timestamp=None, value=None)},
+    }
+
+
+def test_time_series():
+    series = TimeSeries(array('q', [TimeSeries.posix_timestamp(_t0)]), array('d', [4]))
+
+    assert len(series) == 1
+    assert series.datetimes() == [_t0]
+    assert TimeSeries.posix_timestamp(date(2024, 6, 15)) == TimeSeries.posix_timestamp(
+        datetime.fromisoformat("2024-06-15T00:00:00Z"))
+
+
+def test_feature_table_from_results():
+    table = FeatureTable.from_results(_rio_results())
+
+    assert table.shape == (2, 2, 2)
+    assert table.get(_p0, RioFeature.NO2_HMEAN, _t1) == 4
+    assert table.get(_p0, RioFeature.NO2_HMEAN, _t0) is None
+    assert table.get(_p0, RioFeature.O3_HMEAN, _t0) == 71
+    assert table.get(_p1, RioFeature.NO2_HMEAN, TimeSeries.posix_timestamp(_t1)) == 12
+    assert table.get(_p1, RioFeature.O3_HMEAN, _t1) is None
+    with pytest.raises(KeyError):
+        table.get((0, 0), RioFeature.O3_HMEAN, _t1)
+
+
+def test_feature_table_from_forecast_results():
+    results = {_p0: {(ForecastFeature.PM10_DMEAN, date(2024, 6, 15)): FeatureValue(timestamp=_t0, value=10.5),
+                     (ForecastFeature.PM10_DMEAN, date(2024, 6, 16)): FeatureValue(timestamp=_t0, value=12.5)}}
+    table = FeatureTable.from_results(results)
+
+    assert table.shape == (1, 1, 2)
+    assert table.get(_p0, ForecastFeature.PM10_DMEAN, date(2024, 6, 16)) == 12.5
+
+
+def test_feature_table_from_timeseries():
+    series = {_p0: {RioFeature.NO2_HMEAN: TimeSeries(array('q', [TimeSeries.posix_timestamp(_t0),
+                                                                 TimeSeries.posix_timestamp(_t1)]),
+                                                     array('d', [3, 4]))},
+              _p1: {RioFeature.O3_HMEAN: TimeSeries(array('q', [TimeSeries.posix_timestamp(_t1)]),
+                                                    array('d', [70]))}}
+    table = FeatureTable.from_timeseries(series)
+
+    assert table.shape == (2, 2, 2)
+    assert table.get(_p0, RioFeature.NO2_HMEAN, _t0) == 3
+    assert table.get(_p1, RioFeature.O3_HMEAN, _t1) == 70
+    assert table.get(_p1, RioFeature.NO2_HMEAN, _t1) is None
+
+
+def test_feature_table_to_numpy():
+    np = pytest.importorskip('numpy')
+    table = FeatureTable.from_results(_rio_results())
+    values, timestamps = table.to_numpy()
+
+    assert values.shape == (2, 2, 2)
+    assert values[0, 0, 1] == 4
+    assert values[1, 0, 1] == 12
+    assert values[0, 1, 0] == 71
+    assert timestamps[1] == np.datetime64('2024-06-15T16:00:00')
+    # Zero copy: changes to the table are visible in the NumPy array
+    table.set(_p1, RioFeature.O3_HMEAN, _t1, 80)
+    assert values[1, 1, 1] == 80
+
+
+def test_feature_table_to_arrow():
+    pytest.importorskip('pyarrow')
+    table = FeatureTable.from_results(_rio_results())
+    batch = table.to_arrow()
+
+    assert batch.num_rows == 4
+    assert batch.column_names == ['position', 'timestamp', 'rio:no2_hmean', 'rio:o3_hmean']
+    assert batch.column('position').to_pylist() == [0, 0, 1, 1]
+    assert batch.column('rio:no2_hmean').to_pylist() == [None, 4, None, 12]
+    assert batch.column('rio:o3_hmean').to_pylist() == [71, None, None, None]
+    assert batch.column('rio:o3_hmean').null_count == 3
@@ -0,0 +1,90 @@
+from array import array
+from math import isnan
+
+import pytest
+
+from src.open_irceline.grid import RegularGrid
+from tests.conftest import get_api_data
+
+
+def test_from_arcgrid():
+    grid = RegularGrid.from_arcgrid(get_api_data('forecast_wcs_arcgrid.asc', plain=True))
+
+    assert grid.shape == (3, 4)
+    assert grid.origin == pytest.approx((50.425, 4.825))
+    assert grid.step == (0.05, 0.05)
+    assert grid.nearest((50.425, 4.825)) == 11.5
+    assert grid.nearest((50.4657, 4.8647)) == 22.5
+    assert grid.nearest((50.525, 4.925)) == 33.5
+    assert grid.nearest((50.525, 4.975)) is None
+    assert grid.nearest((51.2, 4.4)) is None
+
+
+def test_from_arcgrid_invalid():
+    with pytest.raises(ValueError):
+        RegularGrid.from_arcgrid("wow there no valid grid")
+    with pytest.raises(ValueError):
+        RegularGrid.from_arcgrid("ncols 2\nnrows 2\nxllcorner 0\nyllcorner 0\ncellsize 1\n1 2\n3")
+
+
+def test_regular_grid_size():
+    with pytest.raises(ValueError):
+        RegularGrid((0, 0), (1, 1), (2, 2), array('d', [1, 2, 3]))
+    assert RegularGrid((0, 0), (1, 1), (2, 2)).nearest((1, 1)) is None
+
+
+def test_from_csv():
+    grid = RegularGrid.from_csv(get_api_data('forecast.csv', plain=True))
+
+    assert grid.shape == (39, 2)
+    assert grid.origin == (49.7, 4.8)
+    assert grid.step == (0.05, 0.05)
+    assert grid.nearest((51.3, 4.8)) == 20.0029
+    assert grid.nearest((51.31, 4.81)) == 20.0029
+    assert grid.nearest((50.0, 4.85)) == 5.2708
+    assert grid.nearest((51.5, 4.8)) is None
+    assert grid.nearest((52.0, 4.8)) is None
+
+
+def test_from_csv_off_grid():
+    text = "1;50.0;4.8;1\n2;50.05;4.8;2\n3;50.1;4.8;3\n"
+    assert RegularGrid.from_csv(text).shape == (3, 1)
+    assert RegularGrid.from_csv(text, step=(0.025, 0.05)).shape == (5, 1)
+
+    # A slightly-off line does not silently shrink the step
+    with pytest.raises(ValueError):
+        RegularGrid.from_csv(text + "4;50.101;4.8;4\n")
+    with pytest.raises(ValueError):
+        RegularGrid.from_csv(text, step=(0.04, 0.05))
+
+
+def test_bilinear():
+    grid = RegularGrid.from_csv(get_api_data('forecast.csv', plain=True))
+
+    assert grid.bilinear((51.3, 4.8)) == pytest.approx(20.0029)
+    assert grid.bilinear((51.275, 4.8)) == pytest.approx((20.2708 + 20.0029) / 2)
+    # Missing nodes at lon 4.85 are ignored
+    assert grid.bilinear((51.275, 4.825)) == pytest.approx((20.2708 + 20.0029) / 2)
+    assert grid.bilinear((50.825, 4.85)) == pytest.approx((18.2584 + 18.8555) / 2)
+    assert grid.bilinear((52.0, 4.8)) is None
+
+
+def test_many():
+    grid = RegularGrid.from_csv(get_api_data('forecast.csv', plain=True))
+    positions = [(51.3, 4.8), (51.275, 4.825), (50.0, 4.85), (51.5, 4.8), (52.0, 4.8)]
+
+    nearest = [None if isnan(v) else v for v in grid.nearest_many(positions)]
+    bilinear = [None if isnan(v) else v for v in grid.bilinear_many(positions)]
+    assert nearest == [grid.nearest(p) for p in positions]
+    assert bilinear == [grid.bilinear(p) for p in positions]
+
+
+def test_many_numpy():
+    np = pytest.importorskip('numpy')
+    grid = RegularGrid.from_csv(get_api_data('forecast.csv', plain=True))
+    positions = [(51.3, 4.8), (51.275, 4.825), (50.0, 4.85), (51.5, 4.8), (52.0, 4.8), (50.825, 4.85)]
+
+    assert np.allclose(grid.nearest_many(np.array(positions)), np.array(grid.nearest_many(positions)),
+                       equal_nan=True)
+    assert np.allclose(grid.bilinear_many(np.array(positions)), np.array(grid.bilinear_many(positions)),
+                       equal_nan=True)
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from unittest.mock import Mock, AsyncMock
+
+import aiohttp
+import pytest
+from freezegun import freeze_time
+
+from src.open_irceline import IrcelineRioClient, IrcelineApiError, RioFeature
+from src.open_irceline.limiter import RequestLimiter, CircuitBreaker
+from tests.conftest import get_api_data
+
+
+async def test_max_in_flight():
+    limiter = RequestLimiter(max_in_flight=2)
+    in_flight, peak = 0, 0
+
+    async def request(url):
+        nonlocal in_flight, peak
+        async with limiter.slot(url):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*[request('https://geo.irceline.be/wfs') for _ in range(6)],
+                         *[request('https://geobelair.irceline.be/rioifdm/wms') for _ in range(6)])
+    # Two hosts, two requests in flight for each
+    assert peak == 4
+
+
+async def test_rate():
+    limiter = RequestLimiter(rate=100, burst=2)
+
+    start = time.monotonic()
+    for _ in range(6):
+        async with limiter.slot('https://geo.irceline.be/wfs'):
+            pass
+    # Two requests in the burst, then one request every 10 ms
+    assert time.monotonic() - start >= 0.035
+
+
+def test_retry_delay():
+    limiter = RequestLimiter(backoff=1, max_backoff=5)
+
+    assert 0 <= limiter.retry_delay(0) <= 1
+    assert 0 <= limiter.retry_delay(10) <= 5
+    assert limiter.retry_delay(0, '3') >= 3
+    assert limiter.retry_delay(0, '3600') == 5
+    assert 0 <= limiter.retry_delay(0, 'Wed, 21 Oct 2015 07:28:00 GMT') <= 1
+
+
+def _response(status: int) -> Mock:
+    response = Mock()
+    response.status = status
+    response.headers = dict()
+    response.json = AsyncMock(return_value=get_api_data('rio_wfs.json'))
+    if status >= 400:
+        response.raise_for_status = Mock(side_effect=aiohttp.ClientResponseError(Mock(), (), status=status))
+    return response
+
+
+async def test_api_retry():
+    session = Mock(aiohttp.ClientSession)
+    session.request = AsyncMock(side_effect=[_response(503), _response(429), _response(200)])
+
+    client = IrcelineRioClient(session, limiter=RequestLimiter(backoff=0.001))
+    result = await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+
+    assert session.request.call_count == 3
+    assert result[RioFeature.NO2_HMEAN]['value'] == 4
+
+
+async def test_api_retry_exhausted():
+    session = Mock(aiohttp.ClientSession)
+    session.request = AsyncMock(side_effect=[_response(503), _response(503), _response(503)])
+
+    client = IrcelineRioClient(session, limiter=RequestLimiter(max_retries=2, backoff=0.001))
+    with pytest.raises(IrcelineApiError):
+        await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+    assert session.request.call_count == 3
+
+    session.request = AsyncMock(side_effect=[_response(404)])
+    with pytest.raises(IrcelineApiError):
+        await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+    assert session.request.call_count == 1
+
+
+def test_circuit_breaker():
+    url = 'https://geo.irceline.be/wfs'
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    with freeze_time("2024-06-15T16:00:00Z") as frozen:
+        breaker.record_failure(url)
+        assert breaker.allow(url)
+        breaker.record_failure(url)
+        assert breaker.is_open(url)
+        assert not breaker.allow(url)
+        # Other endpoints are not affected
+        assert breaker.allow('https://geo.irceline.be/forecast/wms')
+
+        # A single probe every reset_timeout seconds
+        frozen.tick(31)
+        assert breaker.allow(url)
+        assert not breaker.allow(url)
+        breaker.record_failure(url)
+        frozen.tick(31)
+        assert breaker.allow(url)
+        breaker.record_success(url)
+        assert not breaker.is_open(url)
+        assert breaker.allow(url)
+
+
+async def test_api_circuit_breaker():
+    session = Mock(aiohttp.ClientSession)
+    session.request = AsyncMock(side_effect=aiohttp.ClientConnectionError())
+    client = IrcelineRioClient(session, breaker=CircuitBreaker(failure_threshold=2))
+
+    for _ in range(3):
+        with pytest.raises(IrcelineApiError):
+            await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+    assert session.request.call_count == 2
+
+    # Responses with a 4xx status do not open the circuit
+    session.request = AsyncMock(side_effect=[_response(404)] * 3)
+    client = IrcelineRioClient(session, breaker=CircuitBreaker(failure_threshold=2))
+    for _ in range(3):
+        with pytest.raises(IrcelineApiError):
+            await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+    assert session.request.call_count == 3
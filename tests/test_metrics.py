@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+from unittest.mock import Mock, AsyncMock
+
+import aiohttp
+import pytest
+
+from src.open_irceline import (IrcelineRioClient, IrcelineForecastClient, IrcelineApiError, RioFeature, ForecastFeature,
+                               MetricsCollector, RequestRecord, Instrumentation, RequestLimiter)
+from src.open_irceline.api import _rio_wfs_base_url
+from src.open_irceline.metrics import Histogram
+from tests.conftest import get_mock_session, get_api_data
+
+
+def test_histogram():
+    histogram = Histogram((1., 2., 5., 10.))
+    assert histogram.quantile(.5) is None
+
+    for v in (0.5, 1.5, 1.5, 3, 4, 7, 20):
+        histogram.observe(v)
+
+    assert histogram.count == 7
+    assert histogram.sum == 37.5
+    assert histogram.min == 0.5
+    assert histogram.max == 20
+    assert histogram.counts == [1, 2, 2, 1, 1]
+    assert 2 <= histogram.quantile(.5) <= 5
+    assert histogram.quantile(1) == 20
+    assert histogram.quantile(0) == 0.5
+
+
+async def test_collector_request():
+    session = get_mock_session('rio_wfs.json')
+    collector = MetricsCollector()
+    client = IrcelineRioClient(session, instrumentation=collector)
+
+    await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+
+    _, kwargs = session.request.call_args
+    assert isinstance(kwargs['trace_request_ctx'], RequestRecord)
+
+    endpoint = 'geo.irceline.be/wfs'
+    assert collector.requests == {(endpoint, 200): 1}
+    summary = collector.summary()[endpoint]
+    assert set(summary) == {'wait', 'ttfb', 'body', 'parse', 'size', 'retries'}
+    assert summary['size']['sum'] == len(get_api_data('rio_wfs.json', plain=True).encode())
+    assert summary['retries']['max'] == 0
+
+
+async def test_collector_retries_and_errors():
+    throttled = Mock(status=503, headers={'Retry-After': '0'})
+    failed = Mock(status=503, headers=dict())
+    failed.raise_for_status = Mock(side_effect=aiohttp.ClientResponseError(Mock(), (), status=503))
+
+    session = Mock(aiohttp.ClientSession)
+    session.request = AsyncMock(side_effect=[throttled, failed])
+    collector = MetricsCollector()
+    client = IrcelineRioClient(session, limiter=RequestLimiter(max_retries=1, backoff=0), instrumentation=collector)
+
+    with pytest.raises(IrcelineApiError):
+        await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+
+    endpoint = 'geo.irceline.be/wfs'
+    assert collector.requests == {(endpoint, 'ClientResponseError'): 1}
+    assert collector.histograms[('retries', endpoint)].max == 1
+
+
+async def test_collector_feature_errors():
+    session = Mock(aiohttp.ClientSession)
+    session.request = AsyncMock(side_effect=aiohttp.ClientConnectionError())
+    collector = MetricsCollector()
+    client = IrcelineForecastClient(session, instrumentation=collector)
+
+    result = await client.get_data([ForecastFeature.NO2_DMEAN, ForecastFeature.O3_MAXHMEAN], (50.45, 4.85))
+
+    assert all(v['value'] is None for v in result.values())
+    assert collector.feature_errors == {('IrcelineForecastClient', f'{ForecastFeature.NO2_DMEAN}'): 4,
+                                        ('IrcelineForecastClient', f'{ForecastFeature.O3_MAXHMEAN}'): 4}
+    assert collector.requests == {('geo.irceline.be/forecast/wms', 'ClientConnectionError'): 8}
+
+
+async def test_trace_config_connect():
+    trace_config = Instrumentation().trace_config()
+    record = RequestRecord('GET', _rio_wfs_base_url)
+    ctx = SimpleNamespace(trace_request_ctx=record)
+
+    for callback in trace_config.on_connection_create_start:
+        await callback(None, ctx, None)
+    for callback in trace_config.on_connection_create_end:
+        await callback(None, ctx, None)
+
+    assert record.connect is not None and record.connect >= 0
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import Mock, AsyncMock
+
+import aiohttp
+import pytest
+
+from src.open_irceline import IrcelineRioClient, IrcelineRioIfdmClient, RioFeature, RioIfdmFeature
+from src.open_irceline.scheduler import PrefetchScheduler
+from tests.conftest import get_mock_session, get_mock_wcs_session, pixel_value
+
+
+async def test_scheduler_rio():
+    session = get_mock_session('rio_wfs.json')
+    client = IrcelineRioClient(session)
+    scheduler = PrefetchScheduler(poll_interval=0.01)
+
+    positions = [(50.4657, 4.8647), (50.85, 4.35)]
+    subscription = scheduler.subscribe(client, [RioFeature.NO2_HMEAN], positions)
+    stream = aiter(scheduler)
+
+    received, result = await anext(stream)
+    assert received is subscription
+    assert set(result) == set(positions)
+    assert result[positions[0]][RioFeature.NO2_HMEAN]['timestamp'] == datetime.fromisoformat("2024-06-15T16:00:00Z")
+    # One probe and one request for both positions, asking for the values from the probed timestamp on
+    assert session.request.call_count == 2
+    assert "timestamp>='2024-06-15T16:00:00+00:00'" in session.request.call_args.kwargs['params']['cql_filter']
+
+    # Same timestamp on the next probes: nothing new is fetched
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(anext(stream), 0.05)
+    probes = session.request.call_count - 2
+    assert probes >= 2
+    assert all('MULTIPOINT' not in c.kwargs['params']['cql_filter'] for c in session.request.call_args_list[2:])
+    await stream.aclose()
+
+
+async def test_scheduler_rio_probe_error():
+    session = Mock(aiohttp.ClientSession)
+    session.request = AsyncMock(side_effect=aiohttp.ClientConnectionError())
+    client = IrcelineRioClient(session)
+    scheduler = PrefetchScheduler(poll_interval=0.01)
+    scheduler.subscribe(client, [RioFeature.NO2_HMEAN], [(50.4657, 4.8647)])
+
+    stream = aiter(scheduler)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(anext(stream), 0.05)
+    # The probe is retried after poll_interval
+    assert 2 <= session.request.call_count <= 10
+    await stream.aclose()
+
+
+async def test_scheduler_period():
+    session = get_mock_wcs_session()
+    client = IrcelineRioIfdmClient(session)
+    scheduler = PrefetchScheduler(poll_interval=0.01)
+
+    features = [RioIfdmFeature.NO2_HMEAN, RioIfdmFeature.O3_HMEAN, RioIfdmFeature.PM10_HMEAN,
+                RioIfdmFeature.PM25_HMEAN]
+    first = scheduler.subscribe(client, features, [(50.4657, 4.8647)])
+    second = scheduler.subscribe(client, features, [(50.8512, 4.3517)])
+    assert len(scheduler) == 2
+
+    stream = aiter(scheduler)
+    results = dict([await anext(stream), await anext(stream)])
+    assert set(results) == {first, second}
+    assert results[first][(50.4657, 4.8647)][RioIfdmFeature.O3_HMEAN]['value'] == pixel_value(185200, 128400)
+    requests = session.request.call_count
+
+    # The data is only fetched again in the next hour
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(anext(stream), 0.05)
+    assert session.request.call_count == requests
+
+    scheduler.unsubscribe(first)
+    scheduler.unsubscribe(second)
+    assert len(scheduler) == 0
+    await stream.aclose()
@@ -0,0 +1,52 @@
+import aiohttp
+from aiohttp import web
+
+from src.open_irceline import create_session, irceline_session, warm_up, MetricsCollector
+
+
+async def _start_server(peers: set) -> web.AppRunner:
+    async def handler(request: web.Request) -> web.Response:
+        peers.add(request.transport.get_extra_info('peername'))
+        return web.Response(status=400, text='Bad request')
+
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner
+
+
+async def test_create_session():
+    session = create_session(limit_per_host=4, ttl_dns_cache=60, instrumentation=MetricsCollector())
+    try:
+        connector = session.connector
+        assert isinstance(connector, aiohttp.TCPConnector)
+        assert connector.limit_per_host == 4
+        assert connector.use_dns_cache
+        assert len(session.trace_configs) == 1
+    finally:
+        await session.close()
+
+
+async def test_warm_up():
+    peers = set()
+    runner = await _start_server(peers)
+    port = runner.addresses[0][1]
+    try:
+        async with irceline_session() as session:
+            urls = [f'http://127.0.0.1:{port}/wfs', f'http://127.0.0.1:{port}/forecast/wms']
+            result = await warm_up(session, 3, urls)
+            assert result == {'127.0.0.1': True}
+            assert len(peers) == 3
+
+            # The next requests reuse the connections opened by the warm-up
+            async with session.get(f'http://127.0.0.1:{port}/wfs') as r:
+                await r.read()
+            assert len(peers) == 3
+        assert session.closed
+    finally:
+        await runner.cleanup()
+
+    async with irceline_session() as session:
+        assert await warm_up(session, 1, [f'http://127.0.0.1:{port}/wfs'], timeout=1) == {'127.0.0.1': False}
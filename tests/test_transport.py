@@ -0,0 +1,78 @@
+import asyncio
+import time
+from datetime import datetime
+from unittest.mock import Mock, AsyncMock
+
+import aiohttp
+import pytest
+from freezegun import freeze_time
+
+from src.open_irceline import (IrcelineRioClient, IrcelineForecastClient, IrcelineApiError, RioFeature,
+                               ForecastFeature, RecordingTransport, ReplayTransport, MetricsCollector)
+from tests.conftest import get_mock_session
+
+
+def _recording_session(fixture: str, delay: float = 0.) -> aiohttp.ClientSession:
+    session = get_mock_session(fixture)
+    response = session.request.return_value
+    response.reason = 'OK'
+
+    async def request(**_):
+        await asyncio.sleep(delay)
+        return response
+
+    session.request = AsyncMock(side_effect=request)
+    return session
+
+
+@freeze_time(datetime.fromisoformat("2024-06-15T16:55:03.419Z"))
+async def test_record_replay(tmp_path):
+    path = tmp_path / 'traffic.zip'
+    features = [RioFeature.NO2_HMEAN, RioFeature.O3_HMEAN]
+    positions = [(50.4657, 4.8647), (50.85, 4.35)]
+
+    session = _recording_session('rio_wfs.json')
+    with RecordingTransport(session, path) as transport:
+        client = IrcelineRioClient(session, transport=transport)
+        expected = [await client.get_data(features, position) for position in positions]
+    assert len(transport) == 2
+
+    transport = ReplayTransport(path)
+    assert len(transport) == 2
+    client = IrcelineRioClient(None, transport=transport, instrumentation=MetricsCollector())
+    assert [await client.get_data(features, position) for position in positions] == expected
+
+    with pytest.raises(IrcelineApiError):
+        await client.get_data(features, (51.2, 3.2))
+
+
+async def test_replay_error_status(tmp_path):
+    path = tmp_path / 'traffic.zip'
+    session = Mock(aiohttp.ClientSession)
+    failed = Mock(status=503, reason='Service Unavailable', headers={'Retry-After': '0'})
+    failed.read = AsyncMock(return_value=b'')
+    session.request = AsyncMock(return_value=failed)
+
+    with RecordingTransport(session, path) as transport:
+        client = IrcelineForecastClient(session, transport=transport)
+        result = await client.get_data([ForecastFeature.NO2_DMEAN], (50.45, 4.85))
+    assert all(v['value'] is None for v in result.values())
+    assert len(transport) == 4
+
+    client = IrcelineForecastClient(None, transport=ReplayTransport(path))
+    result = await client.get_data([ForecastFeature.NO2_DMEAN], (50.45, 4.85))
+    assert all(v['value'] is None for v in result.values())
+
+
+async def test_replay_timing(tmp_path):
+    path = tmp_path / 'traffic.zip'
+    session = _recording_session('rio_wfs.json', delay=.05)
+    with RecordingTransport(session, path) as transport:
+        await IrcelineRioClient(session, transport=transport).get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+
+    for timing, fast in ((False, True), (True, False)):
+        client = IrcelineRioClient(None, transport=ReplayTransport(path, timing=timing, ignore_params=['cql_filter']))
+        start = time.perf_counter()
+        result = await client.get_data([RioFeature.NO2_HMEAN], (50.4657, 4.8647))
+        assert (time.perf_counter() - start < .05) == fast
+        assert result[RioFeature.NO2_HMEAN]['value'] is not None
@@ -1,7 +1,63 @@
-from src.open_irceline.utils import epsg_transform
+import random
+import subprocess
+import sys
+
+import pytest
+
+from src.open_irceline.utils import epsg_transform, epsg_transform_many, geometry_bbox, CellIndex, _lambert72, \
+    epsg_transform_pyproj
 
 
 def test_epsg_transform():
     x, y = epsg_transform((50.4657, 4.8647))
     assert x == 185211
     assert y == 128437
+
+
+def test_geometry_bbox():
+    geometry = {"type": "Polygon",
+                "coordinates": [[[182000, 128000], [182000, 132000], [186000, 132000], [186000, 128000],
+                                 [182000, 128000]]]}
+    assert geometry_bbox(geometry) == (182000, 128000, 186000, 132000)
+    assert geometry_bbox(None) is None
+    assert geometry_bbox({"type": "Polygon", "coordinates": []}) is None
+
+
+def test_cell_index():
+    index = CellIndex()
+    index.add((182000, 128000, 186000, 132000), 'a')
+    index.add((186000, 128000, 190000, 132000), 'b')
+    index.add((100, 100, 100, 100), 'c')
+
+    assert len(index) == 3
+    assert index.find((185211, 128437)) == 'a'
+    assert index.find((186500, 131999)) == 'b'
+    assert index.find((100, 100)) == 'c'
+    assert index.find((0, 0)) is None
+
+
+def test_epsg_transform_many():
+    positions = [(50.4657, 4.8647), (50.85, 4.35), (51.2194, 4.4025)]
+    assert epsg_transform_many(positions) == [epsg_transform(p) for p in positions]
+    assert epsg_transform_many([]) == []
+
+
+def test_lambert72_matches_pyproj():
+    pytest.importorskip('pyproj')
+    rng = random.Random(42)
+    positions = [(rng.uniform(49.4, 51.6), rng.uniform(2.4, 6.5)) for _ in range(1000)]
+
+    for (x, y), (ref_x, ref_y) in zip([_lambert72(*p) for p in positions], epsg_transform_pyproj(positions)):
+        assert abs(x - ref_x) < 1e-6
+        assert abs(y - ref_y) < 1e-6
+
+
+def test_epsg_transform_many_numpy():
+    np = pytest.importorskip('numpy')
+    positions = [(50.4657, 4.8647), (50.85, 4.35), (51.2194, 4.4025)]
+    assert epsg_transform_many(np.array(positions)) == [epsg_transform(p) for p in positions]
+
+
+def test_import_without_pyproj():
+    code = "import sys, src.open_irceline; assert 'pyproj' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], check=True)